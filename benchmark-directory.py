@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Comparison of the directory fetch strategies (fetch threads, fetch profiles) offline and reproducibly: the directory is loaded
+# from MOLGENIS REST responses recorded by data-check.py --record-molgenis (see molgenistransport.py), replayed with the given
+# per-request latency and bandwidth, with an empty directory cache (in a temporary directory) for each combination.
+
+import argparse
+import json
+import logging as log
+import tempfile
+import time
+
+from directory import Directory
+import caches
+import molgenistransport
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose information on progress of the directory loading')
+parser.add_argument('-d', '--debug', dest='debug', action='store_true', help='debug information on progress of the directory loading')
+parser.add_argument('recording', help='directory with the MOLGENIS responses recorded using data-check.py --record-molgenis')
+parser.add_argument('-P', '--package', dest='package', default='eu_bbmri_eric', help='MOLGENIS Package that contains the data (default eu_bbmri_eric).')
+parser.add_argument('--directory-url', dest='directoryURL', default='https://directory-backend.molgenis.net/', help='URL of the MOLGENIS server the responses were recorded from (default https://directory-backend.molgenis.net/)')
+parser.add_argument('--fetch-threads', dest='fetchThreads', nargs='+', type=int, default=[1, 5], help='numbers of fetch threads to be compared (default 1 5)')
+parser.add_argument('--profiles', dest='profiles', nargs='+', default=['full'], help='fetch profiles to be compared (default full)')
+parser.add_argument('--latency', dest='latencies', nargs='+', type=float, default=[0.0, 0.1], help='latencies added to each request in seconds (default 0 0.1)')
+parser.add_argument('--bandwidth', dest='bandwidth', type=float, help='bandwidth of each response in bytes per second (default unlimited)')
+parser.add_argument('--repeat', dest='repeat', type=int, default=1, help='number of runs of each combination, the fastest one is reported (default 1)')
+parser.add_argument('-o', '--output', dest='output', help='write the results as JSON into the file provided as parameter')
+args = parser.parse_args()
+
+if args.debug:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.DEBUG)
+elif args.verbose:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.INFO)
+else:
+    log.basicConfig(format="%(levelname)s: %(message)s")
+
+results = []
+print('%-10s %8s %8s %10s %12s %10s' % ('profile', 'threads', 'latency', 'requests', 'bytes', 'wall [s]'))
+for profile in args.profiles:
+    for latency in args.latencies:
+        for fetchThreads in args.fetchThreads:
+            wall = None
+            for i in range(args.repeat):
+                with tempfile.TemporaryDirectory(prefix='benchmark-directory-') as cacheRoot:
+                    caches.cacheRoot = cacheRoot
+                    transport = molgenistransport.ReplayTransport(args.recording, latency, args.bandwidth)
+                    start_time = time.perf_counter()
+                    Directory(package=args.package, directoryURL=args.directoryURL, profile=profile, fetchThreads=fetchThreads, transport=transport)
+                    runWall = time.perf_counter() - start_time
+                wall = runWall if wall is None else min(wall, runWall)
+            result = { 'profile' : profile, 'fetchThreads' : fetchThreads, 'latency' : latency, 'bandwidth' : args.bandwidth, 'requests' : transport.statistics.requests, 'bytes' : transport.statistics.bytes, 'wall' : wall }
+            results.append(result)
+            print('%-10s %8d %8.3f %10d %12d %10.3f' % (profile, fetchThreads, latency, result['requests'], result['bytes'], wall))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({ 'recording' : args.recording, 'package' : args.package, 'repeat' : args.repeat, 'results' : results }, f, indent=2)
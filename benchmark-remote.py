@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Throughput of the remote checks (CheckURLs, ContactFields, BiobankGeo) under injected latency, measured against the local
+# stand-in services (see standins.py) instead of the real ones: for each latency, each check is run on the directory with empty
+# remote check caches (in a temporary directory) and the wall time and the number of remote items resolved per second are reported.
+
+import argparse
+import json
+import logging as log
+import os.path
+import pprint
+import tempfile
+import time
+
+from yapsy.PluginManager import PluginManager
+import validate_email
+
+from directory import Directory
+import caches
+import offlinegeocoder
+import standins
+
+# the remote checks assert that they are known to the main script
+remoteCheckList = ['emails', 'geocoding', 'URLs']
+# check -> cache namespace whose misses are the remote items resolved by the check
+remoteChecks = {
+        'CheckURLs' : 'URLs',
+        'ContactFields' : 'emails',
+        'BiobankGeo' : 'geolocator',
+        }
+
+pp = pprint.PrettyPrinter(indent=4)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose information on progress of the checks')
+parser.add_argument('-d', '--debug', dest='debug', action='store_true', help='debug information on progress of the checks')
+parser.add_argument('-P', '--package', dest='package', default='eu_bbmri_eric', help='MOLGENIS Package that contains the data (default eu_bbmri_eric).')
+parser.add_argument('--directory-url', dest='directoryURL', default='https://directory-backend.molgenis.net/', help='URL of the MOLGENIS server with the Directory (default https://directory-backend.molgenis.net/)')
+parser.add_argument('--snapshot', dest='snapshot', help='load the directory from a local snapshot directory with JSON or EMX entity files instead of MOLGENIS')
+parser.add_argument('--checks', dest='checks', nargs='+', choices=list(remoteChecks), default=list(remoteChecks), help='checks to be measured (default all the remote ones)')
+parser.add_argument('--latency', dest='latencies', nargs='+', type=float, default=[0.0, 0.05, 0.2], help='latencies of the stand-in services in seconds, each measured separately (default 0 0.05 0.2)')
+parser.add_argument('--jitter', dest='jitter', type=float, default=0.0, help='maximum random latency added to each response in seconds (default 0)')
+parser.add_argument('--error-rate', dest='errorRate', type=float, default=0.0, help='fraction of the URLs answering 404 and of the email domains without MX record (default 0)')
+parser.add_argument('--reset-rate', dest='resetRate', type=float, default=0.0, help='fraction of the URLs whose connections are reset (default 0)')
+parser.add_argument('--geocoding-boundaries', dest='geocodingBoundaries', help='country boundaries (GeoJSON, or shapefile if pyshp is installed) used by the stand-in Nominatim to answer the country of a location (otherwise it answers with the country of the first biobank)')
+parser.add_argument('-o', '--output', dest='output', help='write the results as JSON into the file provided as parameter')
+args = parser.parse_args()
+
+if args.debug:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.DEBUG)
+elif args.verbose:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.INFO)
+else:
+    log.basicConfig(format="%(levelname)s: %(message)s")
+
+simplePluginManager = PluginManager()
+simplePluginManager.setPluginPlaces(["checks"])
+simplePluginManager.collectPlugins()
+plugins = { os.path.basename(p.path) : p for p in simplePluginManager.getAllPlugins() }
+
+dir = Directory(package=args.package, pp=pp, snapshot=args.snapshot, directoryURL=args.directoryURL)
+log.info('Total biobanks: ' + str(dir.getBiobanksCount()))
+log.info('Total collections: ' + str(dir.getCollectionsCount()))
+
+geocoder = offlinegeocoder.OfflineReverseGeocoder.load(args.geocodingBoundaries) if args.geocodingBoundaries is not None else None
+# without the boundaries, the stand-in Nominatim answers with the country of the first biobank, so that most of the locations pass
+defaultCountry = dir.getBiobanks()[0]['country']['id'] if dir.getBiobanksCount() > 0 else None
+
+results = []
+print('%-15s %8s %8s %10s %10s %10s' % ('check', 'latency', 'items', 'wall [s]', 'items/s', 'requests'))
+for latency in args.latencies:
+    behavior = standins.Behavior(200, latency, args.jitter)
+    HTTP = standins.HTTPStandIn(behavior)
+    HTTP.addFraction(args.errorRate, standins.Behavior(404, latency, args.jitter))
+    HTTP.addFraction(args.resetRate, standins.Behavior(latency=latency, jitter=args.jitter, reset=True))
+    MX = standins.MXStandIn(standins.Behavior('ok', latency, args.jitter))
+    MX.addFraction(args.errorRate, standins.Behavior('nomx', latency, args.jitter))
+    nominatim = standins.NominatimStandIn(behavior, geocoder=geocoder, defaultCountry=defaultCountry)
+    standInOf = { 'CheckURLs' : HTTP, 'ContactFields' : MX, 'BiobankGeo' : nominatim }
+    with HTTP, MX, nominatim:
+        for check in args.checks:
+            # the caches (including the journals of the remote checks) are kept apart from the ones of data-check.py and empty
+            # for each run, so that all the items are resolved using the stand-ins
+            with tempfile.TemporaryDirectory(prefix='benchmark-remote-') as cacheRoot:
+                caches.cacheRoot = cacheRoot
+                caches.takeStatistics()
+                validate_email.MX_DNS_CACHE.clear()
+                validate_email.MX_CHECK_CACHE.clear()
+                checkArgs = argparse.Namespace(disableChecksRemote=[], purgeCaches=[], URLRefreshBudget=None, geocodingGrid=None, geocodingBoundaries=None, geocodingBorderMargin=None,
+                        URLConnectTo=HTTP.endpoint(), MXResolver=MX.endpoint(), nominatimURL=nominatim.endpoint())
+                requestsBefore = standInOf[check].requests
+                start_time = time.perf_counter()
+                warnings = plugins[check].plugin_object.check(dir, checkArgs)
+                wall = time.perf_counter() - start_time
+                items = caches.takeStatistics().get(caches.scopedNamespace(remoteChecks[check], standInOf[check].endpoint()), {}).get('misses', 0)
+            result = { 'check' : check, 'latency' : latency, 'items' : items, 'wall' : wall, 'itemsPerSecond' : items / wall if wall > 0 else None, 'requests' : standInOf[check].requests - requestsBefore, 'warnings' : len(warnings) }
+            results.append(result)
+            print('%-15s %8.3f %8d %10.3f %10.1f %10d' % (check, latency, items, wall, result['itemsPerSecond'] or 0, result['requests']))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({ 'package' : args.package, 'jitter' : args.jitter, 'errorRate' : args.errorRate, 'resetRate' : args.resetRate, 'results' : results }, f, indent=2)
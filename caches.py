@@ -0,0 +1,144 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Caches of the directory data and of the results of the checks, all stored under data-check-cache/<namespace> as diskcache
+# caches with the expiry (TTL) and size limit policies below. Lookups (reported by the users via recordLookup()) and writes
+# are counted per namespace, so that data-check.py can print the cache efficiency summary of the run.
+
+import hashlib
+import logging as log
+import os
+import threading
+
+from diskcache import Cache
+
+import profiling
+
+cacheRoot = 'data-check-cache'
+
+MiB = 2**20
+
+# namespace (first path component without the scope, see scopedNamespace()) -> (TTL of the entries in seconds or None, maximum size in bytes); the least recently stored
+# entries are evicted once the maximum size is exceeded
+policies = {
+        'directory' : (None, 4096*MiB),
+        'checks' : (None, 1024*MiB),
+        # expiry of the URL check results is handled by CheckURLs, since expired results are kept until they are refreshed
+        'URLs' : (None, 256*MiB),
+        # ContactFields sets the expiry of each domain depending on the result
+        'emails' : (7*24*3600, 64*MiB),
+        'geolocator' : (365*24*3600, 1024*MiB),
+        # remote work items left unchecked (see remotework.Journal)
+        'journal' : (None, 64*MiB),
+        }
+defaultPolicy = (None, 1024*MiB)
+
+__statistics = {}
+__statisticsLock = threading.Lock()
+
+
+def policy(namespace : str):
+    return policies.get(namespace.split('/')[0].split('@')[0], defaultPolicy)
+
+def scopedNamespace(namespace : str, scope : str = None) -> str:
+    # namespace of the cache kept apart for the scope (e.g., the endpoint of a stand-in replacing the remote service), with the policy of
+    # the namespace; the namespace itself if there is no scope
+    if not scope:
+        return namespace
+    return namespace + '@' + hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]
+
+def __counters(namespace : str) -> dict:
+    return __statistics.setdefault(namespace, { 'hits' : 0, 'misses' : 0, 'writes' : 0 })
+
+def count(namespace : str, counter : str, n : int = 1):
+    with __statisticsLock:
+        __counters(namespace)[counter] += n
+
+
+class ManagedCache(Cache):
+
+    def __init__(self, namespace : str):
+        (self.ttl, sizeLimit) = policy(namespace)
+        self.namespace = namespace
+        super().__init__(os.path.join(cacheRoot, namespace), size_limit=sizeLimit)
+
+    def set(self, key, value, expire=None, read=False, tag=None, retry=False):
+        # entries get the TTL of the namespace unless a particular expiry is given
+        count(self.namespace, 'writes')
+        return super().set(key, value, expire=self.ttl if expire is None else expire, read=read, tag=tag, retry=retry)
+
+    def recordLookup(self, hit : bool, n : int = 1):
+        # to be called by the users for the logical lookups (i.e., not for the bookkeeping entries), n lookups with the same result at once
+        count(self.namespace, 'hits' if hit else 'misses', n)
+        profiling.countCacheLookup(hit, n)
+
+
+def openCache(namespace : str, purge : bool = False) -> ManagedCache:
+    cache = ManagedCache(namespace)
+    if purge:
+        log.debug('Purging cache ' + namespace)
+        cache.clear()
+    return cache
+
+def purgeVariants(namespace : str):
+    # clears the cache of the namespace and the ones nested in it (e.g., the directory caches of the particular servers and packages) or
+    # scoped from it (see scopedNamespace()), so that purging a cache by its name purges all of its variants
+    for variant in namespaces():
+        if variant == namespace or variant.startswith(namespace + '/') or variant.startswith(namespace + '@'):
+            log.debug('Purging cache ' + variant)
+            with ManagedCache(variant) as cache:
+                cache.clear()
+
+def removeCache(namespace : str) -> bool:
+    # removes the cache database of the namespace itself, keeping the caches nested in it (used for the caches left by the former
+    # layouts, e.g., the un-namespaced directory cache), returns whether there was a cache to remove
+    path = os.path.join(cacheRoot, namespace)
+    if not os.path.exists(os.path.join(path, 'cache.db')):
+        return False
+    with Cache(path) as cache:
+        cache.clear()
+    for name in ['cache.db', 'cache.db-wal', 'cache.db-shm']:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    return True
+
+def takeStatistics() -> dict:
+    # returns the counters collected so far and resets them (used to pass the counters from the forked processes)
+    with __statisticsLock:
+        statistics = { namespace : dict(counters) for (namespace, counters) in __statistics.items() }
+        __statistics.clear()
+    return statistics
+
+def mergeStatistics(statistics : dict):
+    with __statisticsLock:
+        for (namespace, counters) in statistics.items():
+            for (counter, n) in counters.items():
+                __counters(namespace)[counter] += n
+
+def namespaces() -> list:
+    # namespaces of the caches existing on disk
+    found = []
+    for (path, dirs, files) in os.walk(cacheRoot):
+        if 'cache.db' in files:
+            found.append(os.path.relpath(path, cacheRoot).replace(os.sep, '/'))
+    return sorted(found)
+
+def compact(namespace : str) -> int:
+    # removes the expired entries, evicts the entries over the size limit and vacuums the database, returns the bytes reclaimed
+    with ManagedCache(namespace) as cache:
+        volume = cache.volume()
+        cache.expire()
+        cache.cull()
+        cache.check(fix=True)
+        return volume - cache.volume()
+
+def summary(namespaces : list = None) -> list:
+    # (namespace, hits, misses, hit ratio, writes, entries, bytes on disk) for the namespaces used in the run (or the ones given)
+    with __statisticsLock:
+        statistics = { namespace : dict(counters) for (namespace, counters) in __statistics.items() }
+    rows = []
+    for namespace in sorted(statistics if namespaces is None else namespaces):
+        counters = statistics.get(namespace, { 'hits' : 0, 'misses' : 0, 'writes' : 0 })
+        lookups = counters['hits'] + counters['misses']
+        with ManagedCache(namespace) as cache:
+            rows.append((namespace, counters['hits'], counters['misses'], counters['hits'] / lookups if lookups > 0 else None, counters['writes'], len(cache), cache.volume()))
+    return rows
@@ -13,7 +13,7 @@ BBMRICohortsDNANetworkName = 'bbmri-eric:networkID:EU_BBMRI-ERIC:networks:BBMRI-
 
 def compareFactsColl(self, dir, factsList, collList, collection, errorDescription, actionDescription, warningsList): # TO improve
 	if factsList != [] and py_collections.Counter(factsList) != py_collections.Counter(collList):
-		warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, errorDescription + f" - collection information: {sorted(collList)} - fact information: {sorted(factsList)}", actionDescription, collection['contact']['email']))
+		warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, errorDescription + f" - collection information: {sorted(collList)} - fact information: {sorted(factsList)}", actionDescription, dir.getCollectionFeatures(collection['id']).contactEmail))
 
 def compareAge(self, dir, factAges : set, factsAgeUnits : set, collection, warningsList):
 	# NOTE assuming that collection age units uppercase and singular match with facts age units lowercase and plural (at least with years, YEAR, months, MONTH works)
@@ -25,7 +25,7 @@ def compareAge(self, dir, factAges : set, factsAgeUnits : set, collection, warni
 		{i.lower() + 's' for i in collUnits}
 		collUnitsAdapt = {i.lower() + 's' for i in collUnits}
 	if sorted(collUnitsAdapt) != sorted(factsAgeUnits):
-		warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Age unit ID of the collection is {collection['age_unit']} while the age unit in the fact table is {factsAgeUnits}", "Check age unit information of the collection description with age units from the facts table and correct as necessary", collection['contact']['email']))
+		warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Age unit ID of the collection is {collection['age_unit']} while the age unit in the fact table is {factsAgeUnits}", "Check age unit information of the collection description with age units from the facts table and correct as necessary", dir.getCollectionFeatures(collection['id']).contactEmail))
 	else:
 		# Comparison of numbers
 		# TODO, NOTE: not sure what happens when there is more than 1 age unit i.e.: month and year
@@ -34,9 +34,9 @@ def compareAge(self, dir, factAges : set, factsAgeUnits : set, collection, warni
 		# check if any of age groups is outside of min-max range of the collection:
 		try:
 			if (minFactAge < collection['age_low']) or (maxFactAge > collection['age_high']):
-				warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Fact table age outside collection age_high age_low range", "Check age range of the collection description with ages from the facts table and correct as necessary", collection['contact']['email'])) #TODO: explain it better
+				warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Fact table age outside collection age_high age_low range", "Check age range of the collection description with ages from the facts table and correct as necessary", dir.getCollectionFeatures(collection['id']).contactEmail)) #TODO: explain it better
 			if (collection['age_low'] < minFactAge) or (collection['age_high'] > maxFactAge):
-				warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Collection ages outside facts age range", "Check age information of the collection description with age ranges from the facts table and correct as necessary", collection['contact']['email'])) #TODO: explain it better
+				warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Collection ages outside facts age range", "Check age information of the collection description with age ranges from the facts table and correct as necessary", dir.getCollectionFeatures(collection['id']).contactEmail)) #TODO: explain it better
 		except KeyError as e:
 			log.info(f"Incomplete age range information for {collection['id']}: " + str(e) + " missing")
 
@@ -62,7 +62,7 @@ def checkCollabBB(self, dir, collection : dict, biobank : dict, warningsList):
 			return
 
 	# If we got here, the previous checks failed
-	warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection and biobank are not available for commercial collaboration modes: collection[commercial_use] is {formatAttribute('commercial_use', collection)}, biobank[collaboration_commercial] is {formatAttribute('collaboration_commercial', biobank)}", "Check if this is true (that both are false): if so, remove the networks BBMRI Cohorts/BBMRI Cohorts DNA , otherwise correct the value of commercial availibility", collection['contact']['email']))
+	warningsList.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection and biobank are not available for commercial collaboration modes: collection[commercial_use] is {formatAttribute('commercial_use', collection)}, biobank[collaboration_commercial] is {formatAttribute('collaboration_commercial', biobank)}", "Check if this is true (that both are false): if so, remove the networks BBMRI Cohorts/BBMRI Cohorts DNA , otherwise correct the value of commercial availibility", dir.getCollectionFeatures(collection['id']).contactEmail))
 
 
 class BBMRICohorts(IPlugin):
@@ -81,78 +81,47 @@ class BBMRICohorts(IPlugin):
 			ages = set()
 			ageUnits = set()
 
-			biobankId = dir.getCollectionBiobankId(collection['id'])
-			biobank = dir.getBiobankById(biobankId)
-			biobank_capabilities = []
-			if 'capabilities' in biobank:
-				for c in biobank['capabilities']:
-					biobank_capabilities.append(c['id'])
-			biobank_networks = []
-			if 'network' in biobank:
-				for n in biobank['network']:
-					biobank_networks.append(n['id'])
-			collection_networks = []
-			if 'network' in collection:
-				for n in collection['network']:
-					collection_networks.append(n['id'])
+			features = dir.getCollectionFeatures(collection['id'])
+			biobank = dir.getBiobankById(features.biobankId)
+			biobankFeatures = dir.getBiobankFeatures(features.biobankId)
+			biobank_capabilities = biobankFeatures.capabilities
+			biobank_networks = biobankFeatures.networks
+			collection_networks = features.networks
 
 			if BBMRICohortsNetworkName in collection_networks or BBMRICohortsDNANetworkName in collection_networks:
-				OoM = collection['order_of_magnitude']['id']
-
-				materials = []
-				if 'materials' in collection:
-					for m in collection['materials']:
-						materials.append(m['id'])
-				
-				data_categories = []
-				if 'data_categories' in collection:
-					for c in collection['data_categories']:
-						data_categories.append(c['id'])
-
-				types = []
-				if 'type' in collection:
-					for t in collection['type']:
-						types.append(t['id'])
-							
-				diags = []
-				diag_ranges = []
-
-				for d in collection['diagnosis_available']:
-					if re.search('-', d['id']):
-						diag_ranges.append(d['id'])
-					else:
-						diags.append(d['id'])
-
-				collSex = set()
-				for s in collection['sex']:
-						collSex.add(s['id'])
+				OoM = features.OoM
+				materials = features.materials
+				data_categories = features.data_categories
+				types = features.types
+				diags = features.diagnosisCodes
+				diag_ranges = features.diagnosisRanges
+				collSex = set(features.sex)
 
 				# Check commercial use
 				checkCollabBB(self, dir, collection, biobank, warnings)
 
 				# Check presence of fact tables
 				if collection['facts'] != []:
-					for fact in dir.getFacts():
-						if fact['collection']['id'] == collection['id']:
-							collectionFacts.append(fact) # We collect here all the facts for a given collection (maybe not needed)
-							if 'disease' in fact:
-								collFactsDiseases.add(fact['disease']['id']) # Collect all diagnoses from facts
-							if 'age_range' in fact:
-								ages.update(re.findall(r'\d+', fact['age_range']['label']))
-								ageUnits.update(re.findall(r'\((?:\d+-\d+\s)?(.*?)\)', fact['age_range']['label']))
-								# Deal with >80
-								if '>80 years' in ageUnits:
-									# Remove the old value
-									ageUnits.remove('>80 years')
-									# Add the new value
-									ageUnits.add('years')
-								#collFactsAgeGroups.add(fact['age_range']['id'])
-							if 'sex' in fact:
-								collFactsSexGroups.add(fact['sex']['id'])
-							if 'sample_type' in fact:
-								collFactsMaterialTypes.add(fact['sample_type']['id'])
-							if 'number_of_samples' in fact:
-								collsFactsSamples += fact['number_of_samples']
+					for fact in dir.getCollectionFacts(collection['id']):
+						collectionFacts.append(fact) # We collect here all the facts for a given collection (maybe not needed)
+						if 'disease' in fact:
+							collFactsDiseases.add(fact['disease']['id']) # Collect all diagnoses from facts
+						if 'age_range' in fact:
+							ages.update(re.findall(r'\d+', fact['age_range']['label']))
+							ageUnits.update(re.findall(r'\((?:\d+-\d+\s)?(.*?)\)', fact['age_range']['label']))
+							# Deal with >80
+							if '>80 years' in ageUnits:
+								# Remove the old value
+								ageUnits.remove('>80 years')
+								# Add the new value
+								ageUnits.add('years')
+							#collFactsAgeGroups.add(fact['age_range']['id'])
+						if 'sex' in fact:
+							collFactsSexGroups.add(fact['sex']['id'])
+						if 'sample_type' in fact:
+							collFactsMaterialTypes.add(fact['sample_type']['id'])
+						if 'number_of_samples' in fact:
+							collsFactsSamples += fact['number_of_samples']
 					if collsFactsSamples > 0:
 						if BBMRICohortsNetworkName in collection_networks or BBMRICohortsDNANetworkName in collection_networks:
 							log.info(f"Hooooray, we have found BBMRI Cohorts collection with the fact table populated: {collection['id']}")
@@ -176,46 +145,41 @@ class BBMRICohorts(IPlugin):
 
 						if 'size' in collection:
 							if not isinstance(collection['size'], int):
-								warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Collection size attribute (number of samples) is not an integer", collection['contact']['email']))
+								warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Collection size attribute (number of samples) is not an integer", features.contactEmail))
 							# check that the total numbers of samples is matching total number of samples in the fact table (donor's are not aggregable)
 							if collsFactsSamples < collection['size']:
-									warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Value of the collection size attribute (number of samples - {collection['size']}) is greater than the total number of samples in facts table ({collsFactsSamples}) - maybe false positive due to anonymization", "Check size information of the collection description with the cummulated number from the facts table and correct as necessary", collection['contact']['email']))
+									warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Value of the collection size attribute (number of samples - {collection['size']}) is greater than the total number of samples in facts table ({collsFactsSamples}) - maybe false positive due to anonymization", "Check size information of the collection description with the cummulated number from the facts table and correct as necessary", features.contactEmail))
 							elif collsFactsSamples > collection['size']:
-									warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Value of the collection size attribute (number of samples - {collection['size']}) is smaller than the total number of samples in facts table ({collsFactsSamples})", "Check size information of the collection description with the cummulated number from the facts table and correct as necessary", collection['contact']['email']))
+									warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, f"Value of the collection size attribute (number of samples - {collection['size']}) is smaller than the total number of samples in facts table ({collsFactsSamples})", "Check size information of the collection description with the cummulated number from the facts table and correct as necessary", features.contactEmail))
 						else:
-							warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, "Collection size attribute (number of samples) not provided", "Add size attribute to the collection", collection['contact']['email']))
+							warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, "Collection size attribute (number of samples) not provided", "Add size attribute to the collection", features.contactEmail))
 
 						# check that if the DNA network, the fact table contains liquid materials from which DNA can be extracted (DNA, Peripheral blood cells, Whole Blood)
 						if 'network' in collection:
 							if BBMRICohortsDNANetworkName in collection_networks:
 								requiredMaterialTypes = ['DNA','WHOLE_BLOOD','PERIPHERAL_BLOOD_CELLS','BUFFY_COAT','CDNA','PLASMA','SERUM']
 								if not any(mat in collFactsMaterialTypes for mat in requiredMaterialTypes):
-									warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in {BBMRICohortsDNANetworkName} but the fact table does not contain any of the expected material types: {','.join(requiredMaterialTypes)})", collection['contact']['email']))
+									warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in {BBMRICohortsDNANetworkName} but the fact table does not contain any of the expected material types: {','.join(requiredMaterialTypes)})", features.contactEmail))
 
 								if 'NAV' in collFactsMaterialTypes:
-									warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in {BBMRICohortsDNANetworkName} but the fact table does specified the NAV (not-available) material type", collection['contact']['email']))
+									warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in {BBMRICohortsDNANetworkName} but the fact table does specified the NAV (not-available) material type", features.contactEmail))
 
 				else:
 					if 'network' in collection and (BBMRICohortsNetworkName in collection_networks or BBMRICohortsDNANetworkName in collection_networks):
-						warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in BBMRI cohorts but the fact table is missing", "Prepare the facts table for the collection and upload", collection['contact']['email']))
+						warnings.append(DataCheckWarning(self.__class__.__name__, "", features.NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, f"Collection in BBMRI cohorts but the fact table is missing", "Prepare the facts table for the collection and upload", features.contactEmail))
 
 		for biobank in dir.getBiobanks():
-			biobank_networks = []
-			if 'network' in biobank:
-				for n in biobank['network']:
-					biobank_networks.append(n['id'])
+			biobankFeatures = dir.getBiobankFeatures(biobank['id'])
+			biobank_networks = biobankFeatures.networks
 
-			collections = dir.getGraphBiobankCollectionsFromBiobank(biobank['id'])
 			collection_networks = set()  # set is sufficient since we only collect all the networks in which any of the collections of a biobank are participating
-			for collection in collections:
-				if 'network' in collection:
-					for n in collection['network']:
-						collection_networks.add(n['id'])
+			for collectionId in dir.getBiobankCollectionIds(biobank['id']):
+				collection_networks.update(dir.getCollectionFeatures(collectionId).networks)
 
 			for network in [BBMRICohortsNetworkName, BBMRICohortsDNANetworkName]:
 				# if network in biobank_networks and not network in collection_networks:
-					# warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, f"Biobank in BBMRI-Cohorts network {network} but has no collections in the same network network."))
+					# warnings.append(DataCheckWarning(self.__class__.__name__, "", biobankFeatures.NN, DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, f"Biobank in BBMRI-Cohorts network {network} but has no collections in the same network network."))
 				 if network in biobank_networks:
-					 warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, f"Biobanks are not expected to be part of BBMRI-Cohorts networks, only specific collections must be included. Biobank participates in BBMRI-Cohorts network: {network}.", "Remove BBMRI Cohorts/BBMRI Cohorts DNA network from the Biobank entry, check which collections shall be flagged with the networks BBMRI Cohorts / BBMRI Cohorts DNA and flag them", biobank['contact']['email']))
+					 warnings.append(DataCheckWarning(self.__class__.__name__, "", biobankFeatures.NN, DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, f"Biobanks are not expected to be part of BBMRI-Cohorts networks, only specific collections must be included. Biobank participates in BBMRI-Cohorts network: {network}.", "Remove BBMRI Cohorts/BBMRI Cohorts DNA network from the Biobank entry, check which collections shall be flagged with the networks BBMRI Cohorts / BBMRI Cohorts DNA and flag them", biobankFeatures.contactEmail))
 			
 		return warnings
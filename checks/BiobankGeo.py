@@ -1,17 +1,86 @@
 # vim:ts=8:sw=8:tw=0:noet
 
 import re
+import math
 import logging as log
-import os
 
 # this is ugly and only for assertive programming
 import __main__ 
 
 from yapsy.IPlugin import IPlugin
 from customwarnings import DataCheckWarningLevel,DataCheckWarning,DataCheckEntityType
+import profiling
+import caches
+import remotework
+import offlinegeocoder
 
 from geopy.geocoders import Nominatim
-from diskcache import Cache
+from geopy.extra.rate_limiter import RateLimiter
+from urllib.parse import urlsplit
+
+geocoords_pattern = '^-?\d+\.\d+$'
+# coordinates are snapped to a grid (step in degrees, see --geocoding-grid) before reverse geocoding, so that sites close to each other
+# share a single request and cache entry; 0 disables the snapping
+defaultGridStep = 0.01
+# Nominatim usage policy: at most 1 request per second from an application identified by its user agent
+nominatimMinDelay = 1.0
+nominatimUserAgent = 'BBMRI-ERIC Directory data checks (https://github.com/BBMRI-ERIC/directory-scripts)'
+# with the offline geocoder (--geocoding-boundaries), locations closer to a border (degrees, see --geocoding-border-margin) are checked using Nominatim
+defaultBorderMargin = 0.05
+
+def snapToGrid(latitude : str, longitude : str, step : float) -> str:
+	# returns the point as "lat, lon" string used as the cache key
+	if step <= 0:
+		return latitude + ", " + longitude
+	decimals = max(0, -math.floor(math.log10(step)))
+	return "%.*f, %.*f" % (decimals, round(float(latitude) / step) * step, decimals, round(float(longitude) / step) * step)
+
+def outsideCountry(country_code : str, countryId : str) -> bool:
+	return (countryId != "IARC" and countryId != "EU") and country_code.upper() != countryId and not (country_code.upper() == "GB" and countryId == "UK")
+
+def reverseGeocode(points : list, cache, nominatimURL : str = None) -> dict:
+	# returns point -> country code (or the exception if the reverse geocoding failed, or remotework.PENDING if the remote budget has been
+	# spent before the point could be resolved)
+	# points missing in the cache are resolved sequentially through a rate-limited queue as required by the Nominatim usage policy
+	# nominatimURL (see --nominatim-url) replaces the public service, the rate limit applies only to the latter
+	results = {}
+	pending = []
+	for point in points:
+		cache.recordLookup(point in cache and cache[point] != "")
+		if point in cache and cache[point] != "":
+			results[point] = cache[point]
+			log.info("Checking reverse geocoding for " + point + " -> OK")
+		else:
+			pending.append(point)
+	journal = remotework.Journal('geocoding', scope=nominatimURL)
+	if pending:
+		log.info("Reverse geocoding " + str(len(pending)) + " distinct locations" + (" (expected to take at least " + "%0.0f" % (len(pending) * nominatimMinDelay) + "s)" if nominatimURL is None else " using " + nominatimURL))
+		journal.begin(pending)
+		if nominatimURL is not None:
+			url = urlsplit(nominatimURL)
+			geolocator = Nominatim(user_agent=nominatimUserAgent, timeout=15, domain=url.netloc + url.path.rstrip('/'), scheme=url.scheme or 'https')
+			reverse = geolocator.reverse
+		else:
+			geolocator = Nominatim(user_agent=nominatimUserAgent, timeout=15)
+			reverse = RateLimiter(geolocator.reverse, min_delay_seconds=nominatimMinDelay, swallow_exceptions=False)
+		for point in journal.prioritize(pending):
+			if not remotework.available():
+				results[point] = remotework.PENDING
+				continue
+			logMessage = "Checking reverse geocoding for " + point
+			try:
+				profiling.countRemoteCall()
+				location = reverse(point, language='en')
+				results[point] = location.raw['address']['country_code']
+				cache[point] = results[point]
+				logMessage += " -> OK"
+			except Exception as e:
+				results[point] = e
+				logMessage += " -> failed (" + str(e) + ")"
+			journal.done(point)
+			log.info(logMessage)
+	journal.finish()
+	return results
 
 
 class BiobankGeo(IPlugin):
@@ -26,79 +95,91 @@ class BiobankGeo(IPlugin):
 		else:
 			geoCodingEnabled = True
 
-		cache_dir = 'data-check-cache/geolocator'
-		if not os.path.exists(cache_dir):
-			os.makedirs(cache_dir)
-		cache = Cache(cache_dir)
+		# the results obtained through --nominatim-url are cached apart from the ones of the public service
 		if 'geocoding' in args.purgeCaches:
-			cache.clear()
-		
-		geocoords_pattern = '^-?\d+\.\d+$'
-		geolocator = Nominatim(user_agent='Mozilla/5.0 (X11; Linux i686; rv:10.0) Gecko/20100101 Firefox/10.0',timeout=15)
+			caches.purgeVariants('geolocator')
+		cache = caches.openCache(caches.scopedNamespace('geolocator', getattr(args, 'nominatimURL', None)))
+
+		gridStep = args.geocodingGrid if getattr(args, 'geocodingGrid', None) is not None else defaultGridStep
+		borderMargin = args.geocodingBorderMargin if getattr(args, 'geocodingBorderMargin', None) is not None else defaultBorderMargin
+		boundaries = getattr(args, 'geocodingBoundaries', None)
+		# the offline geocoder does not need any network, hence it is used even if the remote geocoding is disabled
+		geocoder = offlinegeocoder.OfflineReverseGeocoder.load(boundaries, cache) if boundaries is not None else None
+		reverseGeocodingEnabled = geoCodingEnabled or geocoder is not None
 
+		# first pass: the coordinates are validated and the locations to be reverse geocoded collected - items are either warnings
+		# or (entity ID, entity type, NN, country to compare with, country reported, coordinates) in the order of the reported warnings
+		items = []
 		for biobank in dir.getBiobanks():
+			NN = dir.getBiobankNN(biobank['id'])
 			if 'latitude' in biobank and not re.search('^\s*$', biobank['latitude']) and 'longitude' in biobank and not re.search('^\s*$', biobank['longitude']):
 				# we check before doing any convenience substitutions 
 				if not re.search (geocoords_pattern, biobank['latitude']):
-					warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, "Invalid biobank latitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + biobank['latitude'] + "'"))
+					items.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, "Invalid biobank latitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + biobank['latitude'] + "'"))
 				if not re.search (geocoords_pattern, biobank['longitude']):
-					warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, "Invalid biobank longitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + biobank['longitude'] + "'"))
+					items.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, "Invalid biobank longitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + biobank['longitude'] + "'"))
 				# this is for convenience - if there are commas used instead of periods, we should still do the remaining checks
-				biobank['latitude'] = re.sub(r',', r'.', biobank['latitude'])
-				biobank['longitude'] = re.sub(r',', r'.', biobank['longitude'])
-				if re.search (geocoords_pattern, biobank['latitude']) and re.search (geocoords_pattern, biobank['longitude']):
-					if geoCodingEnabled:
-						logMessage = "Checking reverse geocoding for " + biobank['latitude'] + ", " + biobank['longitude']
-						try:
-							loc_string = biobank['latitude'] + ", " + biobank['longitude']
-							if loc_string in cache and cache[loc_string] != "":
-								country_code = cache[loc_string]
-							else:
-								location = geolocator.reverse(loc_string, language='en')
-								country_code = location.raw['address']['country_code']
-								cache[loc_string] = country_code
-							logMessage += " -> OK"
-							if ((biobank['country']['id'] != "IARC" and biobank['country']['id'] != "EU") and country_code.upper() != biobank['country']['id'] and 
-									not (country_code.upper() == "GB" and biobank['country']['id'] == "UK")):
-								warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.WARNING, biobank['id'], DataCheckEntityType.BIOBANK, "Geolocation of the biobank is likely outside of its country " + biobank['country']['id'] + "; biobank seems to be in " + country_code.upper() + f" based on geographical coordinates 'latitude'={biobank['latitude']} 'longitude'={biobank['longitude']}"))
-						except Exception as e:
-							logMessage += " -> failed (" + str(e) + ")"
-							warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.WARNING, biobank['id'], DataCheckEntityType.BIOBANK, "Reverse geocoding of the biobank  location failed (" + str(e) + ")"))
-						log.info(logMessage)
+				latitude = re.sub(r',', r'.', biobank['latitude'])
+				longitude = re.sub(r',', r'.', biobank['longitude'])
+				if re.search (geocoords_pattern, latitude) and re.search (geocoords_pattern, longitude) and reverseGeocodingEnabled:
+					items.append((biobank['id'], DataCheckEntityType.BIOBANK, NN, biobank['country']['id'], biobank['country']['id'], latitude, longitude))
 			else:
-				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.INFO, biobank['id'], DataCheckEntityType.BIOBANK, "Missing geographical coordinates ('latitude and/or 'longitude' attributes are empty)"))
+				items.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.INFO, biobank['id'], DataCheckEntityType.BIOBANK, "Missing geographical coordinates ('latitude and/or 'longitude' attributes are empty)"))
 
 		for collection in dir.getCollections():
+			NN = dir.getCollectionNN(collection['id'])
 			if 'latitude' in collection and not re.search('^\s*$', collection['latitude']) and 'longitude' in collection and not re.search('^\s*$', collection['longitude']):
 				# we check before doing any convenience substitutions 
 				if not re.search (geocoords_pattern, collection['latitude']):
-					warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Invalid collection latitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + collection['latitude'] + "'"))
+					items.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Invalid collection latitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + collection['latitude'] + "'"))
 				if not re.search (geocoords_pattern, collection['longitude']):
-					warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Invalid collection longitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + collection['longitude'] + "'"))
+					items.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Invalid collection longitude (should be a decimal number with period without any spaces or stray characters around - the surrounding quotes are added in this report): offending value '" + collection['longitude'] + "'"))
 				# this is for convenience - if there are commas used instead of periods, we should still do the remaining checks
-				collection['latitude'] = re.sub(r',', r'.', collection['latitude'])
-				collection['longitude'] = re.sub(r',', r'.', collection['longitude'])
-				if re.search (geocoords_pattern, collection['latitude']) and re.search (geocoords_pattern, collection['longitude']):
-					if geoCodingEnabled:
-						logMessage = "Checking reverse geocoding for " + collection['latitude'] + ", " + collection['longitude']
-						try:
-							loc_string = collection['latitude'] + ", " + collection['longitude']
-							if loc_string in cache and cache[loc_string] != "":
-								country_code = cache[loc_string]
-							else:
-								location = geolocator.reverse(loc_string, language='en')
-								country_code = location.raw['address']['country_code']
-								cache[loc_string] = country_code
-							logMessage += " -> OK"
-							biobankId = dir.getCollectionBiobankId(collection['id'])
-							biobank = dir.getBiobankById(biobankId)
-							if ((biobank['country']['id'] != "IARC" and biobank['country']['id'] != "EU") and country_code.upper() != biobank['country']['id'] and 
-									not (country_code.upper() == "GB" and biobank['country']['id'] == "UK")):
-								warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, "Geolocation of the collection is likely outside of its country " + collection['country']['id'] + "; collection seems to be in " + country_code.upper() + f" based on geographical coordinates 'latitude'={collection['latitude']} 'longitude'={collection['longitude']}"))
-						except Exception as e:
-							logMessage += " -> failed (" + str(e) + ")"
-							warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.WARNING, collection['id'], DataCheckEntityType.COLLECTION, "Reverse geocoding of the collection  location failed (" + str(e) + ")"))
-						log.info(logMessage)
+				latitude = re.sub(r',', r'.', collection['latitude'])
+				longitude = re.sub(r',', r'.', collection['longitude'])
+				if re.search (geocoords_pattern, latitude) and re.search (geocoords_pattern, longitude) and reverseGeocodingEnabled:
+					biobank = dir.getBiobankById(dir.getCollectionBiobankId(collection['id']))
+					items.append((collection['id'], DataCheckEntityType.COLLECTION, NN, biobank['country']['id'], collection['country']['id'], latitude, longitude))
+
+		# each distinct location is reverse geocoded just once - offline if the country boundaries are provided, with Nominatim used
+		# for the locations near a border or outside of the boundary dataset (unless the remote geocoding is disabled)
+		locations = []
+		for item in items:
+			if not isinstance(item, DataCheckWarning) and item[5:7] not in locations:
+				locations.append(item[5:7])
+		countries = {}
+		remotePoints = {}
+		for (latitude, longitude) in locations:
+			if geocoder is not None:
+				(code, nearBorder) = geocoder.lookup(float(latitude), float(longitude), borderMargin if geoCodingEnabled else 0.0)
+				if code is not None and not nearBorder:
+					countries[(latitude, longitude)] = code
+					continue
+				if not geoCodingEnabled:
+					countries[(latitude, longitude)] = Exception("location is not within any country of " + boundaries)
+					continue
+			remotePoints[(latitude, longitude)] = snapToGrid(latitude, longitude, gridStep)
+		if geocoder is not None:
+			log.info("Reverse geocoded " + str(len(countries)) + " locations offline, " + str(len(remotePoints)) + " near a border or outside of the boundary dataset left for Nominatim")
+		if remotePoints:
+			resolved = reverseGeocode(list(dict.fromkeys(remotePoints.values())), cache, getattr(args, 'nominatimURL', None))
+			for (location, point) in remotePoints.items():
+				countries[location] = resolved[point]
+
+		# second pass: the warnings
+		for item in items:
+			if isinstance(item, DataCheckWarning):
+				warnings.append(item)
+				continue
+			(entityId, entityType, NN, countryId, reportedCountryId, latitude, longitude) = item
+			entityName = 'biobank' if entityType == DataCheckEntityType.BIOBANK else 'collection'
+			country_code = countries[(latitude, longitude)]
+			if country_code is remotework.PENDING:
+				warnings.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.INFO, entityId, entityType, "Geolocation of the " + entityName + " is pending - the location was not reverse geocoded within the remote check budget, it will be checked in the next run"))
+			elif isinstance(country_code, Exception):
+				warnings.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.WARNING, entityId, entityType, "Reverse geocoding of the " + entityName + "  location failed (" + str(country_code) + ")"))
+			elif outsideCountry(country_code, countryId):
+				warnings.append(DataCheckWarning(self.__class__.__name__, "", NN, DataCheckWarningLevel.WARNING, entityId, entityType, "Geolocation of the " + entityName + " is likely outside of its country " + reportedCountryId + "; " + entityName + " seems to be in " + country_code.upper() + f" based on geographical coordinates 'latitude'={latitude} 'longitude'={longitude}"))
 
 		cache.close()
 		return warnings
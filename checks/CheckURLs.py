@@ -1,85 +1,189 @@
 # vim:ts=8:sw=8:tw=0:noet
 
-from typing import List
+from typing import List, Optional, Tuple
 import re
-import urllib
 import pprint
-import ssl
-import certifi
 import logging as log
-import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+import urllib3
 
 # this is ugly and only for assertive programming
 import __main__ 
 
 from yapsy.IPlugin import IPlugin
 from customwarnings import DataCheckWarningLevel,DataCheckWarning,DataCheckEntityType
+import profiling
+import caches
+import remotework
 
-from diskcache import Cache
 
 pp = pprint.PrettyPrinter(indent=4)
 
-cache = None
+# the URLs are checked concurrently by maxWorkers threads, with at most maxRequestsPerHost requests to the same host at a time
+maxWorkers = 16
+maxRequestsPerHost = 2
+# seconds
+connectTimeout = 10
+readTimeout = 30
+# cached results expire after the TTL (seconds) - successes are trusted longer than failures, which may be transient
+successTTL = 30*24*3600
+failureTTL = 2*24*3600
+# default number of expired cache entries refreshed per run (oldest first), see --url-refresh-budget
+defaultRefreshBudget = 200
+
+biobankURLMessage = "Biobank URL"
+collectionURLMessages = {
+		'data_access_uri' : "Data access URL for collection",
+		'sample_access_uri' : "Sample access URL for collection",
+		'image_access_uri' : "Image access URL for collection",
+		}
+
+hostLimits = {}
+hostLimitsLock = threading.Lock()
+
+def URLHost(URL : str) -> str:
+	try:
+		return urlsplit(URL).netloc.lower()
+	except ValueError:
+		return ''
 
-def testURL (URL : str, URLErrorWarning : DataCheckWarning) -> List[DataCheckWarning]:
+def hostLimit(URL : str) -> threading.Semaphore:
+	host = URLHost(URL)
+	with hostLimitsLock:
+		if host not in hostLimits:
+			hostLimits[host] = threading.BoundedSemaphore(maxRequestsPerHost)
+		return hostLimits[host]
+
+def connectionErrorCause(e : Exception):
+	# requests wraps the socket exceptions (possibly several times), we look for the original one
+	# failures to establish the connection are reported as unreachable URLs, not as connection errors
+	seen = set()
+	stack = [e]
+	while stack:
+		e = stack.pop()
+		if id(e) in seen:
+			continue
+		seen.add(id(e))
+		if isinstance(e, urllib3.exceptions.NewConnectionError):
+			return None
+		if isinstance(e, ConnectionError):
+			return e
+		stack += [a for a in getattr(e, 'args', ()) if isinstance(a, BaseException)]
+		stack += [a for a in (getattr(e, 'reason', None), e.__cause__, e.__context__) if isinstance(a, BaseException)]
+	return None
+
+def requestURL(URL : str, validators : dict = None, connectTo : str = None) -> requests.Response:
+	# HEAD is enough to get the status, but some servers do not implement it (properly) or refuse it - then we fall back to GET (without downloading the body)
+	# with the validators of a previous successful check (ETag, Last-Modified), the request is conditional and the server may answer 304 Not Modified
+	headers = {}
+	if validators:
+		if validators.get('etag'):
+			headers['If-None-Match'] = validators['etag']
+		if validators.get('lastModified'):
+			headers['If-Modified-Since'] = validators['lastModified']
+	# with connectTo (host:port, see --url-connect-to), the request is sent there in plain HTTP with the host of the URL in the Host header
+	target = URL
+	if connectTo is not None:
+		parts = urlsplit(URL)
+		headers['Host'] = parts.netloc
+		target = urlunsplit(('http', connectTo, parts.path or '/', parts.query, ''))
+	with hostLimit(URL):
+		# checked once the slot of the host is available, the requests waiting for it may take a while
+		if not remotework.available():
+			raise remotework.BudgetSpent()
+		profiling.countRemoteCall()
+		response = requests.head(target, headers=headers, timeout=(connectTimeout, readTimeout), allow_redirects=True)
+		response.close()
+		if response.status_code in (403, 404, 405, 501) or response.status_code >= 500:
+			profiling.countRemoteCall()
+			response = requests.get(target, headers=headers, timeout=(connectTimeout, readTimeout), allow_redirects=True, stream=True)
+			response.close()
+	return response
+
+def testURL (URL : str, URLErrorWarning : DataCheckWarning, validators : dict = None, connectTo : str = None) -> Tuple[Optional[Tuple[List[DataCheckWarning], str]], dict]:
+	# returns (warnings, logString) as stored in the cache and the validators for the next revalidation
+	# the result is None if the URL has been revalidated using validators and it has not changed since
 	warnings = []
 	logString = "Testing URL " + URL
 	URL_connection_reset = False
-	global cache
+	newValidators = {}
 
-	if(URL in cache):
-		(warnings, logString) = cache[URL]
+	if(not re.search('^(http|https):', URL, re.IGNORECASE)):
+		URLErrorWarning.message += ' (' + URL + ') does not start with http or https'
+		warnings.append(URLErrorWarning)
+		logString += " -> URL does not start with http or https"
 	else:
-		if(not re.search('^(http|https):', URL, re.IGNORECASE)):
-			URLErrorWarning.message += ' (' + URL + ') does not start with http or https'
+		try: 
+			response = requestURL(URL, validators, connectTo)
+			URL_ret_code = response.status_code
+			URL_well_formatted = True
+			if URL_ret_code == 304 and validators:
+				log.info(logString + " -> not modified")
+				return (None, validators)
+			newValidators = { 'etag' : response.headers.get('ETag'), 'lastModified' : response.headers.get('Last-Modified') }
+		except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema, ValueError) as e:
+			URLErrorWarning.message += " is misformatted (" + URL + ")"
 			warnings.append(URLErrorWarning)
-			logString += " -> URL does not start with http or https"
-		else:
-			try: 
-				URL_ret_code = urllib.request.urlopen(URL).getcode()
-				URL_well_formatted = True
-			except urllib.error.HTTPError as e:
-				URL_ret_code = e.code
-				URL_well_formatted = True
-			except urllib.error.URLError as e:
-				URLErrorWarning.message += " was not accessed successfully (accessing " + URL + " returns " + str(e) + ")"
-				warnings.append(URLErrorWarning)
-				URL_well_formatted = False
-				logString += " -> URL not reachable (urllib.error.URLError)"
-			except ValueError as e:
-				URLErrorWarning.message += " is misformatted (" + URL + ")"
-				warnings.append(URLErrorWarning)
-				URL_well_formatted = False
-				logString += " -> malformatted URL (ValueError)"
-			except ConnectionError as e:
-				cause = "failed"
-				if isinstance(e, ConnectionAbortedError):
+			URL_well_formatted = False
+			logString += " -> malformatted URL (" + e.__class__.__name__ + ")"
+		except requests.exceptions.RequestException as e:
+			cause = connectionErrorCause(e)
+			if isinstance(cause, (ConnectionAbortedError, ConnectionRefusedError, ConnectionResetError)):
+				if isinstance(cause, ConnectionAbortedError):
 					cause = "aborted by peer"
-				elif isinstance(e, ConnectionRefusedError):
+				elif isinstance(cause, ConnectionRefusedError):
 					cause = "refused by peer"
-				elif isinstance(e, ConnectionResetError):
+				else:
 					cause = "reset by peer"
 				URLErrorWarning.message += " produced connection %s (%s)" % (cause, URL)
 				warnings.append(URLErrorWarning)
 				URL_well_formatted = True
 				URL_connection_reset = True
 				logString += " -> connection " + cause
-			except Exception as e:
-				logString += " -> unknown exception"
-				log.info(logString)
-				raise
-			
-			if URL_well_formatted and not URL_connection_reset and not (URL_ret_code >= 200 and URL_ret_code < 300):
-				URLErrorWarning.message += " returns non-success code (" + URL + " returns HTTP error code " + str(URL_ret_code) + ")"
-				warnings.append(URLErrorWarning)
-				logString += " -> HTTP error code " + str(URL_ret_code)
 			else:
-				if URL_well_formatted and not URL_connection_reset:
-					logString += " -> OK"
-		cache[URL] = (warnings, logString)
+				URLErrorWarning.message += " was not accessed successfully (accessing " + URL + " returns " + str(e) + ")"
+				warnings.append(URLErrorWarning)
+				URL_well_formatted = False
+				logString += " -> URL not reachable (" + e.__class__.__name__ + ")"
+		except remotework.BudgetSpent:
+			raise
+		except Exception as e:
+			logString += " -> unknown exception"
+			log.info(logString)
+			raise
+		
+		if URL_well_formatted and not URL_connection_reset and not (URL_ret_code >= 200 and URL_ret_code < 300):
+			URLErrorWarning.message += " returns non-success code (" + URL + " returns HTTP error code " + str(URL_ret_code) + ")"
+			warnings.append(URLErrorWarning)
+			logString += " -> HTTP error code " + str(URL_ret_code)
+		else:
+			if URL_well_formatted and not URL_connection_reset:
+				logString += " -> OK"
 
 	log.info(logString)
-	return warnings
+	return ((warnings, logString), newValidators if not warnings else {})
+
+def testURLWithinBudget(URL : str, URLErrorWarning : DataCheckWarning, validators : dict = None, connectTo : str = None):
+	# as testURL, but the result is remotework.PENDING if the remote budget has been spent before the URL could be tested
+	try:
+		return testURL(URL, URLErrorWarning, validators, connectTo)
+	except remotework.BudgetSpent:
+		log.info("Testing URL " + URL + " -> pending")
+		return (remotework.PENDING, validators)
+
+def retargetWarning(warning : DataCheckWarning, URLErrorWarning : DataCheckWarning) -> DataCheckWarning:
+	# the result of a URL is shared by all the entities referring to it: the warning is rebuilt for the particular entity
+	suffix = warning.message
+	for prefix in sorted([biobankURLMessage] + list(collectionURLMessages.values()), key=len, reverse=True):
+		if warning.message.startswith(prefix):
+			suffix = warning.message[len(prefix):]
+			break
+	return DataCheckWarning(URLErrorWarning.dataCheckID, URLErrorWarning.recipients, URLErrorWarning.NN, warning.level, URLErrorWarning.directoryEntityID, URLErrorWarning.directoryEntityType, URLErrorWarning.message + suffix, warning.action, warning.emailTo)
 
 class CheckURLs(IPlugin):
 	def check(self, dir, args):
@@ -89,43 +193,96 @@ class CheckURLs(IPlugin):
 		if 'URLs' in args.disableChecksRemote:
 			return warnings
 
-		cache_dir = 'data-check-cache/URLs'
-		if not os.path.exists(cache_dir):
-			os.makedirs(cache_dir)
-		global cache
-		cache = Cache(cache_dir)
+		# the results obtained through --url-connect-to are cached apart from the real ones
+		connectTo = getattr(args, 'URLConnectTo', None)
 		if 'URLs' in args.purgeCaches:
-			cache.clear()
-                
-		log.info("Testing biobank URLs")
+			caches.purgeVariants('URLs')
+		cache = caches.openCache(caches.scopedNamespace('URLs', connectTo))
+
+		# the references are collected first (in the order of the reported warnings), so that each distinct URL is tested just once
+		references = []
+		log.info("Collecting biobank URLs")
 		for biobank in dir.getBiobanks():
 			if not 'url' in biobank or re.search('^\s*$', biobank['url']):
-				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.WARNING, biobank['id'], DataCheckEntityType.BIOBANK, "Missing URL"))
+				references.append((None, DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.WARNING, biobank['id'], DataCheckEntityType.BIOBANK, "Missing URL")))
 			else:
-				URLwarnings = testURL(biobank['url'], 
-						DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, "Biobank URL")
-						)
-				warnings += URLwarnings
+				references.append((biobank['url'], DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, biobank['id'], DataCheckEntityType.BIOBANK, biobankURLMessage)))
 
-		log.info("Testing collection URLs")
-		for collection in dir.getBiobanks():
+		log.info("Collecting collection URLs")
+		for collection in dir.getCollections():
 			# non-existence of access URIs is tested in the access policy checks - here we only check validity of the URL if it exists
-			if 'data_access_uri' in collection and not re.search('^\s*$', collection['data_access_uri']):
-				URLwarnings = testURL(collection['data_access_uri'],
-						DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Data access URL for collection")
-						)
-				warnings += URLwarnings
-
-			if 'sample_access_uri' in collection and not re.search('^\s*$', collection['sample_access_uri']):
-				URLwarnings = testURL(collection['sample_access_uri'],
-						DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Sample access URL for collection")
-						)
-				warnings += URLwarnings
-			if 'image_access_uri' in collection and not re.search('^\s*$', collection['image_access_uri']):
-				URLwarnings = testURL(collection['image_access_uri'],
-						DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Image access URL for collection")
-						)
-				warnings += URLwarnings
+			for (attribute, message) in collectionURLMessages.items():
+				if attribute in collection and not re.search('^\s*$', collection[attribute]):
+					references.append((collection[attribute], DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, message)))
+
+		# cache entries: URL -> (warnings, logString), 'checked:' + URL -> time of the check, its success and the validators for revalidation
+		# (entries without the latter come from older versions and are considered the oldest ones)
+		now = time.time()
+		results = {}
+		pending = {}
+		expired = []
+		for (URL, URLErrorWarning) in references:
+			if URL is None or URL in results or URL in pending:
+				continue
+			cache.recordLookup(URL in cache)
+			if URL in cache:
+				results[URL] = cache[URL]
+				checked = cache.get('checked:' + URL, { 'time' : 0, 'ok' : not results[URL][0] })
+				if checked['time'] + (successTTL if checked['ok'] else failureTTL) < now:
+					expired.append((checked['time'], URL, URLErrorWarning))
+				else:
+					log.info(results[URL][1])
+			else:
+				pending[URL] = URLErrorWarning
+
+		# expired entries are refreshed gradually, oldest first (the ones left by an unfinished run before them), the remaining ones are used until the next runs
+		journal = remotework.Journal('URLs', scope=connectTo)
+		refreshBudget = args.URLRefreshBudget if getattr(args, 'URLRefreshBudget', None) is not None else defaultRefreshBudget
+		expired.sort(key=lambda e: (e[1] not in journal.previous, e[0]))
+		for (checkedTime, URL, URLErrorWarning) in expired[:refreshBudget]:
+			pending[URL] = URLErrorWarning
+		for (checkedTime, URL, URLErrorWarning) in expired[refreshBudget:]:
+			log.info(results[URL][1] + " (expired, refresh postponed)")
+		if expired:
+			log.info(str(len(expired)) + " cached URL results expired, refreshing " + str(min(len(expired), refreshBudget)) + " of them")
+
+		unchecked = set()
+		if pending:
+			log.info("Testing " + str(len(pending)) + " distinct URLs")
+			journal.begin(list(pending))
+			# round robin over the hosts, so that the workers do not wait for the per-host limits
+			byHost = {}
+			for URL in journal.prioritize(list(pending)):
+				byHost.setdefault(URLHost(URL), []).append(URL)
+			queue = [l[i] for i in range(max(len(l) for l in byHost.values())) for l in byHost.values() if i < len(l)]
+			with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(queue)))) as executor:
+				futures = {}
+				for URL in queue:
+					# the warning template of the first entity referring to the URL is stored in the cache
+					template = DataCheckWarning(pending[URL].dataCheckID, pending[URL].recipients, pending[URL].NN, pending[URL].level, pending[URL].directoryEntityID, pending[URL].directoryEntityType, pending[URL].message)
+					validators = cache.get('checked:' + URL, {}).get('validators') if URL in results else None
+					futures[URL] = executor.submit(profiling.propagate(testURLWithinBudget), URL, template, validators, connectTo)
+				for URL in queue:
+					(result, validators) = futures[URL].result()
+					if result is remotework.PENDING:
+						# URLs with an expired result keep it until they are refreshed
+						if URL not in results:
+							unchecked.add(URL)
+						continue
+					journal.done(URL)
+					if result is not None:
+						results[URL] = result
+						cache[URL] = result
+					cache['checked:' + URL] = { 'time' : time.time(), 'ok' : not results[URL][0], 'validators' : validators }
+		journal.finish()
+
+		for (URL, URLErrorWarning) in references:
+			if URL is None:
+				warnings.append(URLErrorWarning)
+			elif URL in unchecked:
+				warnings.append(DataCheckWarning(URLErrorWarning.dataCheckID, URLErrorWarning.recipients, URLErrorWarning.NN, DataCheckWarningLevel.INFO, URLErrorWarning.directoryEntityID, URLErrorWarning.directoryEntityType, URLErrorWarning.message + " (" + URL + ") is pending - not checked within the remote check budget, it will be checked in the next run"))
+			else:
+				warnings += [retargetWarning(w, URLErrorWarning) for w in results[URL][0]]
 
 		cache.close()
 		return warnings
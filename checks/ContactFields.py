@@ -3,16 +3,39 @@
 import re
 import logging as log
 import DNS
-import os
+from concurrent.futures import ThreadPoolExecutor
 
 # this is ugly and only for assertive programming
 import __main__ 
 
 from yapsy.IPlugin import IPlugin
 from validate_email import validate_email
-from diskcache import Cache
 
 from customwarnings import DataCheckWarningLevel,DataCheckWarning,DataCheckEntityType
+import profiling
+import caches
+import remotework
+
+# distinct email domains are resolved concurrently by maxWorkers threads
+maxWorkers = 16
+# the MX check results of the domains expire after the TTL (seconds) - failures may be transient, hence they are retried sooner
+domainValidTTL = 7*24*3600
+domainInvalidTTL = 24*3600
+
+def emailDomain(email : str) -> str:
+	return email[email.find('@') + 1:].strip().lower()
+
+def checkDomainMX(domain : str) -> bool:
+	# validate_email with check_mx depends only on the domain of the address (looks up the MX records and connects to them),
+	# hence the domain is checked once using the postmaster address, which exists in every mail domain
+	profiling.countRemoteCall()
+	return bool(validate_email('postmaster@' + domain, check_mx=True))
+
+def checkDomainMXWithinBudget(domain : str):
+	# as checkDomainMX, but the result is remotework.PENDING if the remote budget has been spent before the domain could be checked
+	if not remotework.available():
+		return remotework.PENDING
+	return checkDomainMX(domain)
 
 class ContactFields(IPlugin):
 	def check(self, dir, args):
@@ -25,13 +48,51 @@ class ContactFields(IPlugin):
 		else:
 			ValidateEmails = True
 
-		cache_dir = 'data-check-cache/emails'
-		if not os.path.exists(cache_dir):
-			os.makedirs(cache_dir)
-		cache = Cache(cache_dir)
+		# the results obtained through --mx-resolver are cached apart from the real ones
+		MXResolver = getattr(args, 'MXResolver', None)
 		if 'emails' in args.purgeCaches:
-			cache.clear()
-			
+			caches.purgeVariants('emails')
+		cache = caches.openCache(caches.scopedNamespace('emails', MXResolver))
+		if MXResolver is not None:
+			# DNS server (host[:port]) used for the MX lookups instead of the system resolvers
+			(host, sep, port) = MXResolver.partition(':')
+			DNS.defaults['server'] = [host]
+			DNS.defaults['port'] = int(port) if port else 53
+
+		# MX records are checked per domain: the results are cached as 'domain:' + domain and the domains missing in the cache are resolved in parallel
+		domainResults = {}
+		if ValidateEmails:
+			domains = set()
+			for contact in dir.getContacts():
+				if 'email' in contact and not re.search('^\s*$', contact['email']) and validate_email(contact['email']):
+					domains.add(emailDomain(contact['email']))
+			pending = []
+			for domain in sorted(domains):
+				cache.recordLookup('domain:' + domain in cache)
+				if 'domain:' + domain in cache:
+					domainResults[domain] = cache['domain:' + domain]
+				else:
+					pending.append(domain)
+			journal = remotework.Journal('emails', scope=MXResolver)
+			if pending:
+				log.info("Checking MX records of " + str(len(pending)) + " email domains")
+				journal.begin(pending)
+				pending = journal.prioritize(pending)
+				with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(pending)))) as executor:
+					futures = {domain : executor.submit(profiling.propagate(checkDomainMXWithinBudget), domain) for domain in pending}
+					for domain in pending:
+						try:
+							domainResults[domain] = futures[domain].result()
+							if domainResults[domain] is remotework.PENDING:
+								continue
+							journal.done(domain)
+							cache.set('domain:' + domain, domainResults[domain], expire=domainValidTTL if domainResults[domain] else domainInvalidTTL)
+						except (DNS.Base.TimeoutError, DNS.Base.ServerError, DNS.Base.SocketError) as e:
+							# not cached, the domain will be checked again next time
+							domainResults[domain] = e
+							journal.done(domain)
+			journal.finish()
+
 		for contact in dir.getContacts():
 			if(not 'first_name' in contact or re.search('^\s*$', contact['first_name'])):
 				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getContactNN(contact['id']), DataCheckWarningLevel.WARNING, contact['id'], DataCheckEntityType.CONTACT, "Missing first name for contact ('first_name' attribute is empty)"))
@@ -48,27 +109,22 @@ class ContactFields(IPlugin):
 					log_message = "Validating email " + contact_email
 					# XXX: does not work in most cases
 					#if(not validate_email(contact['email'],verify=True)):
-					try:
-						if(contact_email in cache):
-							cache_result = cache[contact_email]
-							if(cache_result['valid']):
-								log_message += " -> OK"
-							else:
-								log_message += " -> failed"
-								warnings.append(cache_result['warning'])
-						else:
-							if(not validate_email(contact_email,check_mx=True)):
-								log_message += " -> failed"
-								warning = DataCheckWarning(self.__class__.__name__, "", dir.getContactNN(contact['id']), DataCheckWarningLevel.WARNING, contact['id'], DataCheckEntityType.CONTACT, "Email for contact seems to be unreachable because of missing DNS MX record")
-								warnings.append(warning)
-								cache[contact_email] = { 'valid' : False, 'warning' : warning }
-							else:
-								log_message += " -> OK"
-								cache[contact_email] = { 'valid' : True, 'warning' : None }
+					# the syntax has been checked above, hence the result is given by the MX check of the domain
+					domainResult = domainResults[emailDomain(contact_email)]
+					if domainResult is remotework.PENDING:
+						log_message += " -> pending"
 						log.info(log_message)
-					except (DNS.Base.TimeoutError, DNS.Base.ServerError, DNS.Base.SocketError) as e:
-						log_message += " -> failed with exception (" + str(e) + ")"
+						warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getContactNN(contact['id']), DataCheckWarningLevel.INFO, contact['id'], DataCheckEntityType.CONTACT, "Email for contact is pending - the DNS MX record was not checked within the remote check budget, it will be checked in the next run"))
+					elif isinstance(domainResult, Exception):
+						log_message += " -> failed with exception (" + str(domainResult) + ")"
 						log.error(log_message)
+					else:
+						if(not domainResult):
+							log_message += " -> failed"
+							warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getContactNN(contact['id']), DataCheckWarningLevel.WARNING, contact['id'], DataCheckEntityType.CONTACT, "Email for contact seems to be unreachable because of missing DNS MX record"))
+						else:
+							log_message += " -> OK"
+						log.info(log_message)
 
 			if(not 'phone' in contact or re.search('^\s*$', contact['phone'])):
 				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getContactNN(contact['id']), DataCheckWarningLevel.WARNING, contact['id'], DataCheckEntityType.CONTACT, "Missing phone for contact ('phone' attribute is empty'"))
@@ -10,7 +10,7 @@ class OrphanedCollections(IPlugin):
 		warnings = []
 		log.info("Running orphaned collection checks (OrphanedCollections)")
 		for collection in dir.getCollections():
-			collections = dir.getGraphBiobankCollectionsFromCollection(collection['id'])
-			if len(collections.edges) < 1:
-				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getBiobankNN(biobank['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Orphaned collection"))
+			# neither a biobank/parent collection above it nor any subcollections below it
+			if len(dir.getCollectionsAncestors(collection['id'])) < 1 and dir.getCollectionsSubtreeSize(collection['id']) <= 1:
+				warnings.append(DataCheckWarning(self.__class__.__name__, "", dir.getCollectionNN(collection['id']), DataCheckWarningLevel.ERROR, collection['id'], DataCheckEntityType.COLLECTION, "Orphaned collection"))
 		return warnings
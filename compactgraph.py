@@ -0,0 +1,307 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Compact directed graph backend for Directory: nodes are mapped to integers and the (frozen) adjacency
+# is stored in CSR arrays. It implements the subset of the networkx.DiGraph API used by the scripts;
+# networkx is only needed when exporting the graph for ad-hoc analysis (to_networkx()).
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+
+
+class CompactNodeView:
+
+    def __init__(self, graph):
+        self.__graph = graph
+
+    def __call__(self):
+        return self
+
+    def __iter__(self):
+        return iter(self.__graph._ids)
+
+    def __len__(self):
+        return len(self.__graph._ids)
+
+    def __contains__(self, node):
+        return node in self.__graph._index
+
+    def __getitem__(self, node):
+        return {'data': self.__graph._data[self.__graph._index[node]]}
+
+
+class CompactEdgeView:
+
+    def __init__(self, graph):
+        self.__graph = graph
+
+    def __call__(self):
+        return self
+
+    def __iter__(self):
+        return self.__graph._iterEdges()
+
+    def __len__(self):
+        return self.__graph.number_of_edges()
+
+    def __contains__(self, edge):
+        return self.__graph.has_edge(edge[0], edge[1])
+
+
+class CompactDiGraph:
+
+    def __init__(self):
+        # string <-> int ID table and node data
+        self._ids = []
+        self._index = {}
+        self._data = []
+        # edges collected before freezing
+        self.__edgeList = []
+        self.__edgeSet = set()
+        # CSR adjacency (successors) and its transpose (predecessors), built by freeze()
+        self.__frozen = False
+        self.__outOffsets = None
+        self.__outTargets = None
+        self.__inOffsets = None
+        self.__inTargets = None
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, node):
+        return node in self._index
+
+    @property
+    def nodes(self):
+        return CompactNodeView(self)
+
+    @property
+    def edges(self):
+        return CompactEdgeView(self)
+
+    def __nodeIndex(self, node) -> int:
+        if node not in self._index:
+            if self.__frozen:
+                raise Exception('CompactDiGraph', 'Frozen graph can\'t be modified')
+            self._index[node] = len(self._ids)
+            self._ids.append(node)
+            self._data.append(None)
+        return self._index[node]
+
+    def add_node(self, node, data=None):
+        i = self.__nodeIndex(node)
+        if data is not None:
+            self._data[i] = data
+
+    def add_edge(self, u, v):
+        if self.__frozen:
+            raise Exception('CompactDiGraph', 'Frozen graph can\'t be modified')
+        e = (self.__nodeIndex(u), self.__nodeIndex(v))
+        if e not in self.__edgeSet:
+            self.__edgeSet.add(e)
+            self.__edgeList.append(e)
+
+    def has_node(self, node) -> bool:
+        return node in self._index
+
+    def has_edge(self, u, v) -> bool:
+        if u not in self._index or v not in self._index:
+            return False
+        (ui, vi) = (self._index[u], self._index[v])
+        if not self.__frozen:
+            return (ui, vi) in self.__edgeSet
+        (start, end) = (self.__outOffsets[ui], self.__outOffsets[ui + 1])
+        pos = bisect_left(self.__outTargets, vi, start, end)
+        return pos < end and self.__outTargets[pos] == vi
+
+    def number_of_nodes(self) -> int:
+        return len(self._ids)
+
+    def number_of_edges(self) -> int:
+        if not self.__frozen:
+            return len(self.__edgeList)
+        return len(self.__outTargets)
+
+    def freeze(self):
+        if self.__frozen:
+            return self
+        n = len(self._ids)
+        (self.__outOffsets, self.__outTargets) = CompactDiGraph.__buildCSR(n, self.__edgeList, 0, 1)
+        (self.__inOffsets, self.__inTargets) = CompactDiGraph.__buildCSR(n, self.__edgeList, 1, 0)
+        self.__edgeList = None
+        self.__edgeSet = None
+        self.__frozen = True
+        return self
+
+    def is_frozen(self) -> bool:
+        return self.__frozen
+
+    @staticmethod
+    def __buildCSR(n : int, edges : list, src : int, dst : int):
+        counts = [0] * (n + 1)
+        for e in edges:
+            counts[e[src] + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        offsets = array('l', counts)
+        targets = array('l', bytes(offsets.itemsize * len(edges)))
+        fill = list(counts[:n])
+        for e in sorted(edges, key=lambda e: (e[src], e[dst])):
+            targets[fill[e[src]]] = e[dst]
+            fill[e[src]] += 1
+        return (offsets, targets)
+
+    def __assertFrozen(self):
+        if not self.__frozen:
+            raise Exception('CompactDiGraph', 'Graph has to be frozen for this operation')
+
+    def _iterEdges(self):
+        if not self.__frozen:
+            # iterate over a copy as the reverse-edge repair adds edges while iterating
+            for (ui, vi) in list(self.__edgeList):
+                yield (self._ids[ui], self._ids[vi])
+            return
+        for ui in range(len(self._ids)):
+            for k in range(self.__outOffsets[ui], self.__outOffsets[ui + 1]):
+                yield (self._ids[ui], self._ids[self.__outTargets[k]])
+
+    def successors(self, node):
+        self.__assertFrozen()
+        ui = self._index[node]
+        return [self._ids[self.__outTargets[k]] for k in range(self.__outOffsets[ui], self.__outOffsets[ui + 1])]
+
+    def predecessors(self, node):
+        self.__assertFrozen()
+        ui = self._index[node]
+        return [self._ids[self.__inTargets[k]] for k in range(self.__inOffsets[ui], self.__inOffsets[ui + 1])]
+
+    def in_degree(self, node=None):
+        self.__assertFrozen()
+        if node is None:
+            return [(self._ids[i], self.__inOffsets[i + 1] - self.__inOffsets[i]) for i in range(len(self._ids))]
+        ui = self._index[node]
+        return self.__inOffsets[ui + 1] - self.__inOffsets[ui]
+
+    def out_degree(self, node=None):
+        self.__assertFrozen()
+        if node is None:
+            return [(self._ids[i], self.__outOffsets[i + 1] - self.__outOffsets[i]) for i in range(len(self._ids))]
+        ui = self._index[node]
+        return self.__outOffsets[ui + 1] - self.__outOffsets[ui]
+
+    def subgraph(self, nodes):
+        # induced subgraph (a new frozen graph, not a view)
+        self.__assertFrozen()
+        sub = CompactDiGraph()
+        selected = sorted({self._index[n] for n in nodes if n in self._index})
+        for ui in selected:
+            sub.add_node(self._ids[ui], data=self._data[ui])
+        selectedSet = set(selected)
+        for ui in selected:
+            for k in range(self.__outOffsets[ui], self.__outOffsets[ui + 1]):
+                if self.__outTargets[k] in selectedSet:
+                    sub.add_edge(self._ids[ui], self._ids[self.__outTargets[k]])
+        return sub.freeze()
+
+    def __reach(self, node, offsets, targets):
+        self.__assertFrozen()
+        start = self._index[node]
+        seen = set()
+        stack = [start]
+        while stack:
+            ui = stack.pop()
+            for k in range(offsets[ui], offsets[ui + 1]):
+                vi = targets[k]
+                if vi not in seen:
+                    seen.add(vi)
+                    stack.append(vi)
+        seen.discard(start)
+        return {self._ids[i] for i in seen}
+
+    def descendants(self, node):
+        return self.__reach(node, self.__outOffsets, self.__outTargets)
+
+    def ancestors(self, node):
+        return self.__reach(node, self.__inOffsets, self.__inTargets)
+
+    def topological_sort(self):
+        # Kahn's algorithm, raises an exception if the graph contains a cycle
+        self.__assertFrozen()
+        n = len(self._ids)
+        indegree = [self.__inOffsets[i + 1] - self.__inOffsets[i] for i in range(n)]
+        queue = [i for i in range(n) if indegree[i] == 0]
+        order = []
+        while queue:
+            ui = queue.pop()
+            order.append(self._ids[ui])
+            for k in range(self.__outOffsets[ui], self.__outOffsets[ui + 1]):
+                vi = self.__outTargets[k]
+                indegree[vi] -= 1
+                if indegree[vi] == 0:
+                    queue.append(vi)
+        if len(order) != n:
+            raise Exception('CompactDiGraph', 'Graph contains a cycle')
+        return order
+
+    def is_directed_acyclic_graph(self) -> bool:
+        try:
+            self.topological_sort()
+        except Exception:
+            return False
+        return True
+
+    def to_networkx(self):
+        if nx is None:
+            raise Exception('CompactDiGraph', 'networkx is not installed, export is not possible')
+        g = nx.DiGraph()
+        for (i, node) in enumerate(self._ids):
+            g.add_node(node, data=self._data[i])
+        g.add_edges_from(self._iterEdges())
+        if self.__frozen:
+            nx.freeze(g)
+        return g
+
+
+# The following functions dispatch the networkx algorithms used by Directory to the graph backend in use.
+
+def freeze(g):
+    if isinstance(g, CompactDiGraph):
+        return g.freeze()
+    return nx.freeze(g)
+
+def is_directed_acyclic_graph(g) -> bool:
+    if isinstance(g, CompactDiGraph):
+        return g.is_directed_acyclic_graph()
+    return nx.algorithms.dag.is_directed_acyclic_graph(g)
+
+def topological_sort(g):
+    if isinstance(g, CompactDiGraph):
+        return g.topological_sort()
+    return nx.algorithms.dag.topological_sort(g)
+
+def descendants(g, node):
+    if isinstance(g, CompactDiGraph):
+        return g.descendants(node)
+    return nx.algorithms.dag.descendants(g, node)
+
+def ancestors(g, node):
+    if isinstance(g, CompactDiGraph):
+        return g.ancestors(node)
+    return nx.algorithms.dag.ancestors(g, node)
+
+def newDiGraph(backend : str):
+    if backend == 'compact':
+        return CompactDiGraph()
+    elif backend == 'networkx':
+        if nx is None:
+            raise Exception('CompactDiGraph', 'networkx graph backend requested, but networkx is not installed')
+        return nx.DiGraph()
+    else:
+        raise Exception('CompactDiGraph', 'Unknown graph backend: ' + backend)
@@ -3,11 +3,15 @@
 
 import pprint
 import re
+import sys
 import argparse
 import logging as log
 import time
 from typing import List
 import os.path
+import multiprocessing
+import signal
+from concurrent.futures import ThreadPoolExecutor
 
 
 from yapsy.PluginManager import PluginManager
@@ -16,6 +20,11 @@ from customwarnings import DataCheckWarning
 from warningscontainer import WarningsContainer
 from nncontacts import NNContacts
 from directory import Directory
+import molgenistransport
+import entityrules
+import profiling
+import caches
+import remotework
 
 from orphacodes import OrphaCodes
 
@@ -41,7 +50,9 @@ for pluginInfo in simplePluginManager.getAllPlugins():
     pluginList.append(os.path.basename(pluginInfo.path))
 
 remoteCheckList = ['emails', 'geocoding', 'URLs']
-cachesList = ['directory', 'emails', 'geocoding', 'URLs']
+# plugins spending most of the time waiting for remote services - with --jobs, they run in threads of the main process instead of the process pool
+ioBoundPluginList = ['CheckURLs', 'ContactFields', 'BiobankGeo']
+cachesList = ['directory', 'emails', 'geocoding', 'URLs', 'checks', 'journal']
 
 parser = argparse.ArgumentParser()
 parser.register('action', 'extend', ExtendAction)
@@ -53,13 +64,35 @@ parser.add_argument('--disable-checks-all-remote', dest='disableChecksRemote', a
 parser.add_argument('--disable-checks-remote', dest='disableChecksRemote', nargs='+', action='extend', choices=remoteCheckList, help='disable particular long remote checks')
 parser.add_argument('--disable-plugins', dest='disablePlugins', nargs='+', action='extend', choices=pluginList, help='disable particular check(s)')
 parser.add_argument('--purge-all-caches', dest='purgeCaches', action='store_const', const=cachesList, help='disable all long remote checks (email address testing, geocoding, URLs')
-parser.add_argument('--purge-cache', dest='purgeCaches', nargs='+', action='extend', choices=cachesList, help='purge particular cache(s)')
+parser.add_argument('--purge-cache', dest='purgeCaches', nargs='+', action='extend', choices=cachesList + ['directory-all'], help='purge particular cache(s) - directory purges the directory cache of the current server, package and user, directory-all the ones of all of them')
+parser.add_argument('--compact-caches', dest='compactCaches', action='store_true', help='at the end of the run, remove the expired entries from the caches, evict the entries over the size limits and reclaim the disk space')
+parser.add_argument('--url-connect-to', dest='URLConnectTo', help='send the URL check requests in plain HTTP to host:port provided as parameter (e.g., a local stand-in, see standins.py) with the host of the URL in the Host header')
+parser.add_argument('--mx-resolver', dest='MXResolver', help='DNS server (host[:port]) used for the MX checks of the email addresses instead of the system resolvers')
+parser.add_argument('--nominatim-url', dest='nominatimURL', help='URL of the Nominatim service used for reverse geocoding instead of the public one (no rate limit is applied)')
+parser.add_argument('--remote-budget', dest='remoteBudget', type=float, help='wall-clock seconds the remote checks may take, the items not checked within the budget are reported as pending and checked first in the next run')
+parser.add_argument('--url-refresh-budget', dest='URLRefreshBudget', type=int, help='maximum number of expired cached URL check results refreshed per run, oldest first (default 200)')
+parser.add_argument('--geocoding-grid', dest='geocodingGrid', type=float, help='grid step in degrees the coordinates are snapped to before reverse geocoding, 0 to use the exact coordinates (default 0.01)')
+parser.add_argument('--geocoding-boundaries', dest='geocodingBoundaries', help='country boundaries (GeoJSON, or shapefile if pyshp is installed) used for offline reverse geocoding, Nominatim is then used only for the locations near a border')
+parser.add_argument('--geocoding-border-margin', dest='geocodingBorderMargin', type=float, help='distance from a border in degrees within which the offline reverse geocoding is verified using Nominatim (default 0.05)')
 parser.add_argument('-O', '--orphacodes-mapfile', dest='orphacodesfile', nargs=1,
                     help='file name of Orpha code mappings from http://www.orphadata.org/cgi-bin/ORPHAnomenclature.html')
 parser.add_argument('-p', '--password', dest='password', help='Password of the account used to login to the Directory')
 parser.add_argument('-u', '--username', dest='username', help='Username of the account used to login to the Directory')
 parser.add_argument('-P', '--package', dest='package', default='eu_bbmri_eric', help='MOLGENIS Package that contains the data (default eu_bbmri_eric).')
+parser.add_argument('--directory-url', dest='directoryURL', default='https://directory-backend.molgenis.net/', help='URL of the MOLGENIS server with the Directory (default https://directory-backend.molgenis.net/)')
+parser.add_argument('--graph-backend', dest='graphBackend', choices=['networkx', 'compact'], help='graph implementation used for the directory structure (default networkx if installed)')
+parser.add_argument('--record-molgenis', dest='recordMolgenis', help='record the raw MOLGENIS REST responses into the directory provided as parameter (for later use with --replay-molgenis)')
+parser.add_argument('--replay-molgenis', dest='replayMolgenis', help='serve the MOLGENIS REST responses from the recording directory provided as parameter instead of the server (the directory cache of the replayed data is kept apart)')
+parser.add_argument('--replay-latency', dest='replayLatency', type=float, default=0.0, help='with --replay-molgenis, seconds added to each request (default 0)')
+parser.add_argument('--replay-bandwidth', dest='replayBandwidth', type=float, help='with --replay-molgenis, bandwidth of each response in bytes per second (default unlimited)')
+parser.add_argument('--delta-sync', dest='deltaSync', action='store_true', help='refresh the directory cache incrementally - retrieve only the entities modified since the last synchronization')
 
+parser.add_argument('--snapshot', dest='snapshot', help='load the directory from a local snapshot directory with JSON or EMX entity files instead of MOLGENIS')
+parser.add_argument('--incremental', dest='incremental', action='store_true', help='reuse the cached results of the local checks whose entities and arguments have not changed since the previous run')
+parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='number of plugins run concurrently (default 1, i.e., sequentially)')
+parser.add_argument('--profile', dest='profile', help='write a JSON report with wall/CPU time, peak memory, warnings, remote calls and cache hits of the directory loading and of each check into the file provided as parameter')
+parser.add_argument('--profile-stats', dest='profileStats', help='with --profile, dump cProfile statistics of each check into the directory provided as parameter')
+parser.add_argument('--write-snapshot', dest='writeSnapshot', help='write the directory entities as a JSON snapshot into the directory provided as parameter (for later use with --snapshot)')
 parser.set_defaults(disableChecksRemote = [], disablePlugins = [], purgeCaches=[])
 args = parser.parse_args()
 
@@ -73,10 +106,25 @@ else:
 
 # Main code
 
-if args.username is not None and args.password is not None:
-    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, username=args.username, password=args.password)
+runStartTime = time.perf_counter()
+profileReports = []
+if args.replayMolgenis is not None:
+    transport = molgenistransport.ReplayTransport(args.replayMolgenis, args.replayLatency, args.replayBandwidth)
+elif args.recordMolgenis is not None:
+    transport = molgenistransport.RecordingTransport(args.recordMolgenis)
 else:
-    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp)
+    transport = None
+# the directory is retrieved in worker threads, hence the CPU time of the whole process is measured
+with profiling.ProfileSection('Directory', enabled=args.profile is not None, statsDir=args.profileStats, cpuClock=time.process_time) as section:
+    if args.username is not None and args.password is not None:
+        dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, username=args.username, password=args.password, deltaSync=args.deltaSync, graphBackend=args.graphBackend, snapshot=args.snapshot, directoryURL=args.directoryURL, transport=transport)
+    else:
+        dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, deltaSync=args.deltaSync, graphBackend=args.graphBackend, snapshot=args.snapshot, directoryURL=args.directoryURL, transport=transport)
+    if transport is not None:
+        section.details['transport'] = { 'requests' : transport.statistics.requests, 'bytes' : transport.statistics.bytes }
+profileReports.append(section.report())
+if args.writeSnapshot is not None:
+    dir.writeSnapshot(args.writeSnapshot)
 warningContainer = WarningsContainer(disabledChecks)
 
 orphacodes = None
@@ -100,17 +148,128 @@ if args.debug:
         if(re.search('MMCI', collection['id'])):
             pp.pprint(collection)
 
-for pluginInfo in simplePluginManager.getAllPlugins():
+def runPlugin(pluginName : str):
+    # with --jobs, this runs in a process forked after the directory has been loaded (i.e., dir is shared copy-on-write) or in a thread
+    # returns the warnings and the profile report of the check
+    pluginInfo = simplePluginManager.getPluginByName(pluginName)
+    # sections are named by the plugin module, which is stable across the runs
+    with profiling.ProfileSection(os.path.basename(pluginInfo.path), enabled=args.profile is not None, statsDir=args.profileStats) as section:
+        # the remote checks keep their own caches of the remote results
+        cache = openResultCache() if os.path.basename(pluginInfo.path) not in ioBoundPluginList else None
+        if cache is not None:
+            warnings = entityrules.cachedResults(cache, dir, args, pluginInfo.plugin_object, lambda: pluginInfo.plugin_object.check(dir, args))
+            cache.close()
+        else:
+            warnings = pluginInfo.plugin_object.check(dir, args)
+        section.setWarnings(warnings)
+        section.details['description'] = pluginName
+    log.info('   ... check ' + pluginName + ' finished in ' + "%0.3f" % section.wall + 's')
+    return (warnings, section.report())
+
+def runRulesPlugins(pluginNames : List[str]):
+    # all the entity rules plugins share a single pass over the directory, hence they are profiled together
+    with profiling.ProfileSection('EntityRules', enabled=args.profile is not None, statsDir=args.profileStats) as section:
+        warnings = runRulesPass(pluginNames)
+        section.setWarnings([w for name in pluginNames for w in warnings[name]])
+        section.details['plugins'] = { os.path.basename(simplePluginManager.getPluginByName(name).path) : { 'description' : name, 'warnings' : profiling.countWarnings(warnings[name]) } for name in pluginNames }
+    log.info('   ... entity rules checks finished in ' + "%0.3f" % section.wall + 's')
+    return (warnings, section.report())
+
+def openResultCache():
+    # opened by each check, since diskcache connections must not be shared with the forked processes
+    return caches.openCache('checks') if args.incremental else None
+
+def runRulesPass(pluginNames : List[str]):
+    cache = openResultCache()
+    warnings = entityrules.runEntityRules(dir, args, [simplePluginManager.getPluginByName(name).plugin_object for name in pluginNames], cache)
+    if cache is not None:
+        cache.close()
+    return dict(zip(pluginNames, warnings))
+
+def runForked(task, *taskArgs):
+    # runs task in a process of the pool and passes its cache statistics back along with the result
+    return (task(*taskArgs), caches.takeStatistics())
+
+def collectForked(result):
+    (taskResult, cacheStatistics) = result.get()
+    caches.mergeStatistics(cacheStatistics)
+    return taskResult
+
+# plugins are sorted by module name, since yapsy does not guarantee any order and the merged warnings should not depend on it
+enabledPlugins = []
+for pluginInfo in sorted(simplePluginManager.getAllPlugins(), key=lambda p: os.path.basename(p.path)):
     if os.path.basename(pluginInfo.path) in args.disablePlugins:
         continue
     simplePluginManager.activatePluginByName(pluginInfo.name)
+    enabledPlugins.append(pluginInfo)
+rulesPlugins = [p.name for p in enabledPlugins if isinstance(p.plugin_object, entityrules.EntityRulesPlugin)]
+
+if 'journal' in args.purgeCaches:
+    caches.purgeVariants('journal')
+if args.incremental or 'checks' in args.purgeCaches:
+    with caches.openCache('checks', purge='checks' in args.purgeCaches) as cache:
+        entityrules.dropLegacyResults(cache)
+if args.incremental:
+    # the digests of the entity lists the results are keyed by are computed before forking the checks, so that each of them does not compute them again
+    for entityKey in entityrules.entityLists:
+        dir.getEntityDigest(entityKey)
+
+def stopRemoteChecks(signum, frame):
+    # the first Ctrl-C (or SIGTERM, e.g., from a CI timeout) lets the remote checks report the remaining items as pending, the second one aborts the run
+    remotework.stop('interrupted by signal ' + signal.Signals(signum).name)
+    if signum == signal.SIGINT:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+if set(remoteCheckList) - set(args.disableChecksRemote):
+    remotework.setBudget(args.remoteBudget)
+    signal.signal(signal.SIGINT, stopRemoteChecks)
+    signal.signal(signal.SIGTERM, stopRemoteChecks)
+
+if args.jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+    log.warning('Parallel checks need fork() support, running the checks sequentially')
+    args.jobs = 1
+
+pluginWarnings = {}
+pluginReports = {}
+rulesReport = None
+if args.jobs > 1:
     start_time = time.perf_counter()
-    warnings = pluginInfo.plugin_object.check(dir, args)
+    ioBoundPlugins = [p.name for p in enabledPlugins if os.path.basename(p.path) in ioBoundPluginList and p.name not in rulesPlugins]
+    cpuBoundPlugins = [p.name for p in enabledPlugins if os.path.basename(p.path) not in ioBoundPluginList and p.name not in rulesPlugins]
+    # the process pool has to be forked before any thread is started
+    poolTasks = len(cpuBoundPlugins) + (1 if rulesPlugins else 0)
+    # the statistics inherited from the parent are dropped by the workers, so that only their own lookups are passed back
+    pool = multiprocessing.get_context('fork').Pool(processes=max(1, min(args.jobs, poolTasks)), initializer=caches.takeStatistics) if poolTasks > 0 else None
+    try:
+        results = {name : pool.apply_async(runForked, (runPlugin, name)) for name in cpuBoundPlugins}
+        rulesResult = pool.apply_async(runForked, (runRulesPlugins, rulesPlugins)) if rulesPlugins else None
+        with ThreadPoolExecutor(max_workers=max(1, min(args.jobs, len(ioBoundPlugins)))) as executor:
+            futures = {name : executor.submit(runPlugin, name) for name in ioBoundPlugins}
+            for name in ioBoundPlugins:
+                (pluginWarnings[name], pluginReports[name]) = futures[name].result()
+        for name in cpuBoundPlugins:
+            (pluginWarnings[name], pluginReports[name]) = collectForked(results[name])
+        if rulesResult is not None:
+            (rulesWarnings, rulesReport) = collectForked(rulesResult)
+            pluginWarnings.update(rulesWarnings)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
     end_time = time.perf_counter()
-    log.info('   ... check finished in ' + "%0.3f" % (end_time-start_time) + 's')
-    if len(warnings) > 0:
-       for w in warnings:
-           warningContainer.newWarning(w)
+    log.info('   ... all checks finished in ' + "%0.3f" % (end_time-start_time) + 's')
+else:
+    if rulesPlugins:
+        (rulesWarnings, rulesReport) = runRulesPlugins(rulesPlugins)
+        pluginWarnings.update(rulesWarnings)
+    for pluginInfo in enabledPlugins:
+        if pluginInfo.name not in rulesPlugins:
+            (pluginWarnings[pluginInfo.name], pluginReports[pluginInfo.name]) = runPlugin(pluginInfo.name)
+
+# warnings are merged in the plugin order, hence the output does not depend on the order the checks finished in
+for pluginInfo in enabledPlugins:
+    for w in pluginWarnings[pluginInfo.name]:
+        warningContainer.newWarning(w)
 
 if not args.nostdout:
     log.info("Outputting warnings on stdout")
@@ -118,3 +277,22 @@ if not args.nostdout:
 if args.outputXLSX is not None:
     log.info("Outputting warnings in Excel file " + args.outputXLSX[0])
     warningContainer.dumpWarningsXLSX(args.outputXLSX)
+
+if args.profile is not None:
+    if rulesReport is not None:
+        profileReports.append(rulesReport)
+    profileReports += [pluginReports[p.name] for p in enabledPlugins if p.name in pluginReports]
+    profiling.writeReport(args.profile, profileReports, { 'package' : args.package, 'jobs' : args.jobs, 'plugins' : [os.path.basename(p.path) for p in enabledPlugins], 'wall' : time.perf_counter() - runStartTime })
+
+if args.compactCaches:
+    for namespace in caches.namespaces():
+        log.info('Compacting cache ' + namespace)
+        reclaimed = caches.compact(namespace)
+        log.info('   ... reclaimed ' + str(reclaimed) + ' bytes')
+
+# the summary goes to stderr, since stdout carries the warnings
+cacheSummary = caches.summary()
+if cacheSummary:
+    print('Cache efficiency:', file=sys.stderr)
+for (namespace, hits, misses, ratio, writes, entries, volume) in cacheSummary:
+    print('   %-40s hits %7d  misses %7d  hit ratio %6s  writes %7d  entries %7d  size %10.1f MiB' % (namespace, hits, misses, "%0.1f%%" % (100*ratio) if ratio is not None else '-', writes, entries, volume / caches.MiB), file=sys.stderr)
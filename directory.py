@@ -1,104 +1,591 @@
 # vim:ts=4:sw=4:tw=0:sts=4:et
 
 import logging as log
+import csv
+import hashlib
+import json
 import os.path
+import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional
+from urllib.parse import quote
 
 import molgenis.client
-import networkx as nx
-from diskcache import Cache
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+import caches
+import compactgraph
+import molgenistransport
+import profiling
+
+
+# derived features shared by the checks and exporters, computed once per entity in Directory.__buildFeatures
+class BiobankFeatures(NamedTuple):
+    NN : Optional[str]
+    contactEmail : Optional[str]
+    capabilities : List[str]
+    covid : List[str]
+    networks : List[str]
+
+class CollectionFeatures(NamedTuple):
+    NN : Optional[str]
+    biobankId : str
+    contactEmail : Optional[str]
+    OoM : Optional[int]
+    materials : List[str]
+    data_categories : List[str]
+    types : List[str]
+    networks : List[str]
+    # all diagnoses as provided, split into codes and ranges (IDs containing '-')
+    diagnoses : List[str]
+    diagnosisCodes : List[str]
+    diagnosisRanges : List[str]
+    # ICD-10 and ORPHA codes without the 'urn:miriam:icd:' and 'ORPHA:' prefixes
+    diagnosesICD10 : List[str]
+    diagnosesORPHA : List[str]
+    imagingModalities : List[str]
+    imageDatasetTypes : List[str]
+    sex : List[str]
 
 
 class Directory:
 
-    def __init__(self, package='eu_bbmri_eric', purgeCaches=[], debug=False, pp=None, username=None, password=None):
+    # (cache key, entity name suffix in the package, arguments for molgenis.client.Session.get)
+    entityFetchList = [
+            ('biobanks', '_biobanks', {'expand': 'contact,collections,country,capabilities'}),
+            ('collections', '_collections', {'expand': 'biobank,contact,network,parent_collection,sub_collections,type,materials,order_of_magnitude,data_categories,diagnosis_available,imaging_modality,image_dataset_type'}),
+            ('contacts', '_persons', {'num': 2000, 'expand': 'biobanks,collections,country'}),
+            ('networks', '_networks', {'num': 2000, 'expand': 'contact'}),
+            ('facts', '_facts', {}),
+            ]
+    # references in EMX entity files: attribute -> whether it is a multi-reference (mref); the references declared in the EMX metadata
+    # (attributes sheet) of a snapshot are added to these
+    emxReferences = {
+            'biobanks': {'contact': False, 'collections': True, 'country': False, 'capabilities': True, 'network': True, 'covid19biobank': True, 'quality': True, 'also_known': True},
+            'collections': {'biobank': False, 'contact': False, 'network': True, 'parent_collection': False, 'sub_collections': True, 'type': True, 'materials': True, 'order_of_magnitude': False, 'order_of_magnitude_donors': False, 'data_categories': True, 'diagnosis_available': True, 'imaging_modality': True, 'image_dataset_type': True, 'sex': True, 'age_unit': True, 'country': False, 'facts': True, 'data_use': True, 'quality': True, 'storage_temperatures': True, 'body_part_examined': True, 'also_known': True, 'studies': True},
+            'contacts': {'biobanks': True, 'collections': True, 'networks': True, 'country': False},
+            'networks': {'contact': False, 'contacts': True, 'biobanks': True, 'collections': True, 'country': False},
+            'facts': {'collection': False, 'disease': False, 'sex': False, 'age_range': False, 'sample_type': False},
+            }
+    # EMX data types of the references (see __loadEMXMetadata): data type -> whether it is a multi-reference
+    emxReferenceTypes = {'xref': False, 'categorical': False, 'file': False, 'mref': True, 'categorical_mref': True, 'one_to_many': True}
+    emxIntAttributes = {'size', 'number_of_donors', 'age_low', 'age_high', 'number_of_samples', 'order_of_magnitude', 'order_of_magnitude_donors'}
+    emxBoolAttributes = {'withdrawn', 'commercial_use', 'collaboration_commercial', 'collaboration_non_for_profit'}
+    # attributes that are always retrieved for a projection profile, since they are needed to build the directory structure (non-expanded references still contain the ID)
+    fetchProfileBase = {
+            'biobanks': 'id,name,country,contact,collections,network,withdrawn',
+            'collections': 'id,name,country,biobank,parent_collection,sub_collections,contact,network,size,number_of_donors,order_of_magnitude,order_of_magnitude_donors,withdrawn',
+            'contacts': 'id,email,country,biobanks,collections,networks',
+            'networks': 'id,name,country,contact,biobanks,collections',
+            }
+    # attribute projection profiles: profile name -> { entity key -> {'attributes': ..., 'expand': ...} } on top of fetchProfileBase, or None for everything from entityFetchList
+    # entities not in fetchProfileBase (i.e., facts) are retrieved only if listed in the profile
+    fetchProfiles = {
+            'full': None,
+            'minimal': {},
+            }
+    # version of the processed directory structure stored in the cache - to be increased whenever the structure built in __buildStructure changes
+    stateVersion = 2
+    # attribute holding the last modification time of the rows, used for incremental (delta) synchronization of the cache
+    deltaSyncTimestampAttribute = 'timestamp'
+    # entities without the timestamp attribute, they are always retrieved completely
+    deltaSyncUnsupported = {'facts'}
+    # whether the legacy un-namespaced directory cache has been looked for (see __removeLegacyCache)
+    __legacyCacheChecked = False
+    # one-to-many references holding the inverse of a reference of another entity (mappedBy attributes of the MOLGENIS model), they are rebuilt
+    # from the latter after a delta synchronization or when loading EMX files: (entity key, attribute) -> (referencing entity key, referencing attribute)
+    mappedByReferences = {
+            ('biobanks', 'collections') : ('collections', 'biobank'),
+            ('collections', 'sub_collections') : ('collections', 'parent_collection'),
+            }
+
+    def __init__(self, package='eu_bbmri_eric', purgeCaches=[], debug=False, pp=None, username=None, password=None, fetchThreads=5, deltaSync=False, graphBackend=None, snapshot=None, profile='full', directoryURL="https://directory-backend.molgenis.net/", transport=None):
+        # transport (see molgenistransport) creates the MOLGENIS sessions, e.g., to record or replay the REST responses
         self.__pp = pp
         self.__package = package
+        # digests of the raw entity lists (see getEntityDigest), kept apart from the processed state
+        self.__entityDigests = {}
         
         log.debug('Checking data in package: ' + package)
 
-        cache_dir = 'data-check-cache/directory'
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        cache = Cache(cache_dir)
-        if 'directory' in purgeCaches:
-            cache.clear()
+        if graphBackend is None:
+            graphBackend = 'networkx' if nx is not None else 'compact'
 
-        self.__directoryURL = "https://directory.bbmri-eric.eu/api/"
-        self.__directoryURL = "https://directory-backend.molgenis.net/"
-        log.info('Retrieving directory content from ' + self.__directoryURL)
-        session = molgenis.client.Session(self.__directoryURL)
-        if username is not None and password is not None:
-            log.info("Logging in to MOLGENIS with a user account.")
-            log.debug('username: ' + username)
-            log.debug('password: ' + password)
-            session.login(username, password)
-        log.info('   ... retrieving biobanks')
-        if 'biobanks' in cache:
-            self.biobanks = cache['biobanks']
-        else:
-            start_time = time.perf_counter()
-            # TODO: remove exception handling once BBMRI.uk staging has been fixed
-            try:
-                self.biobanks = session.get(self.__package + "_biobanks", expand='contact,collections,country,capabilities')
-            except:
-                log.warning("Using work-around for inconsistence in the database structure.")
-                self.biobanks = session.get(self.__package + "_biobanks", expand='contact,collections,country')
-            cache['biobanks'] = self.biobanks
-            end_time = time.perf_counter()
-            log.info('   ... retrieved biobanks in ' + "%0.3f" % (end_time-start_time) + 's')
-        log.info('   ... retrieving collections')
-        if 'collections' in cache:
-            self.collections = cache['collections']
-        else:
-            start_time = time.perf_counter()
-            self.collections = session.get(self.__package + "_collections", expand='biobank,contact,network,parent_collection,sub_collections,type,materials,order_of_magnitude,data_categories,diagnosis_available,imaging_modality,image_dataset_type')
-            #self.collections = session.get(self.__package + "_collections", num=2000, expand=[])
-            cache['collections'] = self.collections
-            end_time = time.perf_counter()
-            if debug and self.__pp is not None:
-                for c in self.collections:
-                    pp.pprint(c)
-            log.info('   ... retrieved collections in ' + "%0.3f" % (end_time-start_time) + 's')
-        log.info('   ... retrieving contacts')
-        if 'contacts' in cache:
-            self.contacts = cache['contacts']
+        if snapshot is not None:
+            # offline mode - neither MOLGENIS nor the directory cache are used
+            log.info('Loading directory content from snapshot ' + snapshot)
+            cache = None
+            self.__contentScope = 'snapshot/' + package
+            entities = Directory.__loadSnapshot(snapshot, package, fetchThreads)
         else:
-            start_time = time.perf_counter()
-            self.contacts = session.get(self.__package + "_persons", num=2000, expand='biobanks,collections,country')
-            cache['contacts'] = self.contacts
-            end_time = time.perf_counter()
-            log.info('   ... retrieved contacts in ' + "%0.3f" % (end_time-start_time) + 's')
-        log.info('   ... retrieving networks')
-        if 'networks' in cache:
-            self.networks = cache['networks']
-        else:
-            start_time = time.perf_counter()
-            self.networks = session.get(self.__package + "_networks", num=2000, expand='contact')
-            cache['networks'] = self.networks
-            end_time = time.perf_counter()
-            log.info('   ... retrieved networks in ' + "%0.3f" % (end_time-start_time) + 's')
+            self.__directoryURL = directoryURL
+            self.__username = username
+            self.__password = password
+            self.__transport = transport if transport is not None else molgenistransport.Transport()
+
+            # each (endpoint, package, auth scope) has its own cache namespace, so that different packages or servers can be cached side by side
+            # (data replayed from a recording are cached apart from the data retrieved from the server)
+            cacheNamespace = 'directory/' + Directory.cacheNamespace(directoryURL, package, username if password is not None else None, self.__transport.cacheScope)
+            # only the cache of this namespace is purged, so that the jobs using the other ones are not affected ('directory-all' purges all of them)
+            Directory.__removeLegacyCache()
+            if 'directory-all' in purgeCaches:
+                caches.purgeVariants('directory')
+            cache = caches.openCache(cacheNamespace, purge='directory' in purgeCaches)
+            log.debug('Using directory cache ' + cacheNamespace)
+            self.__contentScope = cacheNamespace
+            if profile not in Directory.fetchProfiles:
+                raise Exception('Directory', 'Unknown fetch profile: ' + profile)
+            log.debug('Using fetch profile: ' + profile)
+            if self.__transport.bypassCache:
+                log.info('Directory cache is not read, all the entities are retrieved')
+            plan = Directory.__fetchPlan(cache, profile, not self.__transport.bypassCache)
+            entities = self.__retrieveEntities(cache, profile, plan, fetchThreads, deltaSync, graphBackend, debug)
+            if entities is None:
+                # processed state loaded from the cache
+                self.__entityDigests.update(Directory.__cachedDigests(cache, plan))
+                log.info('Directory structure initialized')
+                self.__orphacodesmapper = None
+                return
+
+        self.biobanks = entities['biobanks']
+        self.collections = entities['collections']
+        self.contacts = entities['contacts']
+        self.networks = entities['networks']
+        self.facts = entities['facts']
         log.info('   ... all entities retrieved')
-        if 'facts' in cache:
-            self.facts = cache['facts']
+
+        log.info('Processing directory data')
+        start_time = time.perf_counter()
+        attributesBefore = set(self.__dict__)
+        self.__buildStructure(graphBackend)
+        if cache is not None:
+            state = { k : v for (k, v) in self.__dict__.items() if k not in attributesBefore }
+            state.update({ 'biobanks' : self.biobanks, 'collections' : self.collections, 'contacts' : self.contacts, 'networks' : self.networks, 'facts' : self.facts })
+            cache[Directory.__cacheKey(profile, 'state')] = (Directory.stateVersion, Directory.__stateKey(cache, plan, graphBackend), state)
+            self.__entityDigests.update(Directory.__cachedDigests(cache, plan))
+        end_time = time.perf_counter()
+        log.info('   ... processed directory structure in ' + "%0.3f" % (end_time-start_time) + 's')
+
+        log.info('Directory structure initialized')
+        self.__orphacodesmapper = None
+
+    # name of the cache namespace for the given endpoint, package and auth scope (anonymous or the username - data visible to a user may differ)
+    @staticmethod
+    def __removeLegacyCache():
+        # the un-namespaced cache of the former versions is not used anymore; checked once per process (the forked processes inherit the flag)
+        if Directory.__legacyCacheChecked:
+            return
+        Directory.__legacyCacheChecked = True
+        if caches.removeCache('directory'):
+            log.info('Removed the legacy directory cache ' + os.path.join(caches.cacheRoot, 'directory'))
+
+    @staticmethod
+    def cacheNamespace(directoryURL : str, package : str, username=None, transportScope : str = '') -> str:
+        authScope = 'anonymous' if username is None else 'user:' + username
+        digest = hashlib.sha256('|'.join([directoryURL.rstrip('/'), package, authScope] + ([transportScope] if transportScope else [])).encode('utf-8')).hexdigest()
+        return package + '-' + digest[:16]
+
+    # register an attribute projection profile for a consumer, e.g., registerFetchProfile('institutions', {'biobanks': {'attributes': 'juridical_person'}})
+    @classmethod
+    def registerFetchProfile(cls, name : str, entities : dict):
+        if ':' in name:
+            raise Exception('Directory', 'Fetch profile name must not contain a colon: ' + name)
+        cls.fetchProfiles[name] = entities
+
+    # construct the Directory from a local snapshot directory with JSON or EMX (CSV/TSV) entity files instead of MOLGENIS
+    @classmethod
+    def from_snapshot(cls, path : str, **kwargs):
+        return cls(snapshot=path, **kwargs)
+
+    # write the entity lists as a snapshot directory of JSON files that can be loaded using from_snapshot()
+    def writeSnapshot(self, path : str):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for (entityKey, entityList) in [('biobanks', self.biobanks), ('collections', self.collections), ('contacts', self.contacts), ('networks', self.networks), ('facts', self.facts)]:
+            with open(os.path.join(path, entityKey + '.json'), 'w', encoding='utf-8') as f:
+                json.dump(entityList, f, ensure_ascii=False)
+        log.info('Directory snapshot written to ' + path)
+
+    @staticmethod
+    def writeEMXSnapshot(path : str, package : str, entities : dict):
+        # writes the entity lists (entity key -> rows as returned by MOLGENIS) as an EMX snapshot: CSV entity files with the references as
+        # IDs (comma-separated for mrefs) and the attributes sheet declaring the references; the mappedBy references (see mappedByReferences)
+        # are left out as in the EMX exports, they are rebuilt when the snapshot is loaded
+        if not os.path.exists(path):
+            os.makedirs(path)
+        metadata = []
+        for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+            rows = entities.get(entityKey, [])
+            mappedBy = { attribute for (mappedKey, attribute) in Directory.mappedByReferences if mappedKey == entityKey }
+            columns = ['id'] + sorted({ a for e in rows for a in e if a != 'id' and a not in mappedBy and not a.startswith('_') })
+            references = {}
+            for e in rows:
+                for a in columns:
+                    if isinstance(e.get(a), (dict, list)):
+                        references[a] = isinstance(e[a], list)
+            with open(os.path.join(path, package + entitySuffix + '.csv'), 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for e in rows:
+                    writer.writerow([Directory.__emxValue(e.get(a)) for a in columns])
+            metadata += [(package + entitySuffix, a, 'mref' if mref else 'xref') for (a, mref) in sorted(references.items())]
+        with open(os.path.join(path, 'attributes.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['entity', 'name', 'dataType'])
+            writer.writerows(metadata)
+        log.info('Directory EMX snapshot written to ' + path)
+
+    @staticmethod
+    def __emxValue(value) -> str:
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, dict):
+            return str(value['id'])
+        if isinstance(value, list):
+            return ','.join([str(v['id']) if isinstance(v, dict) else str(v) for v in value])
+        return str(value)
+
+    @staticmethod
+    def __snapshotFiles(path : str, package : str, entityKey : str, entitySuffix : str):
+        names = [entityKey, package + entitySuffix]
+        if entityKey == 'contacts':
+            names.append('persons')
+        for name in names:
+            for ext in ['.json', '.jsonl', '.csv', '.tsv']:
+                if os.path.exists(os.path.join(path, name + ext)):
+                    return os.path.join(path, name + ext)
+        return None
+
+    @staticmethod
+    def __loadEMXMetadata(path : str, package : str) -> dict:
+        # references of the entities declared in the attributes sheet of the EMX snapshot (if any): entity key -> attribute -> whether it is an mref
+        references = { entityKey : dict(attributes) for (entityKey, attributes) in Directory.emxReferences.items() }
+        for ext in ['.csv', '.tsv']:
+            filename = os.path.join(path, 'attributes' + ext)
+            if not os.path.exists(filename):
+                continue
+            entityKeys = {}
+            for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+                entityKeys.update({ name : entityKey for name in [entityKey, package + entitySuffix, entitySuffix.lstrip('_')] })
+            with open(filename, encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f, delimiter='\t' if ext == '.tsv' else ','):
+                    entityKey = entityKeys.get((row.get('entity') or '').strip())
+                    dataType = (row.get('dataType') or '').strip().lower()
+                    if entityKey is not None and dataType in Directory.emxReferenceTypes:
+                        references[entityKey][row['name'].strip()] = Directory.emxReferenceTypes[dataType]
+            log.info('   ... loaded EMX metadata from ' + filename)
+            break
+        return references
+
+    @staticmethod
+    def __loadSnapshotFile(filename : str, entityKey : str, references : dict):
+        start_time = time.perf_counter()
+        if filename.endswith('.json'):
+            with open(filename, encoding='utf-8') as f:
+                data = json.load(f)
+        elif filename.endswith('.jsonl'):
+            # JSON lines are parsed while streaming the file
+            data = []
+            with open(filename, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        data.append(json.loads(line))
         else:
+            with open(filename, encoding='utf-8', newline='') as f:
+                data = [Directory.__parseEMXRow(row, references) for row in csv.DictReader(f, delimiter='\t' if filename.endswith('.tsv') else ',')]
+        end_time = time.perf_counter()
+        log.info('   ... loaded ' + str(len(data)) + ' ' + entityKey + ' from ' + filename + ' in ' + "%0.3f" % (end_time-start_time) + 's')
+        return data
+
+    @staticmethod
+    def __parseEMXRow(row : dict, references : dict):
+        # EMX stores references as IDs (comma-separated for mrefs), they are converted into the expanded form returned by MOLGENIS
+        # (references: attribute -> whether it is an mref); empty mrefs are empty lists as returned by MOLGENIS
+        entity = { attribute : [] for (attribute, mref) in references.items() if mref }
+        for (attribute, value) in row.items():
+            if value is None or value.strip() == '':
+                continue
+            if attribute in references:
+                ids = [int(v) if attribute in Directory.emxIntAttributes else v for v in [v.strip() for v in value.split(',')] if v != '']
+                entity[attribute] = [{'id': i} for i in ids] if references[attribute] else {'id': ids[0]}
+            elif attribute in Directory.emxIntAttributes:
+                entity[attribute] = int(value)
+            elif attribute in Directory.emxBoolAttributes:
+                entity[attribute] = value.lower() in ['true', 'yes', '1']
+            else:
+                entity[attribute] = value
+        return entity
+
+    @staticmethod
+    def __loadSnapshot(path : str, package : str, threads : int):
+        if not os.path.isdir(path):
+            raise Exception('DirectorySnapshot', 'Snapshot directory does not exist: ' + path)
+        files = {}
+        for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+            filename = Directory.__snapshotFiles(path, package, entityKey, entitySuffix)
+            if filename is None:
+                if entityKey == 'facts':
+                    log.warning('No facts found in the snapshot ' + path)
+                    continue
+                raise Exception('DirectorySnapshot', 'Missing ' + entityKey + ' in the snapshot ' + path)
+            files[entityKey] = filename
+        entities = { 'facts' : [] }
+        start_time = time.perf_counter()
+        references = Directory.__loadEMXMetadata(path, package)
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(files)))) as executor:
+            futures = {executor.submit(Directory.__loadSnapshotFile, filename, entityKey, references[entityKey]): entityKey for (entityKey, filename) in files.items()}
+            for future in as_completed(futures):
+                entities[futures[future]] = future.result()
+        if any(not (f.endswith('.json') or f.endswith('.jsonl')) for f in files.values()):
+            # references between the entities of the snapshot are resolved to the scalar attributes of the referenced rows (e.g., contact email),
+            # the one-to-many references usually missing in EMX exports (e.g., collections of a biobank) are rebuilt from the references they are the inverse of
+            Directory.resolveReferences(entities, references)
+        end_time = time.perf_counter()
+        log.info('   ... loaded snapshot in ' + "%0.3f" % (end_time-start_time) + 's total')
+        return entities
+
+    @staticmethod
+    def __cacheKey(profile : str, key : str) -> str:
+        # the full profile uses the plain keys, hence caches created before the profiles were introduced remain valid
+        return key if profile == 'full' else profile + ':' + key
+
+    @staticmethod
+    def __attributeSet(attributes) -> set:
+        if attributes is None or attributes == '':
+            return set()
+        if isinstance(attributes, str):
+            attributes = attributes.split(',')
+        return {a.strip() for a in attributes if a.strip() != ''}
+
+    @staticmethod
+    def __profileArgs(profile : str, entityKey : str, entityArgs : dict):
+        # arguments for molgenis.client.Session.get projected according to the profile, None if the entity is not needed by the profile
+        spec = Directory.fetchProfiles[profile]
+        if spec is None:
+            return entityArgs
+        if entityKey not in Directory.fetchProfileBase and entityKey not in spec:
+            return None
+        entitySpec = spec.get(entityKey, {})
+        expand = Directory.__attributeSet(entitySpec.get('expand'))
+        attributes = Directory.__attributeSet(Directory.fetchProfileBase.get(entityKey)) | Directory.__attributeSet(entitySpec.get('attributes')) | expand
+        args = { k : v for (k, v) in entityArgs.items() if k not in ['attributes', 'expand'] }
+        args['attributes'] = ','.join(sorted(attributes))
+        if expand:
+            args['expand'] = ','.join(sorted(expand))
+        return args
+
+    @staticmethod
+    def __argsCover(wider : dict, narrower : dict) -> bool:
+        # whether rows retrieved using the wider arguments contain everything requested by the narrower ones
+        if wider.get('num') != narrower.get('num'):
+            return False
+        if not Directory.__attributeSet(narrower.get('expand')) <= Directory.__attributeSet(wider.get('expand')):
+            return False
+        if 'attributes' not in wider:
+            return True
+        return 'attributes' in narrower and Directory.__attributeSet(narrower['attributes']) <= Directory.__attributeSet(wider['attributes'])
+
+    @staticmethod
+    def __fetchPlan(cache, profile : str, readCache : bool = True):
+        # list of (entity key, cache key, entity name suffix, arguments) for the entities needed by the profile;
+        # if the profile's own cache entry does not exist, the entity is served from a cached wider profile (unless the cache is not to be read)
+        cachedArgs = {}
+        for key in (cache.iterkeys() if readCache else []):
+            if isinstance(key, str) and key.startswith('args:') and key[len('args:'):] in cache:
+                cachedArgs[key[len('args:'):]] = cache[key]
+        plan = []
+        for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+            if readCache and entityKey in cache and entityKey not in cachedArgs:
+                # cached before the profiles were introduced, i.e., using the full profile
+                cachedArgs[entityKey] = entityArgs
+            args = Directory.__profileArgs(profile, entityKey, entityArgs)
+            if args is None:
+                log.debug('Skipping ' + entityKey + ', not needed by fetch profile ' + profile)
+                continue
+            cacheKey = Directory.__cacheKey(profile, entityKey)
+            if cacheKey in cachedArgs and not Directory.__argsCover(cachedArgs[cacheKey], args):
+                # e.g., retrieved using the work-around in __fetchEntity, hence the rows lack some of the requested attributes
+                log.info('   ... cached ' + entityKey + ' do not contain everything requested by fetch profile ' + profile + ', they are retrieved again')
+                for prefix in ['', 'sync:', 'digest:', 'args:']:
+                    cache.delete(prefix + cacheKey)
+                del cachedArgs[cacheKey]
+            if cacheKey not in cachedArgs:
+                for (otherKey, otherArgs) in sorted(cachedArgs.items()):
+                    if otherKey.split(':')[-1] == entityKey and Directory.__argsCover(otherArgs, args):
+                        log.debug('Serving ' + entityKey + ' for fetch profile ' + profile + ' from cache entry ' + otherKey)
+                        (cacheKey, args) = (otherKey, otherArgs)
+                        break
+            plan.append((entityKey, cacheKey, entitySuffix, args))
+        return plan
+
+    def __retrieveEntities(self, cache, profile : str, plan : list, fetchThreads : int, deltaSync : bool, graphBackend : str, debug : bool):
+        # returns the entity lists retrieved from the cache and/or MOLGENIS, or None if the processed state has been loaded from the cache
+        log.info('Retrieving directory content from ' + self.__directoryURL)
+        if self.__username is not None and self.__password is not None:
+            log.info("Logging in to MOLGENIS with a user account.")
+            log.debug('username: ' + self.__username)
+            log.debug('password: ' + self.__password)
+
+        # entities not needed by the profile remain empty
+        entities = { entityKey : [] for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList }
+        fetchList = []
+        syncList = []
+        for (entityKey, cacheKey, entitySuffix, entityArgs) in plan:
+            if self.__transport.bypassCache:
+                fetchList.append((entityKey, cacheKey, entitySuffix, entityArgs))
+            elif cacheKey in cache and deltaSync:
+                if entityKey in Directory.deltaSyncUnsupported:
+                    log.info('   ... ' + entityKey + ' have no ' + Directory.deltaSyncTimestampAttribute + ' attribute, retrieving all of them')
+                    fetchList.append((entityKey, cacheKey, entitySuffix, entityArgs))
+                elif 'sync:' + cacheKey in cache:
+                    syncList.append((entityKey, cacheKey, entitySuffix, entityArgs))
+                else:
+                    # no synchronization point known for the cached data, hence we need to retrieve everything once
+                    fetchList.append((entityKey, cacheKey, entitySuffix, entityArgs))
+            elif cacheKey not in cache:
+                fetchList.append((entityKey, cacheKey, entitySuffix, entityArgs))
+
+        # warm start: if none of the cached entities is to be refreshed and there is a processed state built from the very same entities, we load it instead of rebuilding the structures
+        stateCacheKey = Directory.__cacheKey(profile, 'state')
+        if not fetchList and not syncList:
+            stateKey = Directory.__stateKey(cache, plan, graphBackend)
+            if stateCacheKey in cache:
+                start_time = time.perf_counter()
+                try:
+                    (stateVersion, cachedStateKey, state) = cache[stateCacheKey]
+                except Exception as e:
+                    # e.g., the state has been stored by a version with different classes
+                    log.debug('Processed directory structure in cache can\'t be loaded: ' + str(e))
+                    (stateVersion, cachedStateKey, state) = (None, None, None)
+                if stateVersion == Directory.stateVersion and cachedStateKey == stateKey:
+                    cache.recordLookup(True)
+                    self.__dict__.update(state)
+                    end_time = time.perf_counter()
+                    log.info('   ... loaded processed directory structure from cache in ' + "%0.3f" % (end_time-start_time) + 's')
+                    return None
+                log.info('   ... processed directory structure in cache is outdated')
+
+        refreshed = [e[1] for e in fetchList + syncList]
+        for (entityKey, cacheKey, entitySuffix, entityArgs) in plan:
+            if cacheKey in cache and cacheKey not in refreshed:
+                log.info('   ... retrieving ' + entityKey + ' from cache')
+                entities[entityKey] = cache[cacheKey]
+            cache.recordLookup(cacheKey not in refreshed)
+
+        if fetchList or syncList:
+            # the entities do not depend on each other, hence we fetch them concurrently - each worker has its own MOLGENIS session
             start_time = time.perf_counter()
-            self.facts = session.get(self.__package + "_facts")
-            cache['facts'] = self.facts
+            with ThreadPoolExecutor(max_workers=max(1, min(fetchThreads, len(fetchList) + len(syncList)))) as executor:
+                futures = {executor.submit(profiling.propagate(self.__fetchEntity), entityKey, entitySuffix, entityArgs): (entityKey, cacheKey, entityArgs) for (entityKey, cacheKey, entitySuffix, entityArgs) in fetchList}
+                futures.update({executor.submit(profiling.propagate(self.__syncEntity), entityKey, entitySuffix, entityArgs, cache[cacheKey], cache['sync:' + cacheKey]): (entityKey, cacheKey, entityArgs) for (entityKey, cacheKey, entitySuffix, entityArgs) in syncList})
+                for future in as_completed(futures):
+                    (entityKey, cacheKey, entityArgs) = futures[future]
+                    (entities[entityKey], syncTime, entityArgs) = future.result()
+                    cache[cacheKey] = entities[entityKey]
+                    cache['sync:' + cacheKey] = syncTime
+                    cache['digest:' + cacheKey] = Directory.__entityDigest(entities[entityKey])
+                    cache['args:' + cacheKey] = entityArgs
             end_time = time.perf_counter()
-            log.info('   ... retrieved facts in ' + "%0.3f" % (end_time-start_time) + 's')
-        log.info('   ... all entities retrieved')
-        self.contactHashmap = {}
+            log.info('   ... retrieved ' + ', '.join([e[0] for e in fetchList + syncList]) + ' in ' + "%0.3f" % (end_time-start_time) + 's total')
+            if syncList:
+                self.__refreshReferences(cache, plan, entities)
+            if debug and self.__pp is not None and 'collections' in [e[0] for e in fetchList]:
+                for c in entities['collections']:
+                    self.__pp.pprint(c)
+        return entities
 
-        log.info('Processing directory data')
+    def __refreshReferences(self, cache, plan : list, entities : dict):
+        # the delta synchronization retrieves only the modified rows, hence the rows not modified still hold the reverse references (e.g., the
+        # collections of a biobank) and the expanded data of the referenced rows (e.g., contact email) from their last retrieval
+        start_time = time.perf_counter()
+        Directory.resolveReferences({ entityKey : entities[entityKey] for (entityKey, cacheKey, entitySuffix, entityArgs) in plan },
+                { entityKey : Directory.__attributeSet(entityArgs.get('expand')) for (entityKey, cacheKey, entitySuffix, entityArgs) in plan })
+        for (entityKey, cacheKey, entitySuffix, entityArgs) in plan:
+            digest = Directory.__entityDigest(entities[entityKey])
+            if cache.get('digest:' + cacheKey) != digest:
+                cache[cacheKey] = entities[entityKey]
+                cache['digest:' + cacheKey] = digest
+        end_time = time.perf_counter()
+        log.info('   ... refreshed references between the synchronized entities in ' + "%0.3f" % (end_time-start_time) + 's')
+
+    @staticmethod
+    def resolveReferences(entities : dict, references : dict):
+        # rebuilds the mappedBy references (see mappedByReferences) of the entity lists given as entity key -> rows from the references they are
+        # the inverse of, and replaces the references given as entity key -> attributes by the scalar attributes of the referenced rows: references
+        # holding just the ID get all of them, expanded references keep their attributes with the current values; unknown rows are kept as they are
+        rows = {}
+        for entityList in entities.values():
+            for e in entityList:
+                rows[e['id']] = { k : v for (k, v) in e.items() if not isinstance(v, (dict, list)) }
+        for ((entityKey, attribute), (referencingKey, referencingAttribute)) in Directory.mappedByReferences.items():
+            if entityKey not in entities or referencingKey not in entities:
+                continue
+            inverse = {}
+            for r in entities[referencingKey]:
+                if isinstance(r.get(referencingAttribute), dict):
+                    inverse.setdefault(r[referencingAttribute]['id'], []).append(r['id'])
+            for e in entities[entityKey]:
+                # the order of the references still valid is kept, the new ones are appended
+                current = inverse.get(e['id'], [])
+                currentSet = set(current)
+                previous = { ref['id'] : ref for ref in e.get(attribute, []) if ref['id'] in currentSet }
+                e[attribute] = list(previous.values()) + [{'id': i} for i in current if i not in previous]
+
+        def resolve(ref : dict) -> dict:
+            row = rows.get(ref['id'])
+            if row is None:
+                return ref
+            if set(ref) <= {'id', '_href'}:
+                return row
+            return { k : row.get(k, v) for (k, v) in ref.items() }
+
+        for (entityKey, attributes) in references.items():
+            for e in entities.get(entityKey, []):
+                for attribute in attributes:
+                    if attribute not in e:
+                        continue
+                    if isinstance(e[attribute], list):
+                        e[attribute] = [resolve(r) for r in e[attribute]]
+                    elif isinstance(e[attribute], dict):
+                        e[attribute] = resolve(e[attribute])
+
+    @staticmethod
+    def __entityDigest(data) -> str:
+        return hashlib.sha256(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    @staticmethod
+    def __cachedDigests(cache, plan : list) -> dict:
+        return { entityKey : cache['digest:' + cacheKey] for (entityKey, cacheKey, entitySuffix, entityArgs) in plan if 'digest:' + cacheKey in cache }
+
+    @staticmethod
+    def __stateKey(cache, plan : list, graphBackend : str) -> str:
+        # the processed state is keyed by the digests of the raw entity lists it was built from
+        digests = []
+        for (entityKey, cacheKey, entitySuffix, entityArgs) in plan:
+            if 'digest:' + cacheKey not in cache:
+                cache['digest:' + cacheKey] = Directory.__entityDigest(cache[cacheKey])
+            digests.append(entityKey + '=' + cache['digest:' + cacheKey])
+        return hashlib.sha256(('|'.join(digests) + '|' + graphBackend).encode('utf-8')).hexdigest()
+
+    def __buildStructure(self, graphBackend : str):
+        # everything set up here is stored as the processed state in the cache
+        self.contactHashmap = {}
+        # networkx graphs by default, 'compact' selects the array-backed graphs from compactgraph (networkx is then needed only for exports)
+        log.debug('Using graph backend: ' + graphBackend)
         # Graph containing only biobanks and collections
-        self.directoryGraph = nx.DiGraph()
+        self.directoryGraph = compactgraph.newDiGraph(graphBackend)
         # DAG containing only biobanks and collections
-        self.directoryCollectionsDAG = nx.DiGraph()
+        self.directoryCollectionsDAG = compactgraph.newDiGraph(graphBackend)
         # Weighted graph linking contacts to biobanks/collections/networks
-        self.contactGraph = nx.DiGraph()
+        self.contactGraph = compactgraph.newDiGraph(graphBackend)
         # Graph linking networks to biobanks/collections
-        self.networkGraph = nx.DiGraph()
+        self.networkGraph = compactgraph.newDiGraph(graphBackend)
         for c in self.contacts:
             if self.contactGraph.has_node(c['id']):
                 raise Exception('DirectoryStructure', 'Conflicting ID found in contactGraph: ' + c['id'])
@@ -217,17 +704,234 @@ class Directory:
                 self.networkGraph.add_edge(e[1],e[0])
 
         # now make graphs immutable
-        nx.freeze(self.directoryGraph)
-        nx.freeze(self.directoryCollectionsDAG)
-        nx.freeze(self.contactGraph)
-        nx.freeze(self.networkGraph)
+        compactgraph.freeze(self.directoryGraph)
+        compactgraph.freeze(self.directoryCollectionsDAG)
+        compactgraph.freeze(self.contactGraph)
+        compactgraph.freeze(self.networkGraph)
 
         # we check that DAG is indeed DAG :-)
-        if not nx.algorithms.dag.is_directed_acyclic_graph(self.directoryCollectionsDAG):
+        if not compactgraph.is_directed_acyclic_graph(self.directoryCollectionsDAG):
             raise Exception('DirectoryStructure', 'Collection DAG is not DAG')
 
-        log.info('Directory structure initialized')
-        self.__orphacodesmapper = None
+        self.__buildIndexes()
+        self.__buildFeatures()
+        self.__buildCounts()
+        self.__buildClosure()
+
+    def __buildIndexes(self):
+        # hash-indexed entity store so that the accessors do not need to scan the entity lists
+        self.biobankHashmap = { b['id'] : b for b in self.biobanks }
+        self.collectionHashmap = { c['id'] : c for c in self.collections }
+        self.networkHashmap = { n['id'] : n for n in self.networks }
+        # collection ID -> ID of the parent collection (None for top-level collections)
+        self.__collectionParent = {}
+        # biobank ID -> IDs of all its collections
+        self.__biobankCollections = { b['id'] : [] for b in self.biobanks }
+        # contact ID -> IDs of biobanks/collections/networks having the contact
+        self.__contactEntities = { c['id'] : [] for c in self.contacts }
+        for c in self.collections:
+            self.__collectionParent[c['id']] = c['parent_collection']['id'] if 'parent_collection' in c else None
+            self.__biobankCollections.setdefault(c['biobank']['id'], []).append(c['id'])
+        for e in self.biobanks + self.collections + self.networks:
+            if 'contact' in e:
+                self.__contactEntities.setdefault(e['contact']['id'], []).append(e['id'])
+
+    def __entityContactEmail(self, entity : dict):
+        if 'contact' not in entity:
+            return None
+        contact = self.contactHashmap.get(entity['contact']['id'], entity['contact'])
+        return contact.get('email', entity['contact'].get('email'))
+
+    def __buildFeatures(self):
+        self.__biobankFeatures = {}
+        for b in self.biobanks:
+            self.__biobankFeatures[b['id']] = BiobankFeatures(
+                    NN = b['country']['id'] if 'country' in b else None,
+                    contactEmail = self.__entityContactEmail(b),
+                    capabilities = Directory.getListOfEntityAttributeIds(b, 'capabilities'),
+                    covid = Directory.getListOfEntityAttributeIds(b, 'covid19biobank'),
+                    networks = Directory.getListOfEntityAttributeIds(b, 'network'))
+        self.__collectionFeatures = {}
+        for c in self.collections:
+            diagnoses = Directory.getListOfEntityAttributeIds(c, 'diagnosis_available')
+            biobankFeatures = self.__biobankFeatures.get(c['biobank']['id'])
+            self.__collectionFeatures[c['id']] = CollectionFeatures(
+                    NN = biobankFeatures.NN if biobankFeatures is not None else None,
+                    biobankId = c['biobank']['id'],
+                    contactEmail = self.__entityContactEmail(c),
+                    OoM = c['order_of_magnitude']['id'] if 'order_of_magnitude' in c else None,
+                    materials = Directory.getListOfEntityAttributeIds(c, 'materials'),
+                    data_categories = Directory.getListOfEntityAttributeIds(c, 'data_categories'),
+                    types = Directory.getListOfEntityAttributeIds(c, 'type'),
+                    networks = Directory.getListOfEntityAttributeIds(c, 'network'),
+                    diagnoses = diagnoses,
+                    diagnosisCodes = [d for d in diagnoses if '-' not in d],
+                    diagnosisRanges = [d for d in diagnoses if '-' in d],
+                    diagnosesICD10 = [d[len('urn:miriam:icd:'):] for d in diagnoses if d.startswith('urn:miriam:icd:')],
+                    diagnosesORPHA = [d[len('ORPHA:'):] for d in diagnoses if d.startswith('ORPHA:')],
+                    imagingModalities = Directory.getListOfEntityAttributeIds(c, 'imaging_modality'),
+                    imageDatasetTypes = Directory.getListOfEntityAttributeIds(c, 'image_dataset_type'),
+                    sex = Directory.getListOfEntityAttributeIds(c, 'sex'))
+        # collection ID -> facts of the collection
+        self.__collectionFacts = {}
+        for f in self.facts:
+            if 'collection' in f:
+                self.__collectionFacts.setdefault(f['collection']['id'], []).append(f)
+
+    @staticmethod
+    def __hasIntMetric(entity : dict, metric : str) -> bool:
+        return metric in entity and isinstance(entity[metric], int)
+
+    def __buildCounts(self):
+        # single topological pass over the collection DAG precomputing countability of the collections and the sample/donor counts
+        # a collection is countable for a metric if it provides the metric and none of its ancestors does (otherwise it would be double-counted)
+        self.__countableCollections = { 'size' : set(), 'number_of_donors' : set() }
+        hasCountableAncestor = { 'size' : {}, 'number_of_donors' : {} }
+        self.__collectionCounts = {}
+        self.__biobankCounts = { b['id'] : { 'samplesExplicit' : 0, 'donorsExplicit' : 0, 'samplesIncOoM' : 0, 'donorsIncOoM' : 0 } for b in self.biobanks }
+        for collectionID in compactgraph.topological_sort(self.directoryCollectionsDAG):
+            if collectionID not in self.collectionHashmap:
+                continue
+            collection = self.collectionHashmap[collectionID]
+            parentID = self.__collectionParent[collectionID]
+            parent = self.collectionHashmap.get(parentID) if parentID is not None else None
+            for metric in hasCountableAncestor:
+                if parent is None:
+                    hasCountableAncestor[metric][collectionID] = False
+                else:
+                    if parentID not in hasCountableAncestor[metric]:
+                        # the parent pointer is not consistent with the DAG edges - resolve the parent first
+                        hasCountableAncestor[metric][parentID] = self.__walkCountableAncestor(parentID, metric)
+                    hasCountableAncestor[metric][collectionID] = Directory.__hasIntMetric(parent, metric) or hasCountableAncestor[metric][parentID]
+                if Directory.__hasIntMetric(collection, metric) and not hasCountableAncestor[metric][collectionID]:
+                    self.__countableCollections[metric].add(collectionID)
+
+            # note that OoM is only counted for top-level collections to avoid double counting - because OoM is mandatory parameter, any child collection has a parent which has OoM filled in
+            # Intentionally, the lower bound of the OoM interval is taken - the size of the collection should be in the range of 10**OoM to 10**(OoM+1)
+            counts = { 'samplesExplicit' : 0, 'donorsExplicit' : 0, 'samplesIncOoM' : 0, 'donorsIncOoM' : 0 }
+            if collectionID in self.__countableCollections['size']:
+                counts['samplesExplicit'] = collection['size']
+                counts['samplesIncOoM'] = collection['size']
+            elif parentID is None and 'order_of_magnitude' in collection:
+                counts['samplesIncOoM'] = int(10 ** collection['order_of_magnitude']['id'])
+            if collectionID in self.__countableCollections['number_of_donors']:
+                counts['donorsExplicit'] = collection['number_of_donors']
+                counts['donorsIncOoM'] = collection['number_of_donors']
+            elif parentID is None and 'order_of_magnitude_donors' in collection and collection['order_of_magnitude_donors']['id']:
+                counts['donorsIncOoM'] = int(10 ** collection['order_of_magnitude_donors']['id'])
+            self.__collectionCounts[collectionID] = counts
+            biobankID = collection['biobank']['id']
+            if biobankID in self.__biobankCounts and not ('withdrawn' in collection and collection['withdrawn']):
+                for k in counts:
+                    self.__biobankCounts[biobankID][k] += counts[k]
+
+    def __walkCountableAncestor(self, collectionID : str, metric : str) -> bool:
+        parentID = self.__collectionParent.get(collectionID)
+        while parentID is not None and parentID in self.collectionHashmap:
+            if Directory.__hasIntMetric(self.collectionHashmap[parentID], metric):
+                return True
+            parentID = self.__collectionParent.get(parentID)
+        return False
+
+    def __buildClosure(self):
+        # interval labelling of the collection DAG: nodes are numbered in DFS pre-order, hence descendants of a node form
+        # a contiguous interval of the order following the node and ancestor/descendant queries need no subgraph views
+        # this only works for a forest (biobank trees) - if some node has more than one parent, queries fall back to graph traversal
+        self.__closureForest = all(d <= 1 for (n, d) in self.directoryCollectionsDAG.in_degree())
+        self.__closureOrder = []
+        self.__closurePre = {}
+        self.__closureSize = {}
+        self.__closureParent = {}
+        self.__closureRoot = {}
+        if not self.__closureForest:
+            log.warning('DirectoryStructure - collection DAG is not a forest, ancestor/descendant queries will be slower')
+            return
+        for root in self.directoryCollectionsDAG.nodes:
+            if self.directoryCollectionsDAG.in_degree(root) > 0:
+                continue
+            self.__closureParent[root] = None
+            stack = [(root, False)]
+            while stack:
+                (node, finished) = stack.pop()
+                if finished:
+                    self.__closureSize[node] = len(self.__closureOrder) - self.__closurePre[node]
+                    continue
+                self.__closurePre[node] = len(self.__closureOrder)
+                self.__closureOrder.append(node)
+                self.__closureRoot[node] = root
+                stack.append((node, True))
+                for child in self.directoryCollectionsDAG.successors(node):
+                    self.__closureParent[child] = node
+                    stack.append((child, False))
+
+    def __newSession(self):
+        session = self.__transport.session(self.__directoryURL)
+        if self.__username is not None and self.__password is not None:
+            session.login(self.__username, self.__password)
+        return session
+
+    @staticmethod
+    def __syncTimestamp():
+        return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S%z')
+
+    def __fetchEntity(self, entityKey : str, entitySuffix : str, entityArgs : dict):
+        # runs in a worker thread, hence it uses its own MOLGENIS session
+        # returns the rows, the time of the synchronization and the arguments actually used to retrieve them (to be stored with the rows)
+        log.info('   ... retrieving ' + entityKey)
+        start_time = time.perf_counter()
+        syncTime = Directory.__syncTimestamp()
+        session = self.__newSession()
+        if entityKey == 'biobanks':
+            # TODO: remove exception handling once BBMRI.uk staging has been fixed
+            try:
+                profiling.countRemoteCall()
+                data = session.get(self.__package + entitySuffix, **entityArgs)
+            except:
+                log.warning("Using work-around for inconsistence in the database structure.")
+                # the rows lack the other expansions (and the projection/limit is not applied), hence they must not be stored as retrieved using entityArgs
+                entityArgs = {'expand': 'contact,collections,country'}
+                profiling.countRemoteCall()
+                data = session.get(self.__package + entitySuffix, **entityArgs)
+        else:
+            profiling.countRemoteCall()
+            data = session.get(self.__package + entitySuffix, **entityArgs)
+        end_time = time.perf_counter()
+        log.info('   ... retrieved ' + entityKey + ' in ' + "%0.3f" % (end_time-start_time) + 's')
+        return (data, syncTime, entityArgs)
+
+    def __syncEntity(self, entityKey : str, entitySuffix : str, entityArgs : dict, cachedData : list, lastSync : str):
+        # incremental refresh of a cached entity list: only rows modified since the last sync are retrieved, deletions are detected by reconciling the IDs
+        log.info('   ... synchronizing ' + entityKey + ' modified since ' + lastSync)
+        start_time = time.perf_counter()
+        syncTime = Directory.__syncTimestamp()
+        session = self.__newSession()
+        entity = self.__package + entitySuffix
+        try:
+            profiling.countRemoteCall()
+            changed = session.get(entity, q=Directory.deltaSyncTimestampAttribute + '=ge=' + quote(lastSync, safe=''), **entityArgs)
+        except Exception as e:
+            log.warning('Incremental synchronization of ' + entityKey + ' is not possible (' + str(e) + '), retrieving all of them.')
+            return self.__fetchEntity(entityKey, entitySuffix, entityArgs)
+        profiling.countRemoteCall()
+        currentIDs = [row['id'] for row in session.get(entity, attributes='id', batch_size=10000)]
+        if 'num' in entityArgs:
+            currentIDs = currentIDs[:entityArgs['num']]
+        currentIDset = set(currentIDs)
+        rowsById = {row['id'] : row for row in cachedData if row['id'] in currentIDset}
+        deleted = len(cachedData) - len(rowsById)
+        for row in changed:
+            rowsById[row['id']] = row
+        missingIDs = [rowID for rowID in currentIDs if rowID not in rowsById]
+        if missingIDs:
+            # rows not modified since the last sync but not present in the cache (e.g., created with a back-dated timestamp)
+            log.debug('Retrieving ' + str(len(missingIDs)) + ' ' + entityKey + ' missing in the cache')
+            profiling.countRemoteCall()
+            for row in session.get(entity, q='id=in=(' + ','.join([quote(rowID, safe=':') for rowID in missingIDs]) + ')', **{k : v for (k, v) in entityArgs.items() if k != 'num'}):
+                rowsById[row['id']] = row
+        data = [rowsById[rowID] for rowID in currentIDs if rowID in rowsById]
+        end_time = time.perf_counter()
+        log.info('   ... synchronized ' + entityKey + ' in ' + "%0.3f" % (end_time-start_time) + 's (' + str(len(changed)) + ' modified, ' + str(deleted) + ' deleted, ' + str(len(missingIDs)) + ' missing)')
+        return (data, syncTime, entityArgs)
 
     def setOrphaCodesMapper(self, o):
         self.__orphacodesmapper = o
@@ -241,13 +945,23 @@ class Directory:
     def getOrphaCodesMapper(self):
         return self.__orphacodesmapper
 
+    # where the content comes from (the directory cache namespace, or the package of a snapshot), e.g., to keep the results of the checks
+    # of different servers or packages apart
+    def getContentScope(self) -> str:
+        return self.__contentScope
+
+    # digest of the raw entity list (biobanks, collections, contacts, networks or facts), which changes whenever its content changes;
+    # taken from the directory cache or computed once
+    def getEntityDigest(self, entityKey : str) -> str:
+        if entityKey not in self.__entityDigests:
+            self.__entityDigests[entityKey] = Directory.__entityDigest(getattr(self, entityKey))
+        return self.__entityDigests[entityKey]
+
     def getBiobanks(self):
         return self.biobanks
 
     def getBiobankById(self, biobankId : str):
-        for b in self.biobanks:
-            if b['id'] == biobankId:
-                return b
+        return self.biobankHashmap.get(biobankId)
 
     def getBiobanksCount(self):
         return len(self.biobanks)
@@ -258,57 +972,56 @@ class Directory:
         #if self.pp is not None:
             #pp.pprint(data)
         #biobank = data[biobankID]
-        biobank = self.directoryGraph.nodes[biobankID]['data']
+        biobank = self.biobankHashmap[biobankID]
         return biobank['country']['id']
 
     def getCollections(self):
         return self.collections
 
     def getCollectionById(self, collectionId : str):
-        for c in self.collections:
-            if c['id'] == collectionId:
-                return c
+        return self.collectionHashmap.get(collectionId)
 
     def getCollectionsCount(self):
         return len(self.collections)
 
     def getCollectionBiobankId(self, collectionID : str):
-        collection = self.directoryGraph.nodes[collectionID]['data']
+        collection = self.collectionHashmap[collectionID]
         return collection['biobank']['id']
 
     def getCollectionContact(self, collectionID : str):
-        collection = self.directoryGraph.nodes[collectionID]['data']
+        collection = self.collectionHashmap[collectionID]
         return self.contactHashmap[collection['contact']['id']]
 
+    def getCollectionParentId(self, collectionID : str):
+        return self.__collectionParent[collectionID]
+
+    def getBiobankCollectionIds(self, biobankID : str):
+        return self.__biobankCollections[biobankID]
+
     def isTopLevelCollection(self, collectionID : str):
-        collection = self.directoryGraph.nodes[collectionID]['data']
-        return not 'parent_collection' in collection
+        return self.__collectionParent[collectionID] is None
 
     def isCountableCollection(self, collectionID : str, metric : str):
         assert metric == 'number_of_donors' or metric == 'size' 
         # note that this is intentionally not implemented for OoM - since OoM is a required parameter and thus any child collection would be double-counted
-        collection = self.directoryGraph.nodes[collectionID]['data']
-        if not (metric in collection and isinstance(collection[metric], int)):
-            return False
-        else:
-            if not 'parent_collection' in collection:
-                return True
-            else:
-                parent = self.getCollectionById(collection['parent_collection']['id'])
-                parent_dist = 1
-                while parent is not None:
-                    if metric in parent and isinstance(parent[metric], int):
-                        log.debug(f'Collection {collectionID} is not countable as it has countable parent {parent["id"]} (distance {parent_dist}) for metric {metric}.')
-                        return False
-                    if 'parent_collection' in parent:
-                        parent = self.getCollectionById(parent['parent_collection']['id'])
-                        parent_dist += 1
-                    else:
-                        if parent_dist > 1:
-                            log.debug(f'Detected collection {collectionID} deeper than 1 from {parent["id"]} (distance {parent_dist}) for metric {metric}.')
-                        parent = None
-                return True
-                
+        return collectionID in self.__countableCollections[metric]
+
+    def getBiobankFeatures(self, biobankID : str) -> BiobankFeatures:
+        return self.__biobankFeatures[biobankID]
+
+    def getCollectionFeatures(self, collectionID : str) -> CollectionFeatures:
+        return self.__collectionFeatures[collectionID]
+
+    def getCollectionFacts(self, collectionID : str):
+        return self.__collectionFacts.get(collectionID, [])
+
+    # sample/donor counts contributed by the collection to aggregate statistics: explicit counts of countable collections and OoM estimates of top-level collections
+    def getCollectionCounts(self, collectionID : str):
+        return self.__collectionCounts[collectionID]
+
+    # sample/donor counts of a biobank aggregated over all its non-withdrawn collections
+    def getBiobankCounts(self, biobankID : str):
+        return self.__biobankCounts[biobankID]
 
     def getCollectionNN(self, collectionID):
         # TODO: handle IARC!
@@ -316,14 +1029,48 @@ class Directory:
 
     # return the whole subgraph including the biobank itself
     def getGraphBiobankCollectionsFromBiobank(self, biobankID : str):
-        return self.directoryCollectionsDAG.subgraph(nx.algorithms.dag.descendants(self.directoryCollectionsDAG, biobankID).union({biobankID}))
+        return self.directoryCollectionsDAG.subgraph(self.getCollectionsDescendants(biobankID).union({biobankID}))
 
     # return the whole subgraph including some collection
     def getGraphBiobankCollectionsFromCollection(self, collectionID : str):
-        return self.directoryCollectionsDAG.subgraph(nx.algorithms.dag.ancestors(self.directoryCollectionsDAG, collectionID).union(nx.algorithms.dag.descendants(self.directoryCollectionsDAG, collectionID)).union({collectionID}))
+        return self.directoryCollectionsDAG.subgraph(self.getCollectionsAncestors(collectionID).union(self.getCollectionsDescendants(collectionID)).union({collectionID}))
 
     def getCollectionsDescendants(self, collectionID : str):
-        return nx.algorithms.dag.descendants(self.directoryCollectionsDAG, collectionID)
+        if not self.__closureForest:
+            return compactgraph.descendants(self.directoryCollectionsDAG, collectionID)
+        pre = self.__closurePre[collectionID]
+        return set(self.__closureOrder[pre + 1 : pre + self.__closureSize[collectionID]])
+
+    # ancestors in the collection DAG, i.e., parent collections and the biobank
+    def getCollectionsAncestors(self, collectionID : str):
+        if not self.__closureForest:
+            return compactgraph.ancestors(self.directoryCollectionsDAG, collectionID)
+        ancestors = set()
+        parent = self.__closureParent[collectionID]
+        while parent is not None:
+            ancestors.add(parent)
+            parent = self.__closureParent[parent]
+        return ancestors
+
+    # number of nodes in the subtree rooted at the collection (or biobank), including the node itself
+    def getCollectionsSubtreeSize(self, collectionID : str):
+        if not self.__closureForest:
+            return len(compactgraph.descendants(self.directoryCollectionsDAG, collectionID)) + 1
+        return self.__closureSize[collectionID]
+
+    # root of the tree in the collection DAG containing the collection - normally the biobank of the collection
+    def getCollectionsRootId(self, collectionID : str):
+        if not self.__closureForest:
+            ancestors = compactgraph.ancestors(self.directoryCollectionsDAG, collectionID)
+            roots = [a for a in ancestors if self.directoryCollectionsDAG.in_degree(a) == 0]
+            return roots[0] if roots else collectionID
+        return self.__closureRoot[collectionID]
+
+    def isCollectionsAncestor(self, ancestorID : str, collectionID : str) -> bool:
+        if not self.__closureForest:
+            return ancestorID in compactgraph.ancestors(self.directoryCollectionsDAG, collectionID)
+        pre = self.__closurePre[ancestorID]
+        return pre < self.__closurePre[collectionID] < pre + self.__closureSize[ancestorID]
 
     def getContacts(self):
         return self.contacts
@@ -331,6 +1078,9 @@ class Directory:
     def getContact(self, contactID : str):
         return self.contactHashmap[contactID]
 
+    def getContactEntityIds(self, contactID : str):
+        return self.__contactEntities.get(contactID, [])
+
     def getContactNN(self, contactID : str):
         # TODO: handle IARC!
         return self.contactHashmap[contactID]['country']['id']
@@ -338,12 +1088,15 @@ class Directory:
     def getNetworks(self):
         return self.networks
 
+    def getNetworkById(self, networkId : str):
+        return self.networkHashmap.get(networkId)
+
     def getFacts(self):
         return self.facts
 
     def getNetworkNN(self, networkID : str):
         # TODO: review handling of IARC/EU/global collections
-        network = self.networkGraph.nodes[networkID]['data']
+        network = self.networkHashmap[networkID]
         NN = ""
         if 'country' in network:
             NN = network['country']['id']
@@ -0,0 +1,217 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Single-pass checks: plugins derived from EntityRulesPlugin register rules for particular entity types and
+# runEntityRules() walks each entity of the directory just once, dispatching it to the rules of all the plugins.
+# Plain IPlugin plugins implementing check() keep working alongside.
+# With a result cache, the warnings of EntityRulesPlugin rules are cached per (plugin, entity) and reused as long as the plugin (its
+# version, module and the arguments it depends on) and the content of the entity and of the related entities the plugin declares in
+# dependencies do not change, hence only the modified entities are checked again. Plain check() plugins can't declare per-entity
+# dependencies, their warnings are cached as a whole and reused as long as the entity lists they depend on do not change.
+
+import logging as log
+import hashlib
+import inspect
+import os.path
+import pickle
+import time
+
+from yapsy.IPlugin import IPlugin
+
+from customwarnings import DataCheckEntityType
+
+
+class EntityRulesPlugin(IPlugin):
+    # NB: plugin modules have to import the entityrules module rather than this class, since yapsy instantiates
+    # the first IPlugin subclass found in the (alphabetically sorted) module namespace
+
+    # to be increased whenever the rules change, so that the cached results are not reused
+    version = 1
+    # related entities the results depend on besides the entity itself (see dependencyResolvers), e.g., ['biobank', 'contact']
+    dependencies = []
+    # attributes of the arguments the results depend on, e.g., ['orphacodesfile'] (files are represented by their modification time)
+    argumentDependencies = []
+
+    def __init__(self):
+        super().__init__()
+        self.__rules = { entityType : [] for entityType in DataCheckEntityType }
+        self.registerRules()
+
+    def registerRules(self):
+        # to be overridden: register the rules of the plugin using addRule()
+        pass
+
+    # rule(dir, args, entity, NN) returns a list of DataCheckWarning objects (or None if there is nothing to report)
+    def addRule(self, entityType : DataCheckEntityType, rule):
+        self.__rules[entityType].append(rule)
+
+    def getRules(self, entityType : DataCheckEntityType):
+        return self.__rules[entityType]
+
+    def check(self, dir, args):
+        # the plugin can still be run on its own as any other IPlugin check
+        return runEntityRules(dir, args, [self])[0]
+
+
+def entityWalks(dir):
+    # (entity type, entities, function returning NN for the entity ID) in the order the entities are visited
+    return [
+            (DataCheckEntityType.BIOBANK, dir.getBiobanks(), dir.getBiobankNN),
+            (DataCheckEntityType.COLLECTION, dir.getCollections(), dir.getCollectionNN),
+            (DataCheckEntityType.CONTACT, dir.getContacts(), dir.getContactNN),
+            (DataCheckEntityType.NETWORK, dir.getNetworks(), dir.getNetworkNN),
+            ]
+
+def __collectionParent(dir, entityType, entity):
+    if entityType == DataCheckEntityType.COLLECTION and 'parent_collection' in entity:
+        return dir.getCollectionById(entity['parent_collection']['id'])
+    return None
+
+def __entityContact(dir, entityType, entity):
+    if 'contact' in entity:
+        return dir.contactHashmap.get(entity['contact']['id'])
+    return None
+
+# related entities a plugin can declare in dependencies: name -> function(dir, entity type, entity) returning the related data
+dependencyResolvers = {
+        'biobank': lambda dir, entityType, entity: dir.getBiobankById(entity['biobank']['id']) if entityType == DataCheckEntityType.COLLECTION else None,
+        'parent': __collectionParent,
+        'contact': __entityContact,
+        'collections': lambda dir, entityType, entity: [dir.getCollectionById(c) for c in dir.getBiobankCollectionIds(entity['id'])] if entityType == DataCheckEntityType.BIOBANK else None,
+        'facts': lambda dir, entityType, entity: dir.getCollectionFacts(entity['id']) if entityType == DataCheckEntityType.COLLECTION else None,
+        }
+
+# entity lists of the directory (see Directory.getEntityDigest); plain check() plugins depend on all of them unless they declare
+# the ones they use in the entityListDependencies attribute
+entityLists = ['biobanks', 'collections', 'contacts', 'networks', 'facts']
+
+# results cached by the former versions are dropped once (see dropLegacyResults)
+resultsLayout = 4
+
+def __argumentStamp(value):
+    # files given as arguments are represented by their modification time and size, so that a changed file invalidates the results
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [(v, os.path.getmtime(v), os.path.getsize(v)) if isinstance(v, str) and os.path.isfile(v) else v for v in values]
+
+def __moduleDigest(plugin) -> str:
+    try:
+        with open(inspect.getfile(plugin.__class__), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (TypeError, OSError):
+        return None
+
+def __digest(content) -> str:
+    # pickled as Directory does for the digests of the entity lists, which is several times faster than JSON (a different order of the
+    # attributes gives a different digest, i.e., the entity is just checked again)
+    return hashlib.sha256(pickle.dumps(content, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+def pluginKey(args, plugin) -> str:
+    # part of the result keys given by the plugin: its version and module, and the arguments it depends on
+    content = [plugin.__class__.__name__, getattr(plugin, 'version', None), __moduleDigest(plugin)]
+    content += [(name, __argumentStamp(getattr(args, name, None))) for name in getattr(plugin, 'argumentDependencies', [])]
+    return __digest(content)
+
+def __entityDigest(entity, digests : dict):
+    # content digest of the entity (or of a list of entities) memoized in digests by the entity ID, since the same entities are hashed
+    # for each plugin and as related entities of the others
+    if entity is None:
+        return None
+    if isinstance(entity, list):
+        return [__entityDigest(e, digests) for e in entity]
+    if entity['id'] not in digests:
+        digests[entity['id']] = __digest(entity)
+    return digests[entity['id']]
+
+def entityKey(dir, plugin : EntityRulesPlugin, pluginKey : str, entityType : DataCheckEntityType, entity : dict, NN : str, digests : dict) -> str:
+    related = [__entityDigest(dependencyResolvers[d](dir, entityType, entity), digests) for d in plugin.dependencies]
+    return hashlib.sha256('|'.join([pluginKey, str(NN), __entityDigest(entity, digests), repr(related)]).encode('utf-8')).hexdigest()
+
+# entity lists of the entities the rules are registered for and of the related entities in dependencies
+entityTypeLists = {
+        DataCheckEntityType.BIOBANK : 'biobanks',
+        DataCheckEntityType.COLLECTION : 'collections',
+        DataCheckEntityType.CONTACT : 'contacts',
+        DataCheckEntityType.NETWORK : 'networks',
+        }
+dependencyLists = { 'biobank' : 'biobanks', 'parent' : 'collections', 'contact' : 'contacts', 'collections' : 'collections', 'facts' : 'facts' }
+
+def listsKey(dir, plugin : EntityRulesPlugin, pluginKey : str) -> str:
+    # the entity keys stored with the same key of the entity lists are all still valid, hence they do not need to be computed again
+    lists = { entityTypeLists[t] for t in DataCheckEntityType if plugin.getRules(t) } | { dependencyLists[d] for d in plugin.dependencies }
+    return __digest([pluginKey] + [(entityList, dir.getEntityDigest(entityList)) for entityList in sorted(lists)])
+
+def __resultsKey(dir, plugin):
+    # results of the different servers and packages are kept apart, so that alternating runs do not overwrite each other's results
+    return ('results', plugin.__class__.__name__, dir.getContentScope())
+
+def dropLegacyResults(cache):
+    if cache.get('layout') != resultsLayout:
+        log.info('Dropping the cached results of the checks stored by a former version')
+        cache.clear()
+        cache['layout'] = resultsLayout
+
+def cachedResults(cache, dir, args, plugin, run) -> list:
+    # warnings of a plain check() plugin from the result cache (caches.ManagedCache), or returned by run() and cached if there are none
+    # for the current plugin and the digests of the entity lists it depends on
+    key = __digest([pluginKey(args, plugin)] + [(entityList, dir.getEntityDigest(entityList)) for entityList in getattr(plugin, 'entityListDependencies', entityLists)])
+    cached = cache.get(__resultsKey(dir, plugin))
+    hit = cached is not None and cached[0] == key
+    cache.recordLookup(hit)
+    if hit:
+        log.info('   ... reused cached results of ' + plugin.__class__.__name__)
+        return cached[1]
+    warnings = run()
+    cache[__resultsKey(dir, plugin)] = (key, warnings)
+    return warnings
+
+def runEntityRules(dir, args, plugins : list, cache=None) -> list:
+    # returns the list of warnings for each of the plugins (in the order of the plugins)
+    # cache (caches.ManagedCache) enables reusing results of the unchanged entities from previous runs: the results of each plugin are
+    # stored as a single entry (key of the entity lists, (entity type, entity ID) -> (entity key, warnings)), only the entities whose
+    # key changed are checked; if none of the entity lists the plugin depends on changed, the entity keys are not computed at all
+    warnings = [[] for p in plugins]
+    log.info("Running single-pass entity rules (" + ', '.join([p.__class__.__name__ for p in plugins]) + ")")
+    if cache is not None:
+        pluginKeys = [pluginKey(args, p) for p in plugins]
+        listsKeys = [listsKey(dir, p, pluginKeys[i]) for (i, p) in enumerate(plugins)]
+        cached = [cache.get(__resultsKey(dir, p), (None, {})) for p in plugins]
+        unchanged = [cached[i][0] == listsKeys[i] for i in range(len(plugins))]
+        results = [{} for p in plugins]
+        (hits, misses) = ([0 for p in plugins], [0 for p in plugins])
+        digests = {}
+    for (entityType, entities, getNN) in entityWalks(dir):
+        pluginRules = [(i, p, p.getRules(entityType)) for (i, p) in enumerate(plugins) if p.getRules(entityType)]
+        if not pluginRules:
+            continue
+        start_time = time.perf_counter()
+        for entity in entities:
+            NN = getNN(entity['id'])
+            for (i, plugin, rules) in pluginRules:
+                if cache is not None:
+                    resultID = (entityType.value, entity['id'])
+                    entry = cached[i][1].get(resultID)
+                    key = None if unchanged[i] and entry is not None else entityKey(dir, plugin, pluginKeys[i], entityType, entity, NN, digests)
+                    if entry is not None and (key is None or entry[0] == key):
+                        warnings[i].extend(entry[1])
+                        results[i][resultID] = entry
+                        hits[i] += 1
+                        continue
+                    misses[i] += 1
+                entityWarnings = []
+                for rule in rules:
+                    ruleWarnings = rule(dir, args, entity, NN)
+                    if ruleWarnings:
+                        entityWarnings.extend(ruleWarnings)
+                if cache is not None:
+                    results[i][resultID] = (key, entityWarnings)
+                warnings[i].extend(entityWarnings)
+        end_time = time.perf_counter()
+        log.debug('   ... ' + str(sum([len(r) for (i, p, r) in pluginRules])) + ' rules on ' + str(len(entities)) + ' ' + entityType.value.lower() + ' entities evaluated in ' + "%0.3f" % (end_time-start_time) + 's')
+    if cache is not None:
+        for i in range(len(plugins)):
+            cache.recordLookup(True, hits[i])
+            cache.recordLookup(False, misses[i])
+            # the results of the removed entities are dropped as well
+            if misses[i] > 0 or not unchanged[i] or len(results[i]) != len(cached[i][1]):
+                cache[__resultsKey(dir, plugins[i])] = (listsKeys[i], results[i])
+        log.info('   ... reused cached results for ' + str(sum(hits)) + ' (plugin, entity) pairs, checked ' + str(sum(misses)))
+    return warnings
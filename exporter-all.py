@@ -12,8 +12,6 @@ import json
 import pandas as pd
 
 from directory import Directory
-from orphacodes import OrphaCodes
-from icd10codeshelper import ICD10CodesHelper
 import pddfutils
 
 cachesList = ['directory', 'emails', 'geocoding', 'URLs']
@@ -48,6 +46,7 @@ parser.add_argument('--purge-cache', dest='purgeCaches', nargs='+', action='exte
                     help='disable particular long remote checks')
 parser.add_argument('-F', '--filter-coll-type', dest='filterCollType', nargs=1,
                     help='filter by the collection type provided as parameter (only one type allowed)')
+parser.add_argument('--snapshot', dest='snapshot', help='load the directory from a local snapshot directory with JSON or EMX entity files instead of MOLGENIS')
 parser.set_defaults(disableChecksRemote=[], disablePlugins=[], purgeCaches=[])
 args = parser.parse_args()
 filterCollType = args.filterCollType[0] if args.filterCollType else None #NOTE: only one type accepted for now
@@ -77,8 +76,10 @@ targetColls = []
 def analyseCollections(collections, allCollectionSamplesExplicit, allCollectionDonorsExplicit, allCollectionSamplesIncOoM, allCollectionDonorsIncOoM):
     for collection in collections:
         log.debug("Analyzing collection " + collection['id'])
-        biobankId = dir.getCollectionBiobankId(collection['id'])
+        features = dir.getCollectionFeatures(collection['id'])
+        biobankId = features.biobankId
         biobank = dir.getBiobankById(biobankId)
+        biobankFeatures = dir.getBiobankFeatures(biobankId)
 
         collection_withdrawn = False
         if 'withdrawn' in collection and collection['withdrawn']:
@@ -93,40 +94,13 @@ def analyseCollections(collections, allCollectionSamplesExplicit, allCollectionD
         if collection_withdrawn:
             continue
 
-        biobank_capabilities = []
-        if 'capabilities' in biobank:
-            for c in biobank['capabilities']:
-                biobank_capabilities.append(c['id'])
-        biobank_covid = []
-        if 'covid19biobank' in biobank:
-            for c in biobank['covid19biobank']:
-                biobank_covid.append(c['id'])
-        biobank_networks = []
-        if 'network' in biobank:
-            for n in biobank['network']:
-                biobank_networks.append(n['id'])
-
-        OoM = collection['order_of_magnitude']['id']
-        # OoM Donors
-        try:
-            OoMDonors = collection['order_of_magnitude_donors']['id']
-        except KeyError:
-            OoMDonors = None
-
-        materials = []
-        if 'materials' in collection:
-            for m in collection['materials']:
-                materials.append(m['id'])
-
-        data_categories = []
-        if 'data_categories' in collection:
-            for c in collection['data_categories']:
-                data_categories.append(c['id'])
-
-        types = []
-        if 'type' in collection:
-            for t in collection['type']:
-                types.append(t['id'])
+        biobank_capabilities = biobankFeatures.capabilities
+        biobank_covid = biobankFeatures.covid
+        biobank_networks = biobankFeatures.networks
+
+        materials = features.materials
+        data_categories = features.data_categories
+        types = features.types
         log.debug("Types: " + str(types))
 
 
@@ -134,24 +108,13 @@ def analyseCollections(collections, allCollectionSamplesExplicit, allCollectionD
             allCountries.add(biobank['country']['id'])
         allCollections.append(collection)
         allBiobanks.add(biobankId)
-        #if 'size' in collection and isinstance(collection['size'], int) and dir.isTopLevelCollection(collection['id']):
-        if dir.isCountableCollection(collection['id'], 'size'):
-
-            allCollectionSamplesExplicit += collection['size']
-            allCollectionSamplesIncOoM += collection['size']
-        else:
-            # Intentionally, the lower bound of the OoM interval is taken - the size of the collection should be in the range of 10**OoM to 10**(OoM+1) - and hence using 10**OoM is a bound nobody can question unless there is a bug in the underlying data. Historically, we used also 0.3*10**(OoM+1).
-            # note that OoM is only counted for top-level collections to avoid double counting - because OoM is mandatory parameter, any child collection has a parent which has OoM filled in
-            if dir.isTopLevelCollection(collection['id']):
-                allCollectionSamplesIncOoM += int(10 ** OoM)
-        #if 'number_of_donors' in collection and isinstance(collection['number_of_donors'], int) and dir.isTopLevelCollection(collection['id']):
-        if dir.isCountableCollection(collection['id'], 'number_of_donors'):
-            allCollectionDonorsExplicit += collection['number_of_donors']
-            # OoM Donors
-            allCollectionDonorsIncOoM += collection['number_of_donors']
-        else:
-            if dir.isTopLevelCollection(collection['id']) and OoMDonors:
-                allCollectionDonorsIncOoM += int(10 ** OoMDonors)
+        # countability (to avoid double counting in the collection hierarchy) and OoM estimates are precomputed by Directory
+        counts = dir.getCollectionCounts(collection['id'])
+        allCollectionSamplesExplicit += counts['samplesExplicit']
+        allCollectionSamplesIncOoM += counts['samplesIncOoM']
+        allCollectionDonorsExplicit += counts['donorsExplicit']
+        # OoM Donors
+        allCollectionDonorsIncOoM += counts['donorsIncOoM']
     return allCollections, withdrawnCollections, allCollectionSamplesExplicit, allCollectionDonorsExplicit, allCollectionSamplesIncOoM, allCollectionDonorsIncOoM, allBiobanks
 
 def analyseBBs():
@@ -183,7 +146,7 @@ def outputExcelBiobanksCollections(filename : str, dfBiobanks : pd.DataFrame, bi
 
 ### Main
 
-dir = Directory(purgeCaches=args.purgeCaches, debug=args.debug, pp=pp)
+dir = Directory(purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, snapshot=args.snapshot)
 
 log.info('Total biobanks: ' + str(dir.getBiobanksCount()))
 log.info('Total collections: ' + str(dir.getCollectionsCount()))
@@ -118,6 +118,7 @@ parser.add_argument('--disable-checks-remote', dest='disableChecksRemote', nargs
 parser.add_argument('--disable-plugins', dest='disablePlugins', nargs='+', action='extend', choices=pluginList, help='disable particular check(s)')
 #parser.add_argument('--purge-cache', dest='purgeCaches', nargs='+', action='extend', choices=cachesList, help='disable particular long remote checks')
 
+parser.add_argument('--snapshot', dest='snapshot', help='load the directory from a local snapshot directory with JSON or EMX entity files instead of MOLGENIS')
 parser.set_defaults(disableChecksRemote = [], disablePlugins = [], purgeCaches=[])
 args = parser.parse_args()
 aggregator = args.aggregator
@@ -127,9 +128,9 @@ outputWEXLSX = args.outputWEXLSX
 # Get info from Directory
 pp = pprint.PrettyPrinter(indent=4)
 if args.username is not None and args.password is not None:
-    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, username=args.username, password=args.password)
+    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, username=args.username, password=args.password, snapshot=args.snapshot)
 else:
-    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp)
+    dir = Directory(package=args.package, purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, snapshot=args.snapshot)
 
 
 '''
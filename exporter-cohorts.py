@@ -36,6 +36,7 @@ parser.add_argument('-X', '--output-XLSX', dest='outputXLSX', nargs=1, help='out
 parser.add_argument('-N', '--output-no-stdout', dest='nostdout', action='store_true', help='no output of results into stdout (default: enabled)')
 parser.add_argument('--purge-all-caches', dest='purgeCaches', action='store_const', const=cachesList, help='disable all long remote checks (email address testing, geocoding, URLs')
 parser.add_argument('--purge-cache', dest='purgeCaches', nargs='+', action='extend', choices=cachesList, help='disable particular long remote checks')
+parser.add_argument('--snapshot', dest='snapshot', help='load the directory from a local snapshot directory with JSON or EMX entity files instead of MOLGENIS')
 parser.set_defaults(disableChecksRemote = [], disablePlugins = [], purgeCaches=[])
 args = parser.parse_args()
 
@@ -49,7 +50,7 @@ else:
 
 # Main code
 
-dir = Directory(purgeCaches=args.purgeCaches, debug=args.debug, pp=pp)
+dir = Directory(purgeCaches=args.purgeCaches, debug=args.debug, pp=pp, snapshot=args.snapshot)
 
 log.info('Total biobanks: ' + str(dir.getBiobanksCount()))
 log.info('Total collections: ' + str(dir.getCollectionsCount()))
@@ -60,58 +61,30 @@ cohortCountries = set()
 
 for collection in dir.getCollections():
     log.debug("Analyzing collection " + collection['id'])
-    biobankId = dir.getCollectionBiobankId(collection['id'])
+    features = dir.getCollectionFeatures(collection['id'])
+    biobankId = features.biobankId
     biobank = dir.getBiobankById(biobankId)
+    biobankFeatures = dir.getBiobankFeatures(biobankId)
     country = biobank['country']['id']
 
-    biobank_capabilities = []
-    if 'capabilities' in biobank:
-        for c in biobank['capabilities']:
-            biobank_capabilities.append(c['id'])
-    biobank_covid = []
-    if 'covid19biobank' in biobank:
-        for c in biobank['covid19biobank']:
-            biobank_covid.append(c['id'])
-    biobank_networks = []
-    if 'network' in biobank:
-        for n in biobank['network']:
-            biobank_networks.append(n['id'])
-    collection_networks = []
-    if 'network' in collection:
-        for n in collection['network']:
-            collection_networks.append(n['id'])
-
-    OoM = collection['order_of_magnitude']['id']
-
-    materials = []
-    if 'materials' in collection:
-        for m in collection['materials']:
-            materials.append(m['id'])
-    
-    data_categories = []
-    if 'data_categories' in collection:
-        for c in collection['data_categories']:
-            data_categories.append(c['id'])
-
-    types = []
-    if 'type' in collection:
-        for t in collection['type']:
-            types.append(t['id'])
+    biobank_capabilities = biobankFeatures.capabilities
+    biobank_covid = biobankFeatures.covid
+    biobank_networks = biobankFeatures.networks
+    collection_networks = features.networks
+
+    OoM = features.OoM
+    materials = features.materials
+    data_categories = features.data_categories
+    types = features.types
     log.debug("Types: " + str(types))
     
-    diags = []
-    diag_ranges = []
+    diags = features.diagnosisCodes
+    diag_ranges = features.diagnosisRanges
     covid_diag = False
     covid_control = False
     covid_prospective = False
     non_covid = False
 
-    for d in collection['diagnosis_available']:
-        if re.search('-', d['id']):
-            diag_ranges.append(d['id'])
-        else:
-            diags.append(d['id'])
-
     if diag_ranges:
         log.warning("There are diagnosis ranges provided for collection " + collection['id'] + ": " + str(diag_ranges))
     
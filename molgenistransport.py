@@ -0,0 +1,198 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Transports creating the MOLGENIS sessions used by Directory, so that the directory loading can be recorded and replayed:
+#   Transport - plain MOLGENIS session talking to the server
+#   RecordingTransport - as Transport, but the raw REST responses are also written to a recording directory
+#   ReplayTransport - the responses are served from a recording directory, with configurable per-request latency and bandwidth,
+#                     i.e., without any network, hence fetch strategies (threads, profiles, paging) can be compared reproducibly offline
+# The transports are requests transport adapters mounted on the HTTP session of molgenis.client.Session. The responses are
+# keyed by the method and the path with the query (not the server), one JSON file per response.
+
+import base64
+import hashlib
+import json
+import logging as log
+import os
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import molgenis.client
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# bumped whenever the format of the recorded responses changes
+recordingVersion = 1
+
+
+def topLevelItems(value : str) -> list:
+    # items of a comma-separated list, not splitting the nested lists in parentheses (e.g., 'a,b(c,d)' -> ['a', 'b(c,d)'])
+    (items, depth, start) = ([], 0, 0)
+    for (i, c) in enumerate(value):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(value[start:i])
+            start = i + 1
+    items.append(value[start:])
+    return items
+
+def requestKey(method : str, url : str) -> str:
+    # the request bodies are not part of the key - the only ones sent by Directory are the login credentials, which are not recorded
+    # molgenis.client builds the attrs parameter from a set, hence its items are sorted so that the key does not depend on their order
+    parts = urlsplit(url)
+    query = []
+    for (name, value) in parse_qsl(parts.query, keep_blank_values=True):
+        if name == 'attrs':
+            value = ','.join(sorted(topLevelItems(value)))
+        query.append((name, value))
+    return method.upper() + ' ' + parts.path + ('?' + urlencode(sorted(query), safe='*(),:;=') if query else '')
+
+def recordingFile(path : str, key : str) -> str:
+    return os.path.join(path, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json')
+
+
+class TransportStatistics:
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.__lock = threading.Lock()
+
+    def count(self, size : int):
+        with self.__lock:
+            self.requests += 1
+            self.bytes += size
+
+
+class Transport:
+    # cacheScope distinguishes the directory cache of the data retrieved using the transport (see Directory.cacheNamespace)
+    cacheScope = ''
+    # whether the directory cache is not to be read, i.e., all the entities are retrieved using the transport (they are still cached)
+    bypassCache = False
+
+    def __init__(self):
+        self.statistics = TransportStatistics()
+
+    def session(self, directoryURL : str) -> molgenis.client.Session:
+        session = molgenis.client.Session(directoryURL)
+        adapter = self.adapter()
+        if adapter is not None:
+            session._session.mount('http://', adapter)
+            session._session.mount('https://', adapter)
+        return session
+
+    def adapter(self):
+        # requests transport adapter used by the sessions, None for the default one
+        return None
+
+
+class _RecordingAdapter(HTTPAdapter):
+
+    def __init__(self, transport):
+        super().__init__()
+        self.__transport = transport
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # reading the content here consumes the stream, it is still available to the caller as response.content
+        content = response.content
+        self.__transport.record(request, response, content)
+        return response
+
+
+class RecordingTransport(Transport):
+    # the recording has to contain all the responses, even if the directory cache holds the data already
+    bypassCache = True
+
+    def __init__(self, path : str):
+        super().__init__()
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        log.info('Recording MOLGENIS responses to ' + path)
+
+    def adapter(self):
+        return _RecordingAdapter(self)
+
+    def record(self, request, response, content : bytes):
+        key = requestKey(request.method, request.url)
+        # the login response carries the session token, which is not to be stored
+        if urlsplit(request.url).path.endswith('/v1/login'):
+            content = b'{"token": "replay"}'
+        recording = {
+                'version' : recordingVersion,
+                'key' : key,
+                'status' : response.status_code,
+                'reason' : response.reason,
+                'headers' : { k : v for (k, v) in response.headers.items() if k.lower() not in ('content-encoding', 'transfer-encoding', 'content-length', 'set-cookie') },
+                'elapsed' : response.elapsed.total_seconds(),
+                'body' : base64.b64encode(content).decode('ascii'),
+                }
+        # written to a temporary file first, so that concurrent workers or an interrupted run do not leave a partial recording
+        filename = recordingFile(self.path, key)
+        with open(filename + '.' + str(threading.get_ident()), 'w', encoding='utf-8') as f:
+            json.dump(recording, f)
+        os.replace(filename + '.' + str(threading.get_ident()), filename)
+        self.statistics.count(len(content))
+        log.debug('Recorded ' + key)
+
+
+class _ReplayAdapter(BaseAdapter):
+
+    def __init__(self, transport):
+        super().__init__()
+        self.__transport = transport
+
+    def send(self, request, **kwargs):
+        return self.__transport.replay(request)
+
+    def close(self):
+        pass
+
+
+class ReplayTransport(Transport):
+
+    def __init__(self, path : str, latency : float = 0.0, bandwidth : float = None):
+        # latency: seconds added to each request; bandwidth: bytes per second of each response (None for unlimited)
+        super().__init__()
+        if not os.path.isdir(path):
+            raise Exception('ReplayTransport', 'Recording directory ' + path + ' does not exist')
+        self.path = path
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.cacheScope = 'replay:' + os.path.abspath(path)
+        log.info('Replaying MOLGENIS responses from ' + path)
+
+    def adapter(self):
+        return _ReplayAdapter(self)
+
+    def replay(self, request) -> requests.Response:
+        key = requestKey(request.method, request.url)
+        filename = recordingFile(self.path, key)
+        if not os.path.exists(filename):
+            raise requests.exceptions.ConnectionError('No recorded response for ' + key + ' in ' + self.path, request=request)
+        with open(filename, encoding='utf-8') as f:
+            recording = json.load(f)
+        if recording.get('version') != recordingVersion or recording.get('key') != key:
+            raise requests.exceptions.ConnectionError('Recorded response for ' + key + ' in ' + filename + ' is not usable', request=request)
+        content = base64.b64decode(recording['body'])
+        delay = self.latency + (len(content) / self.bandwidth if self.bandwidth else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        self.statistics.count(len(content))
+        response = requests.Response()
+        response.status_code = recording['status']
+        response.reason = recording['reason']
+        response.headers = CaseInsensitiveDict(recording['headers'])
+        response._content = content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=delay)
+        log.debug('Replayed ' + key)
+        return response
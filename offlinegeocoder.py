@@ -0,0 +1,152 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Offline reverse geocoding to country codes using a country boundary dataset supplied by the operator (GeoJSON, or ESRI shapefile
+# if pyshp is installed), e.g., Natural Earth admin 0 countries. Polygons are indexed by a grid of cells and their edges by
+# latitude bands (sized per polygon for a bounded number of edges per band), hence a point-in-polygon query only tests the few edges
+# crossing the band of the point.
+
+import json
+import logging as log
+import math
+import os.path
+import time
+
+try:
+    import shapefile
+except ImportError:
+    shapefile = None
+
+
+# properties holding the ISO 3166-1 alpha-2 code in the common datasets, in the order of preference
+# (e.g., Natural Earth has ISO_A2 set to -99 for some countries, ISO_A2_EH is filled for them)
+countryCodeProperties = ['ISO_A2_EH', 'ISO_A2', 'iso_a2', 'ISO3166-1-Alpha-2', 'ISO2', 'iso2', 'country_code', 'CC']
+
+# bumped whenever the index structure changes, so that an index cached by another version is not used
+indexVersion = 1
+
+
+class OfflineReverseGeocoder:
+
+    def __init__(self, cellSize : float = 1.0, edgesPerBand : int = 32):
+        self.cellSize = cellSize
+        self.edgesPerBand = edgesPerBand
+        # polygon: (country code, bounding box (min lon, min lat, max lon, max lat), band size, band -> edges (x1, y1, x2, y2) of all its rings)
+        self.__polygons = []
+        # grid cell (lon, lat) -> indices of the polygons whose bounding box overlaps the cell
+        self.__grid = {}
+
+    def __len__(self):
+        return len(self.__polygons)
+
+    def addCountry(self, code : str, geometry : dict):
+        # geometry is a GeoJSON Polygon or MultiPolygon (coordinates in lon, lat order)
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            raise Exception('OfflineReverseGeocoder', 'Unsupported geometry type for ' + code + ': ' + geometry['type'])
+        for rings in polygons:
+            self.__addPolygon(code, rings)
+
+    def __addPolygon(self, code : str, rings : list):
+        bands = {}
+        points = [p for ring in rings for p in ring]
+        if not points:
+            return
+        bbox = (min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points))
+        bandSize = min(1.0, max(0.001, (bbox[3] - bbox[1]) * self.edgesPerBand / len(points)))
+        for ring in rings:
+            for i in range(len(ring) - 1):
+                (x1, y1) = ring[i][:2]
+                (x2, y2) = ring[i + 1][:2]
+                for band in range(math.floor(min(y1, y2) / bandSize), math.floor(max(y1, y2) / bandSize) + 1):
+                    bands.setdefault(band, []).append((x1, y1, x2, y2))
+        index = len(self.__polygons)
+        self.__polygons.append((code, bbox, bandSize, bands))
+        for cx in range(self.__cell(bbox[0]), self.__cell(bbox[2]) + 1):
+            for cy in range(self.__cell(bbox[1]), self.__cell(bbox[3]) + 1):
+                self.__grid.setdefault((cx, cy), []).append(index)
+
+    def __cell(self, v : float) -> int:
+        return math.floor(v / self.cellSize)
+
+    def __contains(self, polygon, lon : float, lat : float) -> bool:
+        # ray casting towards +lon, the parity of the crossings over all the rings accounts for the holes
+        (code, bbox, bandSize, bands) = polygon
+        if not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+            return False
+        inside = False
+        for (x1, y1, x2, y2) in bands.get(math.floor(lat / bandSize), ()):
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+    def __countryAt(self, lat : float, lon : float) -> str:
+        for index in self.__grid.get((self.__cell(lon), self.__cell(lat)), ()):
+            if self.__contains(self.__polygons[index], lon, lat):
+                return self.__polygons[index][0]
+        return None
+
+    def lookup(self, lat : float, lon : float, margin : float = 0.0):
+        # returns (country code or None if the point is outside of all the countries, whether the point is within margin degrees from a border)
+        # a point is considered to be near a border if any of the 8 points around it at the margin distance (in degrees) is
+        # in a different country (hence enclaves or slivers narrower than the margin may be missed)
+        code = self.__countryAt(lat, lon)
+        nearBorder = False
+        if margin > 0:
+            diagonal = margin / math.sqrt(2)
+            for (dlat, dlon) in ((margin, 0), (-margin, 0), (0, margin), (0, -margin), (diagonal, diagonal), (diagonal, -diagonal), (-diagonal, diagonal), (-diagonal, -diagonal)):
+                if self.__countryAt(lat + dlat, lon + dlon) != code:
+                    nearBorder = True
+                    break
+        return (code, nearBorder)
+
+    @staticmethod
+    def __featureCode(properties : dict) -> str:
+        for p in countryCodeProperties:
+            value = properties.get(p)
+            if isinstance(value, str) and len(value) == 2 and value.isalpha():
+                return value.upper()
+        return None
+
+    @staticmethod
+    def __features(path : str):
+        # (properties, geometry) of the features in the dataset
+        if path.lower().endswith('.shp'):
+            if shapefile is None:
+                raise Exception('OfflineReverseGeocoder', 'pyshp is needed to read shapefiles, install it or convert ' + path + ' to GeoJSON')
+            reader = shapefile.Reader(path)
+            for shapeRecord in reader.iterShapeRecords():
+                yield (shapeRecord.record.as_dict(), shapeRecord.shape.__geo_interface__)
+        else:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            features = data['features'] if data.get('type') == 'FeatureCollection' else [data]
+            for feature in features:
+                yield (feature.get('properties') or {}, feature.get('geometry'))
+
+    @staticmethod
+    def load(path : str, cache=None):
+        # with cache (e.g., diskcache.Cache), the index is stored and reused as long as the dataset file does not change
+        stat = os.stat(path)
+        cacheKey = ('offlinegeocoder', indexVersion, os.path.abspath(path), stat.st_mtime, stat.st_size)
+        if cache is not None and cacheKey in cache:
+            log.info('   ... loaded country boundaries index of ' + path + ' from cache')
+            return cache[cacheKey]
+        start_time = time.perf_counter()
+        geocoder = OfflineReverseGeocoder()
+        skipped = 0
+        for (properties, geometry) in OfflineReverseGeocoder.__features(path):
+            code = OfflineReverseGeocoder.__featureCode(properties)
+            if code is None or geometry is None or geometry['type'] not in ('Polygon', 'MultiPolygon'):
+                skipped += 1
+                continue
+            geocoder.addCountry(code, geometry)
+        end_time = time.perf_counter()
+        log.info('   ... indexed ' + str(len(geocoder)) + ' country polygons from ' + path + ' in ' + "%0.3f" % (end_time-start_time) + 's')
+        if skipped > 0:
+            log.warning('Skipped ' + str(skipped) + ' features of ' + path + ' without a country code (' + '/'.join(countryCodeProperties) + ') or polygon geometry')
+        if cache is not None:
+            cache[cacheKey] = geocoder
+        return geocoder
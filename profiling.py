@@ -0,0 +1,148 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Resource profiling of the data checks (data-check.py --profile): wall and CPU time, peak memory, warnings by level,
+# remote calls and cache lookups are recorded per section (directory loading, plugins) and written as a JSON report.
+# Remote calls and cache lookups are reported by the code doing them using countRemoteCall() and countCacheLookup();
+# these are counted for the section recorded in the current thread and are no-ops if there is none.
+
+import cProfile
+import json
+import logging as log
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+reportVersion = 1
+
+_state = threading.local()
+
+
+class ProfileSection:
+
+    def __init__(self, name : str, enabled : bool = True, statsDir : str = None, cpuClock = time.thread_time):
+        # with enabled=False, only the wall time is measured (used for the log messages)
+        # cpuClock is time.thread_time by default, time.process_time is to be used if the section spawns worker threads
+        self.name = name
+        self.enabled = enabled
+        self.statsDir = statsDir
+        self.cpuClock = cpuClock
+        self.wall = None
+        self.cpu = None
+        self.memoryPeak = None
+        self.warnings = {}
+        self.remoteCalls = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.details = {}
+        self.__lock = threading.Lock()
+        self.__profiler = None
+
+    def __enter__(self):
+        if self.enabled:
+            self.__parent = getattr(_state, 'section', None)
+            _state.section = self
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.__memoryStart = tracemalloc.get_traced_memory()[0]
+            if self.statsDir is not None:
+                self.__profiler = cProfile.Profile()
+                try:
+                    self.__profiler.enable()
+                except ValueError as e:
+                    # only one profiler can be active at a time, e.g., for plugins run concurrently in threads
+                    log.warning('cProfile statistics of ' + self.name + ' can\'t be collected: ' + str(e))
+                    self.__profiler = None
+            self.__cpuStart = self.cpuClock()
+        self.__wallStart = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.wall = time.perf_counter() - self.__wallStart
+        if self.enabled:
+            self.cpu = self.cpuClock() - self.__cpuStart
+            if self.__profiler is not None:
+                self.__profiler.disable()
+                if not os.path.exists(self.statsDir):
+                    os.makedirs(self.statsDir, exist_ok=True)
+                self.__profiler.dump_stats(os.path.join(self.statsDir, self.name + '.prof'))
+            # peak of the memory traced by the whole process, hence it is approximate for the sections run concurrently in threads
+            self.memoryPeak = max(0, tracemalloc.get_traced_memory()[1] - self.__memoryStart)
+            _state.section = self.__parent
+        return False
+
+    def setWarnings(self, warnings : list):
+        self.warnings = countWarnings(warnings)
+
+    def addRemoteCalls(self, calls : int):
+        with self.__lock:
+            self.remoteCalls += calls
+
+    def addCacheLookup(self, hit : bool, n : int = 1):
+        with self.__lock:
+            if hit:
+                self.cacheHits += n
+            else:
+                self.cacheMisses += n
+
+    def report(self) -> dict:
+        # plain dict, so that it can be passed from the forked processes and serialized to JSON
+        lookups = self.cacheHits + self.cacheMisses
+        report = {
+                'name' : self.name,
+                'wall' : self.wall,
+                'cpu' : self.cpu,
+                'memoryPeak' : self.memoryPeak,
+                'warnings' : self.warnings,
+                'remoteCalls' : self.remoteCalls,
+                'cacheHits' : self.cacheHits,
+                'cacheMisses' : self.cacheMisses,
+                'cacheHitRatio' : self.cacheHits / lookups if lookups > 0 else None,
+                }
+        report.update(self.details)
+        return report
+
+
+def countWarnings(warnings : list) -> dict:
+    # number of warnings by level
+    counts = {}
+    for w in warnings:
+        counts[w.level.name] = counts.get(w.level.name, 0) + 1
+    return counts
+
+def currentSection():
+    return getattr(_state, 'section', None)
+
+def countRemoteCall(calls : int = 1):
+    section = currentSection()
+    if section is not None:
+        section.addRemoteCalls(calls)
+
+def countCacheLookup(hit : bool, n : int = 1):
+    section = currentSection()
+    if section is not None:
+        section.addCacheLookup(hit, n)
+
+def propagate(fn):
+    # wraps fn to be run in another thread (e.g., a ThreadPoolExecutor worker), so that its remote calls and cache lookups
+    # are counted for the section of the calling thread
+    section = currentSection()
+    def wrapper(*args, **kwargs):
+        previous = getattr(_state, 'section', None)
+        _state.section = section
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _state.section = previous
+    return wrapper
+
+def writeReport(filename : str, sections : list, run : dict):
+    report = { 'version' : reportVersion, 'finished' : datetime.now(timezone.utc).isoformat(timespec='seconds') }
+    report.update(run)
+    report['sections'] = sections
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    log.info('Profile report written to ' + filename)
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Runs the local stand-ins of the remote services (see standins.py) until interrupted and prints the data-check.py options
+# pointing the remote checks to them, e.g., for testing the remote checks in CI without the internet:
+#   ./remote-standins.py --latency 0.05 --error-rate 0.1 &
+#   python3 data-check.py --url-connect-to 127.0.0.1:8080 --mx-resolver 127.0.0.1:8053 --nominatim-url http://127.0.0.1:8088
+# NB: the results of the remote checks (and their journals) obtained through the stand-ins are cached apart from the real ones, separately
+# for each stand-in endpoint.
+
+import argparse
+import logging as log
+import time
+
+import offlinegeocoder
+import standins
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='log the requests served')
+parser.add_argument('--http-port', dest='HTTPPort', type=int, default=8080, help='port of the HTTP stand-in (default 8080, 0 for any free port)')
+parser.add_argument('--dns-port', dest='DNSPort', type=int, default=8053, help='port of the DNS (MX) stand-in (default 8053, 0 for any free port)')
+parser.add_argument('--nominatim-port', dest='nominatimPort', type=int, default=8088, help='port of the Nominatim stand-in (default 8088, 0 for any free port)')
+parser.add_argument('--latency', dest='latency', type=float, default=0.0, help='latency of the responses in seconds (default 0)')
+parser.add_argument('--jitter', dest='jitter', type=float, default=0.0, help='maximum random latency added to each response in seconds (default 0)')
+parser.add_argument('--error-rate', dest='errorRate', type=float, default=0.0, help='fraction of the URLs answering 404 and of the email domains without MX record (default 0)')
+parser.add_argument('--reset-rate', dest='resetRate', type=float, default=0.0, help='fraction of the URLs whose connections are reset (default 0)')
+parser.add_argument('--geocoding-boundaries', dest='geocodingBoundaries', help='country boundaries (GeoJSON, or shapefile if pyshp is installed) used to answer the country of a location')
+parser.add_argument('--default-country', dest='defaultCountry', help='country code answered for the locations outside of the boundaries (default none, i.e., unable to geocode)')
+args = parser.parse_args()
+
+log.basicConfig(format="%(levelname)s: %(message)s", level=log.DEBUG if args.verbose else log.INFO)
+
+HTTP = standins.HTTPStandIn(standins.Behavior(200, args.latency, args.jitter), port=args.HTTPPort)
+HTTP.addFraction(args.errorRate, standins.Behavior(404, args.latency, args.jitter))
+HTTP.addFraction(args.resetRate, standins.Behavior(latency=args.latency, jitter=args.jitter, reset=True))
+MX = standins.MXStandIn(standins.Behavior('ok', args.latency, args.jitter), port=args.DNSPort)
+MX.addFraction(args.errorRate, standins.Behavior('nomx', args.latency, args.jitter))
+geocoder = offlinegeocoder.OfflineReverseGeocoder.load(args.geocodingBoundaries) if args.geocodingBoundaries is not None else None
+nominatim = standins.NominatimStandIn(standins.Behavior(200, args.latency, args.jitter), port=args.nominatimPort, geocoder=geocoder, defaultCountry=args.defaultCountry)
+
+print('--url-connect-to ' + HTTP.endpoint() + ' --mx-resolver ' + MX.endpoint() + ' --nominatim-url ' + nominatim.endpoint(), flush=True)
+try:
+    while True:
+        time.sleep(3600)
+except KeyboardInterrupt:
+    pass
+finally:
+    log.info('Requests served: HTTP ' + str(HTTP.requests) + ', DNS ' + str(MX.requests) + ', Nominatim ' + str(nominatim.requests))
+    for standIn in (HTTP, MX, nominatim):
+        standIn.close()
@@ -0,0 +1,93 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Wall-clock budget and checkpoint journal of the remote checks (URLs, emails, geocoding). The checks call available() before
+# each remote request, which fails once the budget (data-check.py --remote-budget) is spent or the run has been stopped (e.g.,
+# by Ctrl-C or SIGTERM); the items left unchecked are reported as pending. Each check keeps a journal of its remote work items:
+# the whole work list is written before the requests are issued and the completed items are removed as the results come in,
+# hence the next run (after the budget has been spent, a crash or an interrupt) checks the remaining items first.
+
+import logging as log
+import threading
+import time
+
+import caches
+
+# marks the results of the items which were not checked because the budget has been spent
+PENDING = 'pending'
+
+class BudgetSpent(Exception):
+    # may be raised by the code doing the remote requests when available() fails, to be turned into PENDING by the check
+    pass
+
+__deadline = None
+__stopped = threading.Event()
+__stopLock = threading.Lock()
+
+
+def setBudget(seconds : float):
+    # the budget is counted from now; None means no budget
+    global __deadline
+    __deadline = time.monotonic() + seconds if seconds is not None else None
+
+def stop(reason : str):
+    # no more remote requests are issued in this run, the requests in progress are completed
+    with __stopLock:
+        if not __stopped.is_set():
+            log.warning('Stopping remote checks (' + reason + '), the unchecked items are reported as pending')
+        __stopped.set()
+
+def available() -> bool:
+    if __stopped.is_set():
+        return False
+    if __deadline is not None and time.monotonic() >= __deadline:
+        stop('remote budget spent')
+        return False
+    return True
+
+
+class Journal:
+
+    def __init__(self, name : str, checkpointEvery : int = 50, scope : str = None):
+        # checkpointEvery: number of completed items after which the journal is written (and always at the end)
+        # scope: endpoint replacing the remote service (see caches.scopedNamespace), whose journal is kept apart
+        self.name = name
+        self.checkpointEvery = checkpointEvery
+        self.__cache = caches.openCache(caches.scopedNamespace('journal', scope))
+        self.previous = set(self.__cache.get(name, ()))
+        self.__items = set()
+        self.__completed = 0
+        self.__lock = threading.Lock()
+        if self.previous:
+            log.info('Resuming ' + str(len(self.previous)) + ' ' + name + ' items left unchecked by the previous run')
+
+    def prioritize(self, items : list) -> list:
+        # the items left unchecked by the previous run go first, otherwise the order is kept
+        return [i for i in items if i in self.previous] + [i for i in items if i not in self.previous]
+
+    def begin(self, items : list):
+        with self.__lock:
+            self.__items = set(items)
+            self.__save()
+
+    def done(self, item):
+        with self.__lock:
+            self.__items.discard(item)
+            self.__completed += 1
+            if self.__completed % self.checkpointEvery == 0:
+                self.__save()
+
+    def finish(self) -> list:
+        # returns the items not completed in this run, which are kept in the journal for the next run
+        with self.__lock:
+            self.__save()
+            pending = sorted(self.__items)
+        if pending:
+            log.warning(str(len(pending)) + ' ' + self.name + ' items left unchecked, they will be checked first in the next run')
+        self.__cache.close()
+        return pending
+
+    def __save(self):
+        if self.__items:
+            self.__cache[self.name] = sorted(self.__items)
+        else:
+            self.__cache.delete(self.name)
@@ -0,0 +1,269 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Local stand-ins of the remote services used by the remote checks, so that the checks can be exercised and measured without
+# the internet (see benchmark-remote.py and remote-standins.py):
+#   HTTPStandIn - HTTP server for CheckURLs (data-check.py --url-connect-to) with configurable status codes, latency and connection resets
+#   MXStandIn - DNS server answering MX queries and SMTP greeter for ContactFields (data-check.py --mx-resolver)
+#   NominatimStandIn - Nominatim reverse geocoding endpoint for BiobankGeo (data-check.py --nominatim-url)
+# Each stand-in listens on 127.0.0.1 (on a free port by default), serves in daemon threads and is stopped by close().
+
+import fnmatch
+import json
+import logging as log
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class Behavior:
+    # how a stand-in answers a request: status (HTTP status code, or the outcome of an MX query - see MXStandIn),
+    # latency in seconds (plus a uniformly distributed jitter), reset closes the connection without any response
+    def __init__(self, status = 200, latency : float = 0.0, jitter : float = 0.0, reset : bool = False, headers : dict = None):
+        self.status = status
+        self.latency = latency
+        self.jitter = jitter
+        self.reset = reset
+        self.headers = headers or {}
+
+    def delay(self):
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+
+class StandIn:
+
+    def __init__(self, default : Behavior = None):
+        self.default = default or Behavior()
+        # (pattern, behavior) in the order of precedence, see behavior()
+        self.rules = []
+        # (fraction, behavior) applied to the requests not matching any rule
+        self.fractions = []
+        self.requests = 0
+        self.__lock = threading.Lock()
+        self.__servers = []
+
+    def addRule(self, pattern : str, behavior : Behavior):
+        # pattern is a shell-style wildcard matched against the request key (e.g., 'www.example.org/missing*' for HTTP, a domain for MX)
+        self.rules.append((pattern, behavior))
+
+    def addFraction(self, fraction : float, behavior : Behavior):
+        # the fraction of the request keys get behavior - chosen by a hash of the key, hence the same key is answered the same way
+        self.fractions.append((fraction, behavior))
+
+    def behavior(self, key : str) -> Behavior:
+        with self.__lock:
+            self.requests += 1
+        for (pattern, behavior) in self.rules:
+            if fnmatch.fnmatchcase(key, pattern):
+                return behavior
+        position = zlib.crc32(key.encode('utf-8')) / 2**32
+        for (fraction, behavior) in self.fractions:
+            if position < fraction:
+                return behavior
+            position -= fraction
+        return self.default
+
+    def _serve(self, server):
+        self.__servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_address[1]
+
+    def close(self):
+        for server in self.__servers:
+            server.shutdown()
+            server.server_close()
+        self.__servers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+def resetConnection(sock : socket.socket):
+    # closing with zero linger time sends RST instead of FIN
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.close()
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug('HTTPStandIn: ' + format % args)
+
+    def do_HEAD(self):
+        self.__respond(False)
+
+    def do_GET(self):
+        self.__respond(True)
+
+    def __respond(self, body : bool):
+        # the request key is host + path (with --url-connect-to, the host of the original URL is in the Host header)
+        host = self.headers.get('Host', '').lower()
+        behavior = self.server.standIn.behavior(host + self.path)
+        behavior.delay()
+        if behavior.reset:
+            self.close_connection = True
+            resetConnection(self.connection)
+            return
+        content = ('<html><body>' + str(behavior.status) + '</body></html>').encode('utf-8')
+        self.send_response(behavior.status)
+        for (name, value) in behavior.headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+
+class HTTPStandIn(StandIn):
+
+    def __init__(self, default : Behavior = None, port : int = 0):
+        super().__init__(default)
+        server = ThreadingHTTPServer(('127.0.0.1', port), _HTTPHandler)
+        server.daemon_threads = True
+        server.standIn = self
+        self.port = self._serve(server)
+
+    def endpoint(self) -> str:
+        return '127.0.0.1:' + str(self.port)
+
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        (data, sock) = self.request
+        try:
+            (queryId, flags, qdcount) = struct.unpack('>HHH', data[:6])
+            (labels, offset) = ([], 12)
+            while data[offset] != 0:
+                labels.append(data[offset + 1:offset + 1 + data[offset]].decode('ascii', 'replace'))
+                offset += data[offset] + 1
+            (qtype, qclass) = struct.unpack('>HH', data[offset + 1:offset + 5])
+            question = data[12:offset + 5]
+        except (struct.error, IndexError):
+            return
+        domain = '.'.join(labels).lower()
+        behavior = self.server.standIn.behavior(domain)
+        behavior.delay()
+        if behavior.status == 'timeout':
+            return
+        (rcode, answers) = (0, [])
+        if behavior.status == 'nxdomain':
+            rcode = 3
+        elif behavior.status == 'servfail':
+            rcode = 2
+        elif qtype == 15 and behavior.status in ('ok', 'smtpdown'):
+            # smtplib accepts host:port as the host, hence the mail exchanger points directly to the SMTP greeter (or to a closed port)
+            exchange = '127.0.0.1:' + str(self.server.standIn.smtpPort if behavior.status == 'ok' else self.server.standIn.closedPort)
+            rdata = struct.pack('>H', 10) + b''.join(bytes([len(l)]) + l.encode('ascii') for l in exchange.split('.')) + b'\0'
+            answers.append(struct.pack('>HHHIH', 0xC00C, 15, 1, 3600, len(rdata)) + rdata)
+        header = struct.pack('>HHHHHH', queryId, 0x8180 | (flags & 0x0100) | rcode, 1, len(answers), 0, 0)
+        sock.sendto(header + question + b''.join(answers), self.client_address)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.wfile.write(b'220 localhost ESMTP stand-in\r\n')
+        for line in self.rfile:
+            command = line.strip().upper()
+            if command.startswith(b'QUIT'):
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            elif command.startswith(b'HELO') or command.startswith(b'EHLO') or command.startswith(b'MAIL') or command.startswith(b'RCPT'):
+                self.wfile.write(b'250 OK\r\n')
+            else:
+                self.wfile.write(b'502 Not implemented\r\n')
+
+
+class MXStandIn(StandIn):
+    # outcomes (Behavior.status) of the MX queries for a domain: 'ok' (MX record pointing to the SMTP greeter), 'nomx' (no MX record),
+    # 'nxdomain', 'servfail', 'timeout' (no answer), 'smtpdown' (MX record pointing to a closed port)
+
+    def __init__(self, default : Behavior = None, port : int = 0):
+        super().__init__(default or Behavior('ok'))
+        dnsServer = socketserver.ThreadingUDPServer(('127.0.0.1', port), _DNSHandler)
+        dnsServer.daemon_threads = True
+        dnsServer.standIn = self
+        smtpServer = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+        smtpServer.daemon_threads = True
+        # a port nobody listens on (bound and closed right away)
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.closedPort = s.getsockname()[1]
+        self.port = self._serve(dnsServer)
+        self.smtpPort = self._serve(smtpServer)
+
+    def endpoint(self) -> str:
+        return '127.0.0.1:' + str(self.port)
+
+
+class _NominatimHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug('NominatimStandIn: ' + format % args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        try:
+            (lat, lon) = (float(query['lat'][0]), float(query['lon'][0]))
+        except (KeyError, ValueError):
+            self.__send(400, { 'error' : 'Parameters lat and lon are required' })
+            return
+        standIn = self.server.standIn
+        behavior = standIn.behavior("%0.6f, %0.6f" % (lat, lon))
+        behavior.delay()
+        if behavior.reset:
+            self.close_connection = True
+            resetConnection(self.connection)
+            return
+        if behavior.status != 200:
+            self.__send(behavior.status, { 'error' : 'Stand-in error ' + str(behavior.status) })
+            return
+        code = standIn.countryAt(lat, lon)
+        if code is None:
+            self.__send(200, { 'error' : 'Unable to geocode' })
+        else:
+            self.__send(200, { 'lat' : str(lat), 'lon' : str(lon), 'display_name' : code.upper(), 'address' : { 'country_code' : code.lower() } })
+
+    def __send(self, status : int, data : dict):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class NominatimStandIn(StandIn):
+    # the country of a point is given by geocoder (e.g., offlinegeocoder.OfflineReverseGeocoder), or defaultCountry if there is none
+    # (or the point is outside of its countries); rules are matched against "lat, lon" with 6 decimals
+
+    def __init__(self, default : Behavior = None, port : int = 0, geocoder = None, defaultCountry : str = None):
+        super().__init__(default)
+        self.geocoder = geocoder
+        self.defaultCountry = defaultCountry
+        server = ThreadingHTTPServer(('127.0.0.1', port), _NominatimHandler)
+        server.daemon_threads = True
+        server.standIn = self
+        self.port = self._serve(server)
+
+    def countryAt(self, lat : float, lon : float) -> str:
+        code = self.geocoder.lookup(lat, lon)[0] if self.geocoder is not None else None
+        return code if code is not None else self.defaultCountry
+
+    def endpoint(self) -> str:
+        return 'http://127.0.0.1:' + str(self.port)
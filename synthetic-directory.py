@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Generates synthetic Directory content (see syntheticdirectory.py) at a multiple of the size of the production Directory for load
+# testing of the directory loading, the checks and the exporters, e.g., at 10x the size:
+#   ./synthetic-directory.py --scale 10 -o synthetic-10x
+#   python3 data-check.py --snapshot synthetic-10x -N --profile profile-10x.json
+# or as EMX (CSV files and the attributes sheet), so that the EMX loading path is exercised:
+#   ./synthetic-directory.py --scale 10 --emx -o synthetic-10x-emx
+# or stored in the directory cache of a (non-existing) MOLGENIS URL, so that the cache loading path is exercised as well:
+#   ./synthetic-directory.py --scale 10 --cache
+#   python3 data-check.py --directory-url https://synthetic.directory.invalid/ -N
+
+import argparse
+import logging as log
+
+from syntheticdirectory import SyntheticDirectory
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose information on progress of the generation')
+parser.add_argument('-d', '--debug', dest='debug', action='store_true', help='debug information on progress of the generation')
+parser.add_argument('-o', '--output', dest='output', help='write the entities as a snapshot directory (for use with --snapshot) provided as parameter')
+parser.add_argument('--jsonl', dest='jsonLines', action='store_true', help='write the snapshot as JSON lines (.jsonl) instead of JSON arrays')
+parser.add_argument('--emx', dest='emx', action='store_true', help='write the snapshot as EMX CSV files named by --package (with the attributes sheet) instead of JSON')
+parser.add_argument('--cache', dest='cache', action='store_true', help='store the entities in the directory cache of --directory-url and --package (replacing its content)')
+parser.add_argument('--directory-url', dest='directoryURL', default='https://synthetic.directory.invalid/', help='MOLGENIS URL whose directory cache gets the entities with --cache (default https://synthetic.directory.invalid/)')
+parser.add_argument('-P', '--package', dest='package', default='eu_bbmri_eric', help='MOLGENIS Package whose directory cache gets the entities with --cache, and which names the --emx files (default eu_bbmri_eric).')
+parser.add_argument('--scale', dest='scale', type=float, default=1.0, help='size relative to the production Directory (default 1)')
+parser.add_argument('--biobanks', dest='biobanks', type=int, help='number of biobanks (default given by --scale)')
+parser.add_argument('--networks', dest='networks', type=int, help='number of networks (default given by --scale)')
+parser.add_argument('--collections-per-biobank', dest='collectionsPerBiobank', type=int, default=3, help='average number of top-level collections per biobank (default 3)')
+parser.add_argument('--depth', dest='depth', type=int, default=2, help='maximum nesting depth of the sub-collections (default 2)')
+parser.add_argument('--sub-collections', dest='subCollections', type=int, default=3, help='maximum number of sub-collections of a collection (default 3)')
+parser.add_argument('--sub-collection-rate', dest='subCollectionRate', type=float, default=0.3, help='probability that a collection has sub-collections (default 0.3)')
+parser.add_argument('--facts-rate', dest='factsRate', type=float, default=0.2, help='fraction of the collections with facts (default 0.2)')
+parser.add_argument('--facts-per-collection', dest='factsPerCollection', type=int, default=8, help='average number of facts of a collection with facts (default 8)')
+parser.add_argument('--seed', dest='seed', type=int, default=1, help='seed of the random generator, the same seed and parameters give the same content (default 1)')
+args = parser.parse_args()
+
+if args.debug:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.DEBUG)
+elif args.verbose:
+    log.basicConfig(format="%(levelname)s: %(message)s", level=log.INFO)
+else:
+    log.basicConfig(format="%(levelname)s: %(message)s")
+
+if args.output is None and not args.cache:
+    parser.error('at least one of -o/--output and --cache is required')
+if args.jsonLines and args.emx:
+    parser.error('--jsonl and --emx are mutually exclusive')
+
+synthetic = SyntheticDirectory(scale=args.scale, biobanks=args.biobanks, networks=args.networks, collectionsPerBiobank=args.collectionsPerBiobank, depth=args.depth,
+        subCollections=args.subCollections, subCollectionRate=args.subCollectionRate, factsRate=args.factsRate, factsPerCollection=args.factsPerCollection, seed=args.seed)
+print('Generated %d biobanks, %d collections, %d contacts, %d networks, %d facts' % (len(synthetic.biobanks), len(synthetic.collections), len(synthetic.contacts), len(synthetic.networks), len(synthetic.facts)))
+
+if args.output is not None:
+    synthetic.writeSnapshot(args.output, args.jsonLines, args.emx, args.package)
+    print('Snapshot written to ' + args.output)
+if args.cache:
+    namespace = synthetic.writeCache(args.directoryURL, args.package)
+    print('Directory cache ' + namespace + ' of ' + args.directoryURL + ' written')
@@ -0,0 +1,305 @@
+# vim:ts=4:sw=4:tw=0:sts=4:et
+
+# Synthetic Directory content for load testing of the directory loading, the checks and the exporters at a multiple of the size of
+# the production Directory (see synthetic-directory.py): biobanks, nested collections, contacts, networks and facts with the ID
+# formats, references (expanded as returned by MOLGENIS for the attributes expanded in Directory.entityFetchList), ICD-10/ORPHA
+# diagnoses and orders of magnitude of the real data. The content depends only on the parameters and the seed, and it is either
+# written as a snapshot directory (Directory(snapshot=...)) or stored in the directory cache of a MOLGENIS URL, so that Directory
+# loads it without contacting the server.
+
+import json
+import logging as log
+import math
+import os
+import random
+import string
+import time
+
+from directory import Directory
+import caches
+
+# size of the production Directory the scale is relative to (approximate numbers of biobanks, networks and collections per biobank)
+baseBiobanks = 700
+baseNetworks = 40
+
+# country (with a national node, see nncontacts) -> (latitude, longitude, spread in degrees, phone prefix, weight in the number of biobanks)
+countries = {
+        'AT' : (47.6, 14.1, 1.0, '+43', 3),
+        'BE' : (50.6, 4.6, 0.5, '+32', 3),
+        'BG' : (42.7, 25.3, 1.0, '+359', 1),
+        'CH' : (46.8, 8.2, 0.6, '+41', 2),
+        'CY' : (35.0, 33.2, 0.2, '+357', 1),
+        'CZ' : (49.8, 15.5, 1.0, '+420', 4),
+        'DE' : (51.1, 10.4, 1.8, '+49', 12),
+        'EE' : (58.6, 25.0, 0.6, '+372', 1),
+        'FI' : (62.0, 25.7, 1.5, '+358', 3),
+        'GR' : (39.1, 22.0, 1.0, '+30', 2),
+        'IT' : (42.8, 12.5, 1.5, '+39', 14),
+        'LT' : (55.3, 23.9, 0.6, '+370', 1),
+        'LV' : (56.9, 24.6, 0.6, '+371', 1),
+        'MT' : (35.9, 14.4, 0.05, '+356', 1),
+        'NL' : (52.2, 5.5, 0.6, '+31', 8),
+        'NO' : (60.5, 9.5, 1.5, '+47', 3),
+        'PL' : (52.0, 19.4, 1.5, '+48', 6),
+        'SE' : (59.5, 15.5, 1.5, '+46', 5),
+        'TR' : (39.0, 35.2, 2.5, '+90', 2),
+        'ES' : (40.2, -3.7, 2.0, '+34', 5),
+        'HU' : (47.2, 19.4, 1.0, '+36', 1),
+        }
+
+collectionTypes = ['CASE_CONTROL', 'COHORT', 'DISEASE_SPECIFIC', 'POPULATION_BASED', 'PROSPECTIVE_COLLECTION', 'HOSPITAL', 'RARE_DISEASE', 'BIRTH_COHORT', 'LONGITUDINAL', 'SAMPLE']
+materials = ['DNA', 'RNA', 'SERUM', 'PLASMA', 'WHOLE_BLOOD', 'BUFFY_COAT', 'PERIPHERAL_BLOOD_CELLS', 'TISSUE_FROZEN', 'TISSUE_PARAFFIN_EMBEDDED', 'SALIVA', 'URINE', 'FECES', 'CELL_LINES']
+dataCategories = ['BIOLOGICAL_SAMPLES', 'MEDICAL_RECORDS', 'SURVEY_DATA', 'IMAGING_DATA', 'PHYSIOLOGICAL_BIOCHEMICAL_MEASUREMENTS', 'GENEALOGICAL_RECORDS', 'OTHER']
+# DUO terms of the data use conditions: disease specific, health/medical, general research use, data return, ethics approval, joint project
+dataUse = ['DUO:0000007', 'DUO:0000006', 'DUO:0000042', 'DUO:0000029', 'DUO:0000021', 'DUO:0000020']
+capabilities = ['biobanking', 'sample_processing', 'sample_storage', 'data_storage', 'genotyping', 'sequencing']
+# ICD-10 chapters (letter, first and last block) weighted by their frequency in the collections - mostly cancer
+icd10Chapters = [('C', 0, 97, 10), ('D', 0, 89, 3), ('E', 0, 89, 2), ('I', 0, 99, 2), ('J', 0, 99, 1), ('K', 0, 95, 1), ('G', 0, 99, 1), ('F', 0, 99, 1), ('M', 0, 99, 1), ('Q', 0, 99, 1), ('Z', 0, 99, 1)]
+icd10Ranges = ['C00-C97', 'C00-C14', 'C15-C26', 'C81-C96', 'D00-D09', 'E65-E68']
+orphaCodes = [558, 586, 98896, 399, 803, 774, 1331, 2048, 3389, 90117, 231214, 79318, 284963, 217604, 166024]
+# MIABIS age ranges of the facts (id, label)
+ageRanges = [('Child', 'Child (2-12 years)'), ('Adolescent', 'Adolescent (13-17 years)'), ('Young Adult', 'Young Adult (18-24 years)'), ('Adult', 'Adult (25-44 years)'),
+        ('Middle-aged', 'Middle-aged (45-64 years)'), ('Aged (65-79 years)', 'Aged (65-79 years)'), ('Aged (>80 years)', 'Aged (>80 years)')]
+firstNames = ['Anna', 'Jan', 'Maria', 'Peter', 'Eva', 'Marco', 'Sophie', 'Lukas', 'Elena', 'Tomas', 'Laura', 'Jonas', 'Ana', 'Mikko', 'Ingrid', 'Pavel']
+lastNames = ['Novak', 'Muller', 'Rossi', 'Jansen', 'Nowak', 'Svensson', 'Dubois', 'Papadopoulos', 'Virtanen', 'Horvat', 'Smith', 'Berg', 'Kaya', 'Ozols', 'Borg', 'Peeters']
+institutions = ['University Hospital', 'Medical University', 'Cancer Institute', 'Research Centre', 'Children\'s Hospital', 'National Institute of Health', 'Faculty of Medicine']
+
+
+class SyntheticDirectory:
+
+    def __init__(self, scale : float = 1.0, biobanks : int = None, networks : int = None, collectionsPerBiobank : int = 3, depth : int = 2, subCollections : int = 3,
+            subCollectionRate : float = 0.3, factsRate : float = 0.2, factsPerCollection : int = 8, withdrawnRate : float = 0.02, seed : int = 1):
+        # scale multiplies the size of the production Directory unless the numbers of biobanks/networks are given; each biobank has
+        # 1 to 2*collectionsPerBiobank-1 top-level collections, a collection has 1 to subCollections sub-collections with subCollectionRate
+        # probability down to depth levels of nesting, factsRate of the collections have 1 to 2*factsPerCollection-1 facts
+        self.__random = random.Random(seed)
+        self.__collectionsPerBiobank = collectionsPerBiobank
+        self.__depth = depth
+        self.__subCollections = subCollections
+        self.__subCollectionRate = subCollectionRate
+        self.__factsRate = factsRate
+        self.__factsPerCollection = factsPerCollection
+        self.__withdrawnRate = withdrawnRate
+        self.biobanks = []
+        self.collections = []
+        self.contacts = []
+        self.networks = []
+        self.facts = []
+        self.__countryCounters = {}
+
+        start_time = time.perf_counter()
+        biobanksCount = biobanks if biobanks is not None else max(1, round(baseBiobanks * scale))
+        networksCount = networks if networks is not None else max(1, round(baseNetworks * scale))
+        countryList = list(countries)
+        countryWeights = [countries[c][4] for c in countryList]
+        for i in range(networksCount):
+            self.__generateNetwork(self.__random.choice(countryList + ['EU']))
+        for i in range(biobanksCount):
+            self.__generateBiobank(self.__random.choices(countryList, countryWeights)[0])
+        # the references expanded by MOLGENIS (see Directory.entityFetchList) carry the scalar attributes of the referenced rows
+        Directory.resolveReferences(self.entities(), { entityKey : [a for a in entityArgs.get('expand', '').split(',') if a] for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList })
+        end_time = time.perf_counter()
+        log.info('Generated ' + str(len(self.biobanks)) + ' biobanks, ' + str(len(self.collections)) + ' collections, ' + str(len(self.contacts)) + ' contacts, ' +
+                str(len(self.networks)) + ' networks and ' + str(len(self.facts)) + ' facts in ' + "%0.3f" % (end_time-start_time) + 's')
+
+    def entities(self) -> dict:
+        return { 'biobanks' : self.biobanks, 'collections' : self.collections, 'contacts' : self.contacts, 'networks' : self.networks, 'facts' : self.facts }
+
+    def __nextID(self, country : str, kind : str) -> int:
+        self.__countryCounters[(country, kind)] = self.__countryCounters.get((country, kind), 0) + 1
+        return self.__countryCounters[(country, kind)]
+
+    def __acronym(self) -> str:
+        return ''.join(self.__random.choices(string.ascii_uppercase, k=self.__random.randint(3, 5)))
+
+    def __generateContact(self, country : str, domain : str) -> dict:
+        (firstName, lastName) = (self.__random.choice(firstNames), self.__random.choice(lastNames))
+        contact = {
+                'id' : 'bbmri-eric:contactID:' + country + '_' + str(self.__nextID(country, 'contact')),
+                'first_name' : firstName,
+                'last_name' : lastName,
+                'email' : firstName.lower() + '.' + lastName.lower() + '@' + domain,
+                'phone' : countries[country][3] + str(self.__random.randint(100000000, 999999999)) if country in countries else '+3225000000',
+                'country' : { 'id' : country },
+                'biobanks' : [],
+                'collections' : [],
+                'networks' : [],
+                }
+        self.contacts.append(contact)
+        return contact
+
+    def __generateNetwork(self, country : str):
+        acronym = self.__acronym()
+        network = {
+                'id' : 'bbmri-eric:networkID:' + country + '_' + acronym + str(self.__nextID(country, 'network')),
+                'name' : 'Network ' + acronym,
+                'acronym' : acronym,
+                'description' : 'Synthetic network of biobanks and collections for load testing',
+                'country' : { 'id' : country },
+                }
+        contact = self.__generateContact(country, acronym.lower() + '.example.eu')
+        network['contact'] = { 'id' : contact['id'] }
+        contact['networks'].append({ 'id' : network['id'] })
+        self.networks.append(network)
+
+    def __generateBiobank(self, country : str):
+        (latitude, longitude, spread, phonePrefix, weight) = countries[country]
+        acronym = self.__acronym()
+        institution = self.__random.choice(institutions)
+        domain = acronym.lower() + '.example.' + country.lower()
+        biobank = {
+                'id' : 'bbmri-eric:ID:' + country + '_' + acronym + str(self.__nextID(country, 'biobank')),
+                'name' : 'Biobank of the ' + institution + ' ' + acronym,
+                'acronym' : acronym,
+                'description' : 'Synthetic biobank of the ' + institution + ' ' + acronym + ' for load testing of the Directory tools',
+                'juridical_person' : institution + ' ' + acronym,
+                'country' : { 'id' : country },
+                'url' : 'https://www.' + domain + '/biobank',
+                'capabilities' : [{ 'id' : c } for c in self.__random.sample(capabilities, self.__random.randint(1, 3))],
+                'network' : [],
+                'collections' : [],
+                'collaboration_commercial' : self.__random.random() < 0.4,
+                'collaboration_non_for_profit' : self.__random.random() < 0.95,
+                'withdrawn' : self.__random.random() < self.__withdrawnRate,
+                'head_firstname' : self.__random.choice(firstNames),
+                'head_lastname' : self.__random.choice(lastNames),
+                'head_role' : 'Head of the biobank',
+                }
+        if self.__random.random() < 0.8:
+            biobank['latitude'] = "%0.4f" % (latitude + self.__random.uniform(-spread, spread))
+            biobank['longitude'] = "%0.4f" % (longitude + self.__random.uniform(-spread, spread))
+        contact = self.__generateContact(country, domain)
+        biobank['contact'] = { 'id' : contact['id'] }
+        contact['biobanks'].append({ 'id' : biobank['id'] })
+        # the membership is given by the network attribute of the biobanks and collections only (the network graph of Directory
+        # would report the members listed by the networks as missing edges)
+        for network in self.__random.sample(self.networks, min(len(self.networks), self.__random.choice([0, 0, 1, 1, 2]))):
+            biobank['network'].append({ 'id' : network['id'] })
+        self.biobanks.append(biobank)
+        for k in range(self.__random.randint(1, 2 * self.__collectionsPerBiobank - 1)):
+            self.__generateCollection(biobank, contact, None, biobank['id'] + ':collection:' + self.__acronym() + str(k + 1), self.__size(6.0), 0)
+
+    def __size(self, magnitude : float) -> int:
+        # log-normally distributed numbers of samples, median around 10^(magnitude/2)
+        return max(1, int(10 ** self.__random.gauss(magnitude / 2, 1.0)))
+
+    def __diagnoses(self) -> list:
+        diagnoses = []
+        for i in range(self.__random.choice([0, 1, 1, 1, 2, 3, 5])):
+            r = self.__random.random()
+            if r < 0.1:
+                diagnoses.append('urn:miriam:icd:' + self.__random.choice(icd10Ranges))
+            elif r < 0.75:
+                (letter, first, last, weight) = self.__random.choices(icd10Chapters, [c[3] for c in icd10Chapters])[0]
+                code = letter + "%02d" % self.__random.randint(first, last)
+                if self.__random.random() < 0.3:
+                    code += '.' + str(self.__random.randint(0, 9))
+                diagnoses.append('urn:miriam:icd:' + code)
+            else:
+                diagnoses.append('ORPHA:' + str(self.__random.choice(orphaCodes)))
+        return sorted(set(diagnoses))
+
+    def __generateCollection(self, biobank : dict, biobankContact : dict, parent : dict, collectionID : str, size : int, level : int):
+        country = biobank['country']['id']
+        contact = biobankContact if self.__random.random() < 0.7 else self.__generateContact(country, biobankContact['email'].split('@')[1])
+        (ageLow, ageHigh) = sorted(self.__random.sample(range(0, 100), 2))
+        collection = {
+                'id' : collectionID,
+                'name' : 'Collection ' + collectionID.split(':')[-1] + ' of ' + biobank['acronym'],
+                'description' : 'Synthetic collection for load testing of the Directory tools',
+                'biobank' : { 'id' : biobank['id'] },
+                'contact' : { 'id' : contact['id'] },
+                'country' : { 'id' : country },
+                'type' : [{ 'id' : t } for t in self.__random.sample(collectionTypes, self.__random.randint(1, 2))],
+                'materials' : [{ 'id' : m } for m in self.__random.sample(materials, self.__random.randint(1, 4))],
+                'data_categories' : [{ 'id' : 'BIOLOGICAL_SAMPLES' }] + [{ 'id' : d } for d in self.__random.sample(dataCategories[1:], self.__random.randint(0, 2))],
+                'diagnosis_available' : [{ 'id' : d } for d in self.__diagnoses()],
+                'order_of_magnitude' : { 'id' : min(9, int(math.log10(size))) },
+                'sex' : [{ 'id' : s } for s in self.__random.sample(['FEMALE', 'MALE'], self.__random.randint(1, 2))],
+                'age_low' : ageLow,
+                'age_high' : ageHigh,
+                'age_unit' : [{ 'id' : 'YEAR' }],
+                'data_use' : [{ 'id' : d } for d in self.__random.sample(dataUse, self.__random.randint(1, 4))],
+                'network' : [{ 'id' : n['id'] } for n in self.__random.sample(self.networks, min(len(self.networks), self.__random.choice([0, 0, 0, 1])))] + list(biobank['network']),
+                'sub_collections' : [],
+                'facts' : [],
+                'withdrawn' : biobank['withdrawn'],
+                }
+        if self.__random.random() < 0.8:
+            collection['sample_access_description'] = 'Samples are available upon request to the biobank'
+            collection['sample_access_fee'] = self.__random.random() < 0.5
+        if self.__random.random() < 0.6:
+            collection['data_access_description'] = 'Data are available upon request to the biobank'
+        # some collections provide only the order of magnitude
+        if self.__random.random() < 0.7:
+            collection['size'] = size
+        if self.__random.random() < 0.5:
+            donors = max(1, int(size * self.__random.uniform(0.2, 1.0)))
+            collection['number_of_donors'] = donors
+            collection['order_of_magnitude_donors'] = { 'id' : min(9, int(math.log10(donors))) }
+        if parent is not None:
+            collection['parent_collection'] = { 'id' : parent['id'] }
+            parent['sub_collections'].append({ 'id' : collectionID })
+        biobank['collections'].append({ 'id' : collectionID })
+        contact['collections'].append({ 'id' : collectionID })
+        self.collections.append(collection)
+        if self.__random.random() < self.__factsRate:
+            self.__generateFacts(collection, size)
+        if level < self.__depth and self.__random.random() < self.__subCollectionRate:
+            children = self.__random.randint(1, self.__subCollections)
+            for k in range(children):
+                self.__generateCollection(biobank, contact, collection, collectionID + '-' + str(k + 1), max(1, size // children), level + 1)
+
+    def __generateFacts(self, collection : dict, size : int):
+        # the facts split the samples of the collection by sample type, diagnosis, sex and age range of the collection
+        count = self.__random.randint(1, 2 * self.__factsPerCollection - 1)
+        shares = [self.__random.random() for i in range(count)]
+        for (k, share) in enumerate(shares):
+            fact = {
+                    'id' : collection['id'] + ':fact:' + str(k + 1),
+                    'collection' : { 'id' : collection['id'] },
+                    'sample_type' : { 'id' : self.__random.choice(collection['materials'])['id'] },
+                    'sex' : { 'id' : self.__random.choice(collection['sex'])['id'] },
+                    'age_range' : dict(zip(('id', 'label'), self.__random.choice(ageRanges))),
+                    'number_of_samples' : max(1, round(size * share / sum(shares))),
+                    }
+            if collection['diagnosis_available']:
+                fact['disease'] = { 'id' : self.__random.choice(collection['diagnosis_available'])['id'] }
+            if 'number_of_donors' in collection:
+                fact['number_of_donors'] = max(1, round(collection['number_of_donors'] * share / sum(shares)))
+            collection['facts'].append({ 'id' : fact['id'] })
+            self.facts.append(fact)
+
+    # write the entities as a snapshot directory that can be loaded using Directory(snapshot=...), in JSON, JSON lines or EMX (CSV files
+    # named by the package) format
+    def writeSnapshot(self, path : str, jsonLines : bool = False, emx : bool = False, package : str = 'eu_bbmri_eric'):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # files of the other formats would take precedence or be ambiguous
+        for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+            for name in [entityKey, package + entitySuffix]:
+                for ext in ['.json', '.jsonl', '.csv', '.tsv']:
+                    if os.path.exists(os.path.join(path, name + ext)):
+                        os.remove(os.path.join(path, name + ext))
+        if emx:
+            Directory.writeEMXSnapshot(path, package, self.entities())
+            return
+        for (entityKey, entityList) in self.entities().items():
+            with open(os.path.join(path, entityKey + ('.jsonl' if jsonLines else '.json')), 'w', encoding='utf-8') as f:
+                if jsonLines:
+                    for e in entityList:
+                        f.write(json.dumps(e, ensure_ascii=False) + '\n')
+                else:
+                    json.dump(entityList, f, ensure_ascii=False)
+        log.info('Synthetic directory snapshot written to ' + path)
+
+    # store the entities in the directory cache of the given MOLGENIS URL and package as if they had been retrieved using the full
+    # fetch profile - Directory(directoryURL=..., package=...) then loads them without contacting the server (unless run with deltaSync)
+    def writeCache(self, directoryURL : str, package : str = 'eu_bbmri_eric') -> str:
+        namespace = 'directory/' + Directory.cacheNamespace(directoryURL, package)
+        with caches.openCache(namespace, purge=True) as cache:
+            for (entityKey, entitySuffix, entityArgs) in Directory.entityFetchList:
+                cache[entityKey] = self.entities()[entityKey]
+                cache['args:' + entityKey] = entityArgs
+        log.info('Synthetic directory written to cache ' + namespace)
+        return namespace